@@ -1,5 +1,6 @@
 import subprocess
-import json
+from boardInventory import board_inventory
+from coreIndex import core_index, platform_id
 from logger_config import setup_logger
 
 logger = setup_logger(__name__)
@@ -9,87 +10,41 @@ def run_cli_command(command):
     try:
         result = subprocess.run(command, capture_output=True, text=True, check=True)
         return result.stdout
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, OSError) as e:  # OSError: arduino-cli is not installed
         logger.info(f"Command failed: {e}")
         return None
 
 
-# function to get available arduino boards using arduino-cli
-def get_arduino_boards():
-    command = ["arduino-cli", "board", "list", "--format", "json"]
-
-    output = run_cli_command(command)
-
-    if output:
-
-        try:
-            # parse the output as JSON
-            boards_info = json.loads(output)
-            logger.info(f'boards_info: {boards_info}')
-            arduino_ports = []
-
-            for board in boards_info.get("detected_ports", []):
-                if "matching_boards" in board and board["matching_boards"]:
-                    port = board.get("port", {}).get("address", "Unknown Port")
-                    board_name = board["matching_boards"][0].get("name", "Unknown Board")
-                    arduino_ports.append((port, board_name))
-
-            # hypothetical handling for network-based boards
-            for network_board in boards_info.get("network_ports", []):
-                if "matching_boards" in network_board and network_board["matching_boards"]:
-                    port = network_board.get("port", {}).get("address", "Unknown Network Port")
-                    board_name = network_board["matching_boards"][0].get("name", "Unknown Board")
-                    arduino_ports.append((port, board_name))
-
-            logger.info(f'arduino_ports: {arduino_ports}')
-            return arduino_ports
-        except json.JSONDecodeError:
-            logger.info("Error parsing arduino-cli board list output")
-            return []
-    return []
+# function to get available arduino boards using arduino-cli; refresh=True lists them again even if the
+# shared board inventory still holds a recent list
+def get_arduino_boards(refresh=False):
+    boards = board_inventory.get_boards(run_cli_command, refresh)
+    arduino_ports = [(board['port'], board['name']) for board in boards]
+    logger.info(f'arduino_ports: {arduino_ports}')
+    return arduino_ports
 
 
 def detect_board(port):
-    command = ["arduino-cli", "board", "list", "--format", "json"]
-    output = run_cli_command(command)
-
-    if output:
-        boards_info = json.loads(output)
-        for board in boards_info.get("detected_ports", []):
-            if board["port"]["address"] == port:
-                if "matching_boards" in board and board["matching_boards"]:
-                    fqbn = board["matching_boards"][0].get("fqbn", None)
-                    if fqbn:
-                        logger.info(f"Detected FQBN: {fqbn}")
-                        return fqbn
-                    else:
-                        logger.warning(f"No FQBN found for board on port {port}")
-                        return None
-    return None
+    fqbn = board_inventory.fqbn(port, run_cli_command)
+    if fqbn:
+        logger.info(f"Detected FQBN: {fqbn}")
+    else:
+        logger.warning(f"No FQBN found for board on port {port}")
+    return fqbn
 
 
+# answered from the installed-core index, which only runs 'core list' at startup and after an install
 def is_core_installed(fqbn):
-    core_name = fqbn.split(":")[0]
-    command = ["arduino-cli", "core", "list"]
-    output = run_cli_command(command)
-
-    if output:
-        installed_cores = output.splitlines()
-        for core in installed_cores:
-            if core_name in core:
-                logger.info(f"Core {core_name} is already installed.")
-                return True
+    if core_index.is_installed(fqbn, run_cli_command):
+        logger.info(f"Core {platform_id(fqbn)} is already installed.")
+        return True
     return False
 
 
+# installs through the installed-core index, which also updates the compile cache
 def install_core_if_needed(fqbn):
-    core_name = fqbn.split(":")[0]
-    if not is_core_installed(fqbn):
-        logger.info(f"Core {core_name} not installed. Installing...")
-        command = ["arduino-cli", "core", "install", core_name]
-        run_cli_command(command)
-    else:
-        logger.info(f"Core {core_name} is already installed.")
+    if not core_index.install_if_needed(fqbn, run_cli_command):
+        logger.info(f"Core {platform_id(fqbn)} is already installed.")
 
 
 def compile_sketch(fqbn, sketch_path):
@@ -0,0 +1,340 @@
+import json
+import logging
+import os
+import re
+import sys
+import time
+from responseDispatcher import ResponseDispatcher
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests')
+
+# usage: python benchmarks.py [name ...]   (runs all benchmarks when no name is given)
+
+# representative mix of control board output during a running test
+SAMPLE_RESPONSES = [
+    '{"ping_response":{"alive":true,"timestamp":"2024-12-05T15:11:55","machine_state":"HEATING",'
+    '"current_temp":30.625,"test_status":{"is_test_running":true,"current_test":"alphabet_38",'
+    '"current_sequence":1,"desired_temp":35,"current_duration":60000,"time_left":37,"queued_tests":3}}}',
+    'Waiting for target temperature to be reached...',
+    'Setting temperature to 38.00°C',
+    'Running sequence: Target temp = 38.00°C Duration = 1 minutes',
+    'Target temperature reached! Starting timer.',
+    'Sequence completed.',
+    'Test completed: first_alphabet_low_temp',
+    '{"queue":{"tests":{"first_alphabet_low_temp":{"chamber_sequences":[{"temp":38,"duration":60000}],'
+    '"sketch":"./alphabets/alphabet/alphabet.ino","expected_output":"ABCDEFGHIJKLMNOPQRSTUVWXYZ"}}}}',
+    'RTC updated with initial timestamp from python app.',
+]
+
+
+# run fn over all lines repeatedly and return lines per second
+def lines_per_second(fn, lines, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for line in lines:
+            fn(line)
+    elapsed = time.perf_counter() - start
+    return len(lines) * repeat / elapsed
+
+
+# the if/elif chain process_response used before the dispatch table, with the signal emits left out
+def legacy_process_response(response):
+    clean_response = response.strip()
+    trigger_responses = ['Setting', 'Target temperature reached!']
+    if any(response.strip().startswith(trigger) for trigger in trigger_responses):
+        return 'setting'
+    elif 'Test completed:' in response.strip():
+        return 'test_completed'
+    elif response.strip().startswith('Waiting'):
+        return 'waiting'
+    elif response.strip().startswith('Sequence complete'):
+        return 'sequence_complete'
+    elif response.strip().startswith('All tests completed!'):
+        return 'all_tests_completed'
+    elif clean_response.startswith('{"ping_response"'):
+        return json.loads(clean_response)['ping_response']
+    elif clean_response.startswith('{"handshake"'):
+        return json.loads(clean_response)
+    elif 'queue' in response.strip():
+        return json.loads(response)['queue']
+    return None
+
+
+# classification throughput of process_response: legacy chain vs dispatch table
+def bench_dispatch(repeat=20000):
+    ignore = lambda _: None
+    text_handlers = {name: ignore for name in
+                     ('setting', 'test_completed', 'waiting', 'sequence_complete', 'all_tests_completed')}
+    json_handlers = {key: ignore for key in ('ping_response', 'queue', 'handshake')}
+    dispatcher = ResponseDispatcher(text_handlers, json_handlers, ignore, json_hook=lambda key, payload: False)
+
+    before = lines_per_second(legacy_process_response, SAMPLE_RESPONSES, repeat)
+    after = lines_per_second(dispatcher.dispatch, SAMPLE_RESPONSES, repeat)
+    print(f'process_response  before: {before:12,.0f} lines/s')
+    print(f'process_response  after:  {after:12,.0f} lines/s  ({after / before:.2f}x)')
+
+
+# what TestBoardWorker.extract_deterministic_part did per line before the compiled matchers; the log calls
+# are kept but go to a logger without output, so file and console writes are not counted
+LEGACY_LOGGER = logging.getLogger('benchmarks.legacy_matcher')
+LEGACY_LOGGER.addHandler(logging.NullHandler())
+LEGACY_LOGGER.propagate = False
+LEGACY_LOGGER.setLevel(logging.DEBUG)
+
+
+def legacy_extract_deterministic_part(test_data, test_number, message):
+    all_tests = [key for key in test_data['tests'].keys()]
+    test = test_data['tests'][all_tests[test_number]]
+    LEGACY_LOGGER.info(test)
+    expected_pattern = test.get('expected_output', '')
+    if '***' in expected_pattern:
+        regex_pattern = re.escape(expected_pattern).replace(r'\*\*\*', '(.*)')
+    else:
+        regex_pattern = expected_pattern
+    regex_pattern = f'^{regex_pattern}$'
+    LEGACY_LOGGER.debug(f'Encoding pattern: {regex_pattern}')
+    LEGACY_LOGGER.debug(f'Getting expected pattern: {regex_pattern}')
+    match = re.match(regex_pattern, message)
+    LEGACY_LOGGER.debug('About to search for matches')
+    if match:
+        if '(.*)' in regex_pattern:
+            non_deterministic_part = match.group(1) if match.lastindex is not None else ''
+            deterministic_output = "".join(re.split(r'\(\.\*\)', regex_pattern))
+            if non_deterministic_part:
+                LEGACY_LOGGER.info(f'Non-deterministic output: {non_deterministic_part}')
+            LEGACY_LOGGER.debug(f'Deterministic_output: {deterministic_output}')
+            return deterministic_output
+        LEGACY_LOGGER.debug(f'Fully deterministic match: {message}')
+        return message
+    LEGACY_LOGGER.debug(f'No matches found, the message is: {message}')
+    return message
+
+
+# per-line verification of test board output: regex rebuilt per line vs a matcher compiled once per test
+def bench_matcher(repeat=20000):
+    from outputMatcher import BlockMatcher, OutputMatcher
+
+    cases = {
+        'deterministic': ('ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+                          ['ABCDEFGHIJKLMNOPQRSTUVWXYZ'] * 9 + ['ABCDEFGHIJKLMNOPQRSTUVWXYQ']),
+        'wildcard': ('Temperature: *** C, uptime *** ms',
+                     ['Temperature: 38.25 C, uptime 120034 ms'] * 9 + ['Temperature: error']),
+    }
+    for name, (expected, lines) in cases.items():
+        test_data = {'tests': {'bench': {'expected_output': expected}}}
+        matcher = OutputMatcher(expected)
+        before = lines_per_second(lambda line: legacy_extract_deterministic_part(test_data, 0, line), lines, repeat)
+        after = lines_per_second(matcher.matches, lines, repeat)
+        print(f'{name:<14} before: {before:12,.0f} lines/s')
+        print(f'{name:<14} after:  {after:12,.0f} lines/s  ({after / before:.1f}x)')
+
+    # a three-line expected output streamed through the block matcher, one block in ten broken
+    block = BlockMatcher('Sensor check\nTemperature: *** C\nDone')
+    lines = ['Sensor check', 'Temperature: 38.25 C', 'Done'] * 9 + ['Sensor check', 'Temperature: error', 'Done']
+    streamed = lines_per_second(block.feed_line, lines, repeat)
+    tally = {}
+    for line in lines:
+        verdict = block.feed_line(line)
+        if verdict:
+            tally[verdict['verdict']] = tally.get(verdict['verdict'], 0) + 1
+    print(f'{"multi-line":<14} stream: {streamed:12,.0f} lines/s  (verdicts per 10 blocks: {tally})')
+
+
+# soak run of a whole test plan through SerialCaptureWorker against the simulated control board
+def bench_control_board(plan='45C_12h/45C_12h.json', speed=1000, telemetry_format='binary'):
+    from PyQt5.QtCore import QCoreApplication
+    from controlBoardSimulator import ControlBoardSimulator
+    from serialCaptureWorker import SerialCaptureWorker
+
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+    with open(os.path.join(TESTS_DIR, plan)) as f:
+        test_data = json.load(f)
+    simulator = ControlBoardSimulator(speed=speed)
+    worker = SerialCaptureWorker(simulator.start(), telemetry_format=telemetry_format)
+    done = []
+    states = []
+    worker.alert_all_tests_complete_signal.connect(lambda: done.append(time.monotonic()))
+    worker.machine_state_signal.connect(states.append)
+
+    # run the qt event loop until condition() holds or timeout seconds have passed
+    def spin(condition, timeout):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            app.processEvents()
+            time.sleep(0.005)
+        return condition()
+
+    try:
+        worker.start()
+        if not spin(lambda: worker.handshake_done, 10):
+            print('control board simulator did not answer the handshake')
+            return
+        worker.add_to_test_queue(test_data)
+        spin(lambda: worker.test_queue.fed and not worker.queue_upload, 10)
+        started = time.monotonic()
+        worker.run_tests()
+        planned_ms = sum(sequence['duration'] for test in test_data['tests'].values()
+                         for sequence in test['chamber_sequences'])
+        finished = spin(lambda: done, planned_ms / 1000 / speed * 2 + 60)
+        elapsed = time.monotonic() - started
+        simulated_hours = simulator.sim_ms / 3.6e6
+        print(f'plan {plan}: {"completed" if finished else "NOT completed"} in {elapsed:.1f} s '
+              f'({simulated_hours:.2f} simulated h at {speed:g}x)')
+        print(f'status updates: {len(states)} ({len(states) / elapsed:.0f}/s), '
+              f'control board lines out/in: {simulator.lines_sent}/{simulator.lines_received}')
+        backlog = worker.backlog.snapshot()
+        print(f'response backlog: peak depth {backlog["peak_depth"]} lines, '
+              f'peak age {backlog["peak_age_ms"]:.1f} ms')
+    finally:
+        worker.stop()
+        simulator.stop()
+
+
+# percentile of an already sorted list
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+# test board lines through TestBoardWorker into MainWindow.on_output_summary: throughput, losses and verdict latency
+def bench_test_board(rate=2000, count=10000, burst=50, incorrect=0.05, corrupt=0.01):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')  # the main window is built but never shown
+    from PyQt5.QtWidgets import QApplication
+    from main import MainWindow
+    from portBroker import PortBroker
+    from testBoardSimulator import TestBoardSimulator
+    from testBoardWorker import TestBoardWorker
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = MainWindow()
+    simulator = TestBoardSimulator(line_rate=rate, burst=burst, incorrect_rate=incorrect, corrupt_rate=corrupt,
+                                   seed=1)
+    window.test_data = {'tests': {'bench': {'expected_output': simulator.line}}}
+    window.test_number = 0
+    window.test_is_running = True
+    broker = PortBroker()  # the port goes through the broker as in the app
+    device = simulator.open()
+    worker = TestBoardWorker(window.test_data, 0, port=device, baudrate=9600, broker=broker)
+    verdicts = []  # time each line's verdict has reached the gui, through the summary that counted it
+    summaries = []
+
+    def on_summary(summary):
+        verdicts.extend([time.monotonic()] * summary['new_lines'])
+        summaries.append(summary)
+
+    worker.output_summary.connect(window.on_output_summary)
+    worker.output_summary.connect(on_summary)
+    listed_before = window.listbox.count()  # on_output_summary adds a red line per summary with mismatches
+
+    # run the qt event loop until condition() holds or timeout seconds have passed
+    def spin(condition, timeout):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            app.processEvents()
+            time.sleep(0.001)
+        return condition()
+
+    try:
+        worker.start()
+        if not spin(lambda: device in broker.ports and broker.ports[device].ready.is_set(), 10):
+            print('test board worker did not open the simulator port')
+            return
+        cpu_started = time.process_time()
+        simulator.start(count)
+        spin(lambda: not simulator.thread.is_alive(), count / rate * 2 + 30)
+        # let the pipeline drain: done once every line is through or none came in for a second
+        while len(verdicts) < len(simulator.sent):
+            before = len(verdicts)
+            if not spin(lambda: len(verdicts) > before, 1):
+                break
+        cpu = time.process_time() - cpu_started
+    finally:
+        worker.stop()
+        broker.close_all()
+        simulator.stop()
+
+    sent = simulator.sent
+    if not verdicts:
+        print('no verdict reached the gui')
+        return
+    elapsed = verdicts[-1] - sent[0][0]
+    latencies = sorted((verdict - sent_at) * 1000 for verdict, (sent_at, _) in zip(verdicts, sent))
+    lost = simulator.dropped + len(sent) - len(verdicts)
+    flagged = summaries[-1]['failed']
+    listed = window.listbox.count() - listed_before
+    wrong = sum(1 for _, correct in sent if not correct)
+    print(f'offered {count} lines at {rate:g} lines/s in bursts of {burst} ({len(simulator.line)} chars)')
+    print(f'sustained: {len(verdicts) / elapsed:,.0f} lines/s, dropped: {lost} '
+          f'({simulator.dropped} at the port, {len(sent) - len(verdicts)} in the app)')
+    print(f'verdict latency ms: p50 {percentile(latencies, 0.5):.1f}  p99 {percentile(latencies, 0.99):.1f}  '
+          f'max {latencies[-1]:.1f}')
+    print(f'incorrect lines delivered: {wrong}, flagged: {flagged} ({listed} entries in the listbox)')
+    print(f'gui updates: {len(summaries)} ({len(summaries) / elapsed:.1f}/s) for {len(verdicts)} lines')
+    print(f'worker framed {worker.scanner.lines} lines, {worker.scanner.bytes:,} bytes; '
+          f'cpu {cpu / elapsed:.0%} of one core for the whole app')
+
+
+# recorded session fed at full speed through the app's parsers: process_response for the control board
+# (the port the app wrote the most to) and TestBoardWorker.check_response for every other port
+def bench_replay(path=None, expected='ABCDEFGHIJKLMNOPQRSTUVWXYZ'):
+    import telemetry
+    from serialCaptureWorker import SerialCaptureWorker
+    from serialReader import LineFramer
+    from sessionCapture import SessionReplay, latest_capture
+    from testBoardWorker import TestBoardWorker
+
+    path = path or latest_capture()
+    if not path:
+        print('no capture to replay, record a session first (record_sessions in config.json)')
+        return
+    replay = SessionReplay(path)
+    totals, span = replay.summary()
+    sent = {port: size for (port, direction), size in totals.items() if direction == 'tx'}
+    control_port = max(sent, key=sent.get) if sent else None
+    test_data = {'tests': {'replay': {'expected_output': expected}}}
+    framers = {}
+    parsers = {}
+    counts = {}
+    for port in {port for port, _ in totals}:
+        if port == control_port:
+            framers[port] = LineFramer(frame_sync=telemetry.FRAME_SYNC, frame_size=telemetry.FRAME_SIZE,
+                                       frame_check=telemetry.is_valid_frame)
+            parsers[port] = SerialCaptureWorker(port).process_response
+        else:
+            framers[port] = LineFramer()
+            parsers[port] = TestBoardWorker(test_data, 0, port, 9600).check_response
+        counts[port] = 0
+
+    received = 0
+    start = time.perf_counter()
+    for port, payload in replay.play(speed=None):
+        received += len(payload)
+        parse = parsers[port]
+        items = framers[port].feed(payload)
+        for item in items:
+            parse(item)
+        counts[port] += len(items)
+    elapsed = time.perf_counter() - start
+    replay.close()
+    lines = sum(counts.values())
+    print(f'{path}: {span:.1f} s recorded, {received:,} bytes received')
+    for port, count in sorted(counts.items()):
+        role = 'process_response' if port == control_port else 'check_response'
+        print(f'  {port}: {count:,} lines through {role}')
+    print(f'replayed in {elapsed:.2f} s: {lines / elapsed:,.0f} lines/s, {received / elapsed / 1e6:.1f} MB/s '
+          f'({span / elapsed:,.0f}x real time)')
+
+
+BENCHMARKS = {
+    'dispatch': bench_dispatch,
+    'matcher': bench_matcher,
+    'control_board': bench_control_board,
+    'test_board': bench_test_board,
+    'replay': bench_replay,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f'--- {name}')
+        BENCHMARKS[name]()
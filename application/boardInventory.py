@@ -0,0 +1,85 @@
+import json
+import threading
+import time
+from serial.tools import list_ports
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+BOARD_TTL = 300  # seconds a board list is trusted while no port comes or goes
+BOARD_LIST = ['arduino-cli', 'board', 'list', '--format', 'json']
+
+
+# set of serial devices present right now; cheap to read, unlike 'arduino-cli board list'
+def port_signature():
+    return frozenset((port.device, port.hwid) for port in list_ports.comports())
+
+
+# the boards 'arduino-cli board list' found, kept until a serial device is plugged in or out or the ttl runs out;
+# one inventory is shared by the port selector, the cli workers and arduinoUtils
+class BoardInventory:
+
+    def __init__(self, ttl=BOARD_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.boards = None  # [{'port', 'name', 'fqbn', 'network'}] of the last board list
+        self.listed_at = 0.0
+        self.signature = None  # serial devices present at the last board list
+
+    # detected boards; run(command) runs arduino-cli and returns its stdout or None, called only when the
+    # cached list is stale; refresh=True always lists the boards again
+    def get_boards(self, run, refresh=False):
+        with self.lock:
+            signature = port_signature()
+            if not refresh and self.is_fresh(signature):
+                return self.boards
+            output = run(BOARD_LIST)
+            boards = parse_board_list(output)
+            if boards is None:
+                return self.boards or []  # the last known boards rather than none at all
+            if self.signature is not None and signature != self.signature:
+                logger.info('Serial devices changed: boards listed again')
+            self.boards, self.listed_at, self.signature = boards, time.monotonic(), signature
+            logger.info(f'Boards: {[(board["port"], board["fqbn"]) for board in boards]}')
+            return boards
+
+    # the cached list still holds: no serial device came or went and the ttl has not run out
+    def is_fresh(self, signature):
+        return (self.boards is not None and signature == self.signature
+                and time.monotonic() - self.listed_at < self.ttl)
+
+    # fqbn of the board on a port, None if no board there is recognised
+    def fqbn(self, port, run, refresh=False):
+        for board in self.get_boards(run, refresh):
+            if board['port'] == port and board['fqbn']:
+                return board['fqbn']
+        return None
+
+    # forget the boards, e.g. after a board was reflashed with another firmware
+    def invalidate(self):
+        with self.lock:
+            self.boards = None
+
+
+# boards from 'board list --format json' output, None if there is none to read
+def parse_board_list(output):
+    if not output:
+        return None
+    try:
+        boards_info = json.loads(output)
+    except ValueError:
+        logger.info('Error parsing arduino-cli board list output')
+        return None
+    boards = []
+    for key, network in (('detected_ports', False), ('network_ports', True)):
+        for board in boards_info.get(key, []) or []:
+            matching_boards = board.get('matching_boards') or []
+            if matching_boards:
+                boards.append({'port': board.get('port', {}).get('address', 'Unknown Port'),
+                               'name': matching_boards[0].get('name', 'Unknown Board'),
+                               'fqbn': matching_boards[0].get('fqbn'),
+                               'network': network})
+    return boards
+
+
+board_inventory = BoardInventory()
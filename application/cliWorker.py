@@ -1,12 +1,15 @@
 from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtWidgets import QMessageBox
 import subprocess
-import json
-import time
+import os
+import signal
 import serial
 from threading import Lock
 import threading
+from boardInventory import board_inventory
+from coreIndex import core_index, platform_id
 from logger_config import setup_logger
+from serialTransport import SerialTransport, STOP_TIMEOUT_MS
 
 logger = setup_logger(__name__)
 
@@ -18,13 +21,20 @@ class CliWorker(QThread):
     finished = pyqtSignal()  # signal to main when the thread's work is done
     update_upper_listbox = pyqtSignal(str)  # signal to update instruction listbox
     set_test_data_signal = pyqtSignal(dict, str, int)
+    cache_stats = pyqtSignal(dict)  # hit/miss counts of the compile cache after each lookup
 
-    def __init__(self, port, baudrate, timeout=5):
+    def __init__(self, port, baudrate, timeout=5, broker=None, compile_cache=None):
         super().__init__()
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
+        self.broker = broker  # owns the port when given, arduino-cli only borrows it for the upload
+        self.compile_cache = compile_cache  # builds shared between workers and sessions, if given
+        self.build_directory = None  # compiled sketch to upload, from the compile cache
+        self.transport = broker.subscribe(port, baudrate, 'cli worker') if broker else SerialTransport(port, baudrate)
         self.ser = None  # future serial connection object
+        self.stop_event = threading.Event()  # wakes the idle loop and keeps new cli commands from starting
+        self.process = None  # arduino-cli command in progress, killed by stop()
         self.is_open = True
         self.is_running = True  # flag to keep the thread running
         self.is_stopped = False  # flag to stop the read loop
@@ -32,7 +42,6 @@ class CliWorker(QThread):
         self.is_uploading = False
         self.is_compiling = False
         self.is_detecting = False
-        self.checking_core = False
         self.core_installed = False
         self.boards_are_there = False
         # class variables
@@ -50,10 +59,12 @@ class CliWorker(QThread):
         if baudrate:
             self.baudrate = baudrate
         try:
-            self.ser = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+            self.transport.port = self.port
+            self.transport.baudrate = self.baudrate
+            ready = self.transport.open(settle=1)  # make sure arduino is ready, unless stopped meanwhile
+            self.ser = self.transport.ser
             logger.info(f'CLI worker connected to arduino port: {self.port}')
-            time.sleep(1)  # make sure arduino is ready
-            return True
+            return ready and self.is_running  # stop() may have come before open() cleared the cancel
         except serial.SerialException as e:
             logger.error(f'Error: {e}')
             return False
@@ -61,7 +72,9 @@ class CliWorker(QThread):
     # core run method
     def run(self):
         if not self.serial_setup():
-            logger.error(f'CLI worker failed to connect to {self.port}')
+            if self.is_running:
+                logger.error(f'CLI worker failed to connect to {self.port}')
+            self.stop()
             return
         logger.info('CLI worker thread is running')
         # wrap the whole while-loop in a try-except statement to prevent crashes in case of system failure
@@ -76,7 +89,7 @@ class CliWorker(QThread):
                     self.wave(bye)
                     self.is_running = False
                     break
-                time.sleep(0.1)  # prevent jamming
+                self.stop_event.wait(0.1)  # prevent jamming
         except Exception as e:
             # catch any other unexpected exceptions
             logger.exception(f'Unexpected error: {e}')
@@ -98,79 +111,74 @@ class CliWorker(QThread):
     # method to stop the serial communication
     def stop(self):
         self.is_running = False  # Stop the worker thread loop
+        self.stop_event.set()
+        self.kill_cli_command()
+        self.transport.close()
         try:
-            if self.ser and self.ser.is_open:
-                self.ser.close()  # Close the serial connection
-                logger.info(f"Connection to {self.port} closed successfully.")
-        except serial.SerialException as e:
-            logger.error(f"Serial exception while closing connection to {self.port}: {e}")
+            self.quit()  # Gracefully terminate the thread
+            # stop() also runs at the end of run(), where the thread cannot wait for itself
+            if QThread.currentThread() is not self:
+                self.wait(STOP_TIMEOUT_MS)
+            logger.info("CLI Worker thread exited successfully.")
         except Exception as e:
-            logger.error(f"Unexpected error while closing connection to {self.port}: {e}")
-        finally:
-            try:
-                self.quit()  # Gracefully terminate the thread
-                self.wait()  # Ensure thread termination before cleanup
-                logger.info("CLI Worker thread exited successfully.")
-            except Exception as e:
-                logger.error(f"Error during thread termination: {e}")
-
-    # static method for running cli commands
-    @staticmethod
-    def run_cli_command(command):
+            logger.error(f"Error during thread termination: {e}")
+
+    # kill the arduino-cli command in progress, if any, including the uploader tools it started
+    def kill_cli_command(self):
+        process = self.process
+        if not process or process.poll() is not None:
+            return
+        logger.info(f'Killing arduino-cli command: {" ".join(process.args)}')
+        try:
+            if os.name == 'posix':
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except OSError as e:
+            logger.warning(f'Could not kill arduino-cli command: {e}')
+
+    # run a cli command; stop() kills it, so a long compile or upload never holds up shutdown
+    def run_cli_command(self, command):
         with cli_lock:
+            if self.stop_event.is_set():
+                return None
+            # own process group, so the whole command tree can be killed at once
+            self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                            start_new_session=(os.name == 'posix'))
             try:
-                result = subprocess.run(command, capture_output=True, text=True, check=True)
-                logger.info(f'[{threading.current_thread().name}] Command succeeded: {" ".join(command)}')
-
-                return result.stdout
-            except subprocess.CalledProcessError as e:
-                logger.info(f'Command failed: {e.stderr}')
+                stdout, stderr = self.process.communicate()
+            finally:
+                returncode = self.process.returncode
+                self.process = None
+            if returncode != 0:
+                logger.info(f'Command failed: {stderr}')
                 return None
+            logger.info(f'[{threading.current_thread().name}] Command succeeded: {" ".join(command)}')
+            return stdout
 
-    # detect test board
+    # detect test board; the board list is shared with the rest of the app and only run again once
+    # a serial device came or went
     def detect_board(self, port):
         # if self.is_detecting:
         #     logger.warning('Boards already detected: skipping new detect request')
         #     return
 
-        command = ["arduino-cli", "board", "list", "--format", "json"]
-        output = self.run_cli_command(command)
-        if not output:
-            return None
-
         headsup = 'Detecting test board...'
         self.wave(headsup)
-        boards_info = json.loads(output)
-        for board in boards_info.get("detected_ports", []):
-            if board["port"]["address"] == port:
-                matching_boards = board.get("matching_boards", [])
-                if matching_boards:
-                    fqbn = matching_boards[0].get("fqbn", None)
-                    if fqbn:
-                        logger.info(f'Detected fqbn: {fqbn} for port {port}')
-                        return fqbn
+        fqbn = board_inventory.fqbn(port, self.run_cli_command)
+        if fqbn:
+            logger.info(f'Detected fqbn: {fqbn} for port {port}')
+            return fqbn
         logger.warning(f'No board detected on port {port}')
         return None
 
-    # check if core is installed on test board
+    # check if core is installed on test board; answered from the installed-core index, which only
+    # runs 'core list' at startup and after an install
     def is_core_installed(self, fqbn):
-        if self.checking_core:
-            logger.warning('Checking core already: skipping new check core request')
-            return
-
-        core_name = fqbn.split(":")[0]
-        command = ["arduino-cli", "core", "list"]
-        output = self.run_cli_command(command)
-
-        if not output:
-            return False
-
-        self.checking_core = True
-        installed_cores = output.splitlines()
-        for core in installed_cores:
-            if core_name in core:
-                logger.info(f'Core {core_name} is already installed.')
-                return True
+        if core_index.is_installed(fqbn, self.run_cli_command):
+            logger.info(f'Core {platform_id(fqbn)} is already installed.')
+            return True
+        return False
 
     # install core on test board, if necessary
     def install_core_if_needed(self, fqbn):
@@ -178,22 +186,45 @@ class CliWorker(QThread):
             logger.warning('Core already installed: skipping new core install request')
             return
 
-        core_name = fqbn.split(":")[0]
-
         if not self.is_core_installed(fqbn):
             self.core_installed = True
-            logger.info(f'Core {core_name} not installed. installing...')
             update = 'Installing core on test board'
             self.wave(update)
-            command = ["arduino-cli", "core", "install", core_name]
-            self.run_cli_command(command)
+            core_index.install_if_needed(fqbn, self.run_cli_command)  # also updates the compile cache
 
-    # compile sketch before upload
+    # compile sketch before upload; a build found in the compile cache is used as it is
     def compile_sketch(self, fqbn, sketch_path):
         if self.is_compiling:
             logger.warning('Compiling already: skipping new compile request')
             return
 
+        key = None
+        if self.compile_cache:
+            key = self.compile_cache.key(fqbn, sketch_path, self.run_cli_command)
+            waiting = False
+            while True:
+                if self.compile_cache.is_pending(key) and not waiting:
+                    self.wave('Waiting for the sketch to finish precompiling')
+                    waiting = True
+                if not self.compile_cache.wait_for(key, self.stop_event):
+                    return False
+                self.build_directory = self.compile_cache.lookup(key)
+                self.cache_stats.emit(self.compile_cache.stats())
+                if self.build_directory:
+                    self.is_compiling = True  # like a finished compile: later passes neither look up nor count it
+                    logger.info(f'Using cached build {key} of {sketch_path}')
+                    self.wave('Sketch unchanged: using cached build')
+                    return True
+                if self.compile_cache.begin(key):
+                    break  # ours to compile, anyone else who needs it waits for this compile
+            try:
+                return self.compile_and_store(fqbn, sketch_path, key)
+            finally:
+                self.compile_cache.end(key)
+        return self.compile_and_store(fqbn, sketch_path, key)
+
+    # compile a sketch, into the compile cache when key is given
+    def compile_and_store(self, fqbn, sketch_path, key):
         logger.info(f'Compiling sketch for the board with fqbn {fqbn}...')
         headsup = 'Compiling sketch for test board'
         self.wave(headsup)
@@ -202,19 +233,24 @@ class CliWorker(QThread):
             "--fqbn", fqbn,
             sketch_path
         ]
+        if key:
+            command += ["--output-dir", str(self.compile_cache.staging_directory(key))]
         result = self.run_cli_command(command)
         if result:
             self.is_compiling = True
             logger.info('Compilation successful!')
             yes = 'Compilation successful!'
             self.wave(yes)
-            time.sleep(0.5)
+            if key:
+                self.build_directory = self.compile_cache.store(key, sketch_path, fqbn)  # None if nothing was staged
+                self.cache_stats.emit(self.compile_cache.stats())
+            self.stop_event.wait(0.5)
             return True
         else:
             logger.warning('Compilation failed')
             no = 'Compilation failed'
             self.wave(no)
-            time.sleep(0.5)
+            self.stop_event.wait(0.5)
             return False
 
     # upload sketch on test board
@@ -226,7 +262,7 @@ class CliWorker(QThread):
         logger.info(f'Uploading sketch to board with fqbn {fqbn} on port {port}...')
         uploading = 'Uploading sketch on test board'
         self.wave(uploading)
-        time.sleep(0.5)
+        self.stop_event.wait(0.5)
 
         command = [
             "arduino-cli", "upload",
@@ -234,24 +270,27 @@ class CliWorker(QThread):
             "--fqbn", fqbn,
             sketch_path
         ]
+        if self.build_directory:
+            command += ["--input-dir", str(self.build_directory)]  # flash the cached binaries as they are
         try:
             if not self.ser or self.is_stopped:
                 logger.warning(f'Serial connection stopped or missing on port: {port}')
 
-            self.ser.close()
+            self.release_port(port)  # arduino-cli needs the port
             result = self.run_cli_command(command)
             if result:
                 self.is_uploading = True
                 logger.info('Upload successful!')
                 bye = 'Upload successful!'
                 self.wave(bye)
-                time.sleep(2)
+                self.reacquire_port(port, settle=2)
                 self.finished.emit()    # signal to main the cli worker's job is finished
                 return True
             else:
                 logger.warning('Upload failed!')
                 bye = 'Upload failed!'
                 self.wave(bye)
+                self.reacquire_port(port)
                 self.finished.emit()    # signal to main the cli worker's job can't be completed
                 return False
 
@@ -261,6 +300,20 @@ class CliWorker(QThread):
             self.wave(error)
             self.finished.emit()    # signal to main the cli worker's job can't be completed
 
+    # hand the port over to arduino-cli
+    def release_port(self, port):
+        if self.broker:
+            self.broker.release(port)
+        else:
+            self.transport.close()
+
+    # take the port back once the board has re-enumerated after the upload
+    def reacquire_port(self, port, settle=0):
+        if self.broker:
+            self.broker.reacquire(port, self.stop_event)  # returns as soon as the port opens again
+        else:
+            self.stop_event.wait(settle)
+
     # all-in method for handling sketch upload
     def handle_board_and_upload(self, port, sketch_path):
         fqbn = self.detect_board(port)
@@ -306,19 +359,26 @@ class CliWorker(QThread):
             sketch_group_directory = sketch_path.split('/')[-3]  # get the overarching test group directory
             logger.info(f'Sketch group directory: {sketch_group_directory}')
 
-            sketch_full_path = test_data_filepath + '/' + sketch_path
+            sketch_full_path = full_sketch_path(filepath, sketch_path)
             logger.info(f'Full sketch path: {sketch_full_path}')
             self.handle_board_and_upload(port=self.port, sketch_path=sketch_full_path)
         else:
             logger.warning('Sketch path not found')
 
 
+# path of a test's sketch, which the test file gives relative to the directory above its own
+def full_sketch_path(filepath, sketch_path):
+    if sketch_path.startswith('./'):
+        sketch_path = sketch_path[2:]
+    return filepath.rsplit('/', 2)[0] + '/' + sketch_path
+
+
 class WifiCliWorker(CliWorker):
     output_received = pyqtSignal(str)
     finished = pyqtSignal()
 
-    def __init__(self, port, baudrate, timeout=5):
-        super().__init__(port, baudrate, timeout)
+    def __init__(self, port, baudrate, timeout=5, broker=None):
+        super().__init__(port, baudrate, timeout, broker)
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
@@ -332,10 +392,12 @@ class WifiCliWorker(CliWorker):
         if baudrate:
             self.port = baudrate
         try:
-            self.ser = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+            self.transport.port = self.port
+            self.transport.baudrate = self.baudrate
+            ready = self.transport.open(settle=1)
+            self.ser = self.transport.ser
             logger.info(f'Wifi CLI Worker connected to port: {self.port}')
-            time.sleep(1)
-            return True
+            return ready and self.is_running  # stop() may have come before open() cleared the cancel
         except serial.SerialException as e:
             logger.error(f'Error during serial setup for Wifi CLI Worker: {e}')
             return False
@@ -376,16 +438,13 @@ class WifiCliWorker(CliWorker):
 
     def stop(self):
         self.is_running = False
-        try:
-            if self.ser and self.ser.is_open:
-                self.ser.close()
-                logger.info(f'Connection to {self.port} closed successfully.')
-        except Exception as e:
-            logger.error(f'Error while closing connection: {e}')
-        finally:
-            self.quit()
-            self.wait()
-            logger.info('Wifi CLI Worker thread stopped.')
+        self.stop_event.set()
+        self.kill_cli_command()
+        self.transport.close()
+        self.quit()
+        if QThread.currentThread() is not self:
+            self.wait(STOP_TIMEOUT_MS)
+        logger.info('Wifi CLI Worker thread stopped.')
 
 
 
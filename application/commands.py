@@ -14,15 +14,53 @@ def ping():
 def set_temp(data, override):
     return {"commands": {"SET_TEMP": data, "override": override}}
 
-# handshake
-def handshake(time):
-    return {"handshake": {"timestamp": time}}
+# handshake, optionally asking for binary ping responses and offering faster baud rates
+def handshake(time, telemetry=None, baud_rates=None):
+    handshake_data = {"timestamp": time}
+    if telemetry:
+        handshake_data["telemetry"] = telemetry
+    if baud_rates:
+        handshake_data["baud_rates"] = baud_rates
+    return {"handshake": handshake_data}
+
+# stream status frames every interval_ms (0 stops the stream)
+def subscribe(interval_ms):
+    return {"commands": {"SUBSCRIBE": {"interval": interval_ms}}}
+
+# confirm communication after switching to the negotiated baud rate
+def baud_confirm():
+    return {"commands": {"BAUD_CONFIRM": {}}}
 
 # get test queue
 def get_test_queue():
     return {"commands": {"GET_TEST_QUEUE": {}}}
 
+# announce a chunked test queue upload of count tests
+def queue_begin(count):
+    return {"commands": {"QUEUE_BEGIN": {"count": count}}}
+
+# one test of a chunked queue upload, index is its position in the app's test plan
+def queue_test(seq, name, test, index):
+    return {"commands": {"QUEUE_TEST": {"seq": seq, "name": name, "index": index, "test": test}}}
+
 # run all tests
 def run_all_tests():
     return {"commands": {"RUN_QUEUE": {}}}
 
+
+# response type the control board answers each command with (commands not listed get no direct answer)
+RESPONSE_KEYS = {
+    "PING": "ping_response",
+    "BAUD_CONFIRM": "baud_confirm",
+    "SUBSCRIBE": "subscribed",
+    "QUEUE_BEGIN": "queue_begin",
+}
+
+# get the response key a json command expects, or None
+def expected_response(command):
+    if "handshake" in command:
+        return "handshake"
+    for name in command.get("commands", {}):
+        if name in RESPONSE_KEYS:
+            return RESPONSE_KEYS[name]
+    return None
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import re
+import shutil
+import threading
+import time
+from pathlib import Path
+from coreIndex import core_index
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+CACHE_DIRECTORY = Path.cwd() / 'build_cache'
+MAX_ENTRIES = 50  # builds kept, least recently used ones are evicted beyond this
+MAX_MB = 500  # total size of the kept builds
+SOURCE_SUFFIXES = {'.ino', '.pde', '.h', '.hpp', '.c', '.cpp', '.cc', '.S'}  # what arduino-cli compiles
+INCLUDE = re.compile(r'^\s*#\s*include\s*[<"]([^>"]+)[>"]', re.MULTILINE)
+
+
+# persistent arduino-cli builds, keyed by a hash of everything that goes into them: sketch sources,
+# the libraries they include, fqbn and core version; shared by every cli worker of the app
+class CompileCache:
+
+    def __init__(self, directory=CACHE_DIRECTORY, max_entries=MAX_ENTRIES, max_mb=MAX_MB):
+        self.directory = Path(directory)
+        self.directory.mkdir(exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * 1024 * 1024
+        self.lock = threading.Lock()  # index updates come from different workers
+        self.index_file = self.directory / 'index.json'
+        for staging in self.directory.glob('*.partial'):
+            shutil.rmtree(staging, ignore_errors=True)  # left by compiles that failed or were killed
+        self.index = self.load_index()  # key -> {'sketch', 'fqbn', 'size', 'created', 'last_used'}
+        self.hits = 0  # this session
+        self.misses = 0
+        self.libraries = None  # library per header from arduino-cli, read once
+        self.pending = {}  # key -> event set once a build compiling elsewhere is stored or has failed
+        core_index.add_install_listener(self.invalidate_toolchain)  # libraries that came with a core are read again
+
+    def load_index(self):
+        try:
+            with self.index_file.open('r') as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        # entries whose build directory has gone are forgotten
+        return {key: entry for key, entry in index.items() if (self.directory / key).is_dir()}
+
+    def save_index(self):
+        temporary = self.index_file.with_suffix('.tmp')
+        with temporary.open('w') as file:
+            json.dump(self.index, file, indent=4)
+        temporary.replace(self.index_file)
+
+    # build key of a sketch; run(command) runs arduino-cli and returns its stdout or None
+    def key(self, fqbn, sketch_path, run):
+        cores, libraries = self.toolchain_versions(run)
+        sources = hashlib.sha256()
+        headers = set()
+        sketch_directory = Path(sketch_path)
+        if sketch_directory.is_file():
+            sketch_directory = sketch_directory.parent
+        for path in sorted(sketch_directory.rglob('*')):
+            if not path.is_file() or path.suffix not in SOURCE_SUFFIXES:
+                continue
+            if any(part.startswith('.') or part == 'build' for part in path.relative_to(sketch_directory).parts):
+                continue
+            content = path.read_bytes()
+            sources.update(path.relative_to(sketch_directory).as_posix().encode() + b'\0' + content + b'\0')
+            headers.update(INCLUDE.findall(content.decode('utf-8', errors='replace')))
+        platform = ':'.join(fqbn.split(':')[:2])
+        description = {
+            'fqbn': fqbn,
+            'core': cores.get(platform),
+            'libraries': sorted({libraries[header] for header in headers if header in libraries}),
+            'headers': sorted(headers),
+            'sources': sources.hexdigest(),
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()[:32]
+
+    # installed core versions, from the installed-core index, and the library that provides each header,
+    # read from arduino-cli once
+    def toolchain_versions(self, run):
+        if self.libraries is None:
+            libraries = run(['arduino-cli', 'lib', 'list', '--format', 'json'])
+            if libraries is None:
+                return core_index.versions(run), {}  # a failed read is tried again with the next key
+            self.libraries = parse_library_versions(libraries)
+        return core_index.versions(run), self.libraries
+
+    # forget the library versions, e.g. after a core or library install
+    def invalidate_toolchain(self):
+        self.libraries = None
+
+    # directory of a cached build, None on a miss
+    def lookup(self, key):
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None or not (self.directory / key).is_dir():
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry['last_used'] = time.time()
+            self.save_index()
+        return self.directory / key
+
+    # True if a build for key is kept, without counting a hit or miss
+    def contains(self, key):
+        with self.lock:
+            return key in self.index and (self.directory / key).is_dir()
+
+    # claim a build for the caller to compile, so workers that need it wait instead of compiling it as well;
+    # False if it is being compiled elsewhere already or is stored meanwhile
+    def begin(self, key):
+        with self.lock:
+            if key in self.pending or (key in self.index and (self.directory / key).is_dir()):
+                return False
+            self.pending[key] = threading.Event()
+            return True
+
+    # the build for key is stored or has failed
+    def end(self, key):
+        with self.lock:
+            event = self.pending.pop(key, None)
+        if event:
+            event.set()
+
+    # True while a build for key is being compiled elsewhere
+    def is_pending(self, key):
+        with self.lock:
+            return key in self.pending
+
+    # wait for a build being compiled elsewhere; False if stop_event is set first
+    def wait_for(self, key, stop_event=None):
+        with self.lock:
+            event = self.pending.get(key)
+        while event is not None and not event.wait(0.1):
+            if stop_event is not None and stop_event.is_set():
+                return False
+        return True
+
+    # directory a build for key is written to before it is stored
+    def staging_directory(self, key):
+        staging = self.directory / f'{key}.partial'
+        shutil.rmtree(staging, ignore_errors=True)
+        return staging
+
+    # keep a finished build from its staging directory and evict old ones beyond the limits; the build
+    # directory, None if the compile left nothing to store
+    def store(self, key, sketch_path, fqbn):
+        staging = self.directory / f'{key}.partial'
+        target = self.directory / key
+        with self.lock:
+            if key in self.index and target.is_dir():
+                shutil.rmtree(staging, ignore_errors=True)  # same key, same build: keep the one stored first
+                return target
+            if not staging.is_dir():
+                logger.warning(f'No build to store for {sketch_path} in {staging}')
+                return None
+            shutil.rmtree(target, ignore_errors=True)
+            staging.replace(target)
+            now = time.time()
+            self.index[key] = {'sketch': str(sketch_path), 'fqbn': fqbn, 'created': now, 'last_used': now,
+                               'size': sum(path.stat().st_size for path in target.rglob('*') if path.is_file())}
+            self.evict(keep=key)
+            self.save_index()
+        return target
+
+    # drop least recently used builds until the cache is within its limits; caller holds the lock
+    def evict(self, keep=None):
+        by_age = sorted((key for key in self.index if key != keep), key=lambda key: self.index[key]['last_used'])
+        total = sum(entry['size'] for entry in self.index.values())
+        while by_age and (len(self.index) > self.max_entries or total > self.max_bytes):
+            oldest = by_age.pop(0)
+            total -= self.index.pop(oldest)['size']
+            shutil.rmtree(self.directory / oldest, ignore_errors=True)
+            logger.info(f'Evicted cached build {oldest}')
+
+    # hit/miss counts of this session and what the cache holds
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.index),
+                    'size_mb': sum(entry['size'] for entry in self.index.values()) / (1024 * 1024)}
+
+
+# header -> 'library@version' from 'lib list --format json' (older and newer arduino-cli layouts)
+def parse_library_versions(output):
+    try:
+        data = json.loads(output) if output else []
+    except ValueError:
+        return {}
+    installed = data.get('installed_libraries', []) if isinstance(data, dict) else data
+    libraries = {}
+    for item in installed or []:
+        library = item.get('library', item)
+        name = library.get('name')
+        if not name:
+            continue
+        for header in library.get('provides_includes') or [f'{name.replace(" ", "_")}.h']:
+            libraries[header] = f'{name}@{library.get("version", "")}'
+    return libraries
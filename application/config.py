@@ -23,6 +23,11 @@ class Config:
             "control_board": {"port": None, "board_name": None},
             "t_board_wifi": {"port": None, "board_name": None},
             "test_directory": str(Path.cwd()),  # default to current directory
+            "ping_interval": {"min": 0.25, "active": 0.5, "idle": 2.0, "max": 8.0},  # seconds
+            "queue_lookahead": 1,  # tests kept on the control board after the running one
+            "record_sessions": False,  # capture all serial traffic under captures/ for replay
+            "compile_cache": {"max_entries": 50, "max_mb": 500},  # kept builds, least recently used go first
+            "precompile_workers": 4,  # sketches of a loaded test file compiled in parallel
         }
         self.set_test_directory(self.config["test_directory"])
         self.save_config()
@@ -47,6 +52,14 @@ class Config:
         self.config['test_directory'] = str(Path(directory).resolve().as_posix())  # store as absolute path
         self.save_config()
 
+    # remember the baud rate negotiated with the board on a port
+    def set_baud_rate(self, port, baud_rate):
+        self.config.setdefault('baud_rates', {})[port] = baud_rate
+        self.save_config()
+
+    def get_baud_rate(self, port, default=9600):
+        return self.config.get('baud_rates', {}).get(port, default)
+
     def get_test_directory(self):
         return self.config.get('test_directory')
 
@@ -0,0 +1,679 @@
+import argparse
+import json
+import os
+import pty
+import select
+import threading
+import time
+import tty
+from datetime import datetime, timedelta
+import telemetry
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# usage: python controlBoardSimulator.py [--speed 720]   (prints the port to point the app at)
+
+# firmware constants, see TemperatureChamber.ino
+IDLE, HEATING, COOLING, EVALUATE, EMERGENCY_STOP = range(5)
+TEMPERATURE_MAX = 100
+TEMPERATURE_MIN = 0
+ROOM_TEMP = 22
+TIMEOUT_DURATION = 300000  # ms without a ping before the firmware stops everything
+LINE_BUFFER = 1024  # incomingString, longer lines arrive in pieces
+DEFAULT_BAUD_RATE = 9600
+SUPPORTED_BAUD_RATES = [230400, 115200, 57600]
+BAUD_CONFIRM_TIMEOUT = 2000  # ms
+BAUD_IDLE_TIMEOUT = 90000  # ms without handshake or ping before going back to the default rate
+MIN_SUBSCRIPTION_INTERVAL = 100  # ms
+QUEUE_UPLOAD_WINDOW = 2
+RTC_DEFAULT_TIME = datetime(2024, 11, 1, 10, 26, 0)
+
+LOOP_INTERVAL = 0.005  # seconds of real time between two passes of loop()
+MAX_THERMAL_STEP = 1.0  # seconds of simulated time per integration step
+
+
+# two-node chamber model: the heater element stores heat and passes it on to the air, which leaks to the room;
+# the stored heat is what carries the firmware's coasting phase (heater off within 4 °C) up to the target
+class ThermalModel:
+
+    HEATER_POWER = 0.3  # °C/s the element gains with the heater relay on
+    ELEMENT_TO_AIR = 0.005  # 1/s, element -> element/air temperature exchange
+    AIR_FROM_ELEMENT = 0.002  # 1/s, air <- element
+    AIR_TO_ROOM = 0.0002  # 1/s, passive loss through the walls
+    BLOWER = 0.01  # 1/s, extra exchange with the room while the blower runs
+
+    def __init__(self, ambient=ROOM_TEMP):
+        self.ambient = ambient
+        self.air = ambient
+        self.element = ambient
+
+    # advance by seconds of simulated time with the heater at duty (0..1) and the blower on or off
+    def step(self, seconds, heater_duty, blower):
+        while seconds > 0:
+            dt = min(seconds, MAX_THERMAL_STEP)
+            element_delta = self.HEATER_POWER * heater_duty - self.ELEMENT_TO_AIR * (self.element - self.air)
+            air_delta = (self.AIR_FROM_ELEMENT * (self.element - self.air)
+                         - (self.AIR_TO_ROOM + (self.BLOWER if blower else 0)) * (self.air - self.ambient))
+            self.element += element_delta * dt
+            self.air += air_delta * dt
+            seconds -= dt
+
+    # average of the two ds18b20 sensors, which resolve 1/16 °C
+    def reading(self):
+        return round(self.air * 16) / 16
+
+
+# the control board firmware on a pseudo-terminal: same protocol, same text output, same state machine;
+# test durations and the thermal model run speed times faster, everything the app times (pings, baud
+# confirmation, subscription intervals) runs on real time
+class ControlBoardSimulator:
+
+    def __init__(self, speed=1.0, ambient=ROOM_TEMP, system_switch=True, start_switch=True, pace_output=True):
+        self.speed = speed
+        self.system_switch = system_switch  # system switch on: the board accepts tests and commands
+        self.start_switch = start_switch  # start switch on: the state machine may heat and cool
+        self.pace_output = pace_output  # hold output back to what the current baud rate can carry
+        self.thermal = ThermalModel(ambient)
+        self.master = None
+        self.slave = None
+        self.device = None
+        self.thread = None
+        self.running = threading.Event()
+        self.started_at = time.monotonic()
+        self.sim_ms = 0.0  # accelerated millis() for tests and the thermal model
+        self.last_loop = None
+        self.input = b''
+        self.wire_free_at = 0.0  # when the bytes written so far have left at the current baud rate
+        self.lines_sent = 0
+        self.lines_received = 0
+        self.boot()
+
+    # power-on state, as after setup()
+    def boot(self):
+        self.status = EMERGENCY_STOP
+        self.temp_override = False
+        self.temp_limit = TEMPERATURE_MAX
+        self.printed_waiting = False
+        self.printed_running = False
+        self.is_test_running = False
+        self.current_test = None
+        self.current_sequence_index = 0
+        self.sequence_start_time = 0
+        self.current_duration = 0
+        self.test_queue = []  # [(name, test)], the running test is at the front
+        self.current_test_name = ''
+        self.printed_no_ping = False
+        self.temperature_room = self.thermal.reading()
+        self.temperature_desired = 0
+        self.long_heating_flag = 0
+        self.is_heating = False
+        self.is_cooling = False
+        self.heater_duty = 0.0
+        self.temperature_threshold = 0.0
+        self.last_shutdown_cause = 'Unknown'
+        self.last_heating_time = ''
+        self.last_ping_time = 0
+        self.displaying_emergency = False
+        self.binary_telemetry = False
+        self.current_baud_rate = DEFAULT_BAUD_RATE
+        self.baud_switch_time = 0
+        self.awaiting_baud_confirm = False
+        self.last_host_contact = 0
+        self.subscribed = False
+        self.subscription_interval = 0
+        self.last_status_sent = 0
+        self.last_reported_status = -1
+        self.queue_upload_count = 0
+        self.queue_upload_next = 0
+        self.rtc_set_at = time.monotonic()
+        self.rtc_time = RTC_DEFAULT_TIME
+
+    # create the pseudo-terminal and return the device the app should open
+    def open(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)  # no echo, no newline translation, like a usb serial port
+        self.device = os.ttyname(self.slave)
+        return self.device
+
+    # run the firmware loop in a background thread
+    def start(self):
+        if self.device is None:
+            self.open()
+        self.running.set()
+        self.thread = threading.Thread(target=self.run, name='control-board-simulator', daemon=True)
+        self.thread.start()
+        logger.info(f'Control board simulator on {self.device} at {self.speed:g}x speed')
+        return self.device
+
+    # stop the loop and remove the pseudo-terminal
+    def stop(self):
+        self.running.clear()
+        if self.thread:
+            self.thread.join()
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def run(self):
+        while self.running.is_set():
+            self.loop()
+            readable, _, _ = select.select([self.master], [], [], LOOP_INTERVAL)
+            if readable:
+                try:
+                    self.input += os.read(self.master, 4096)
+                except OSError:
+                    break  # pty gone
+
+    # CLOCKS
+    # real milliseconds since power-on, for everything the app times
+    def millis(self):
+        return (time.monotonic() - self.started_at) * 1000
+
+    # accelerated milliseconds, for test sequences
+    def test_millis(self):
+        return self.sim_ms
+
+    # RTC time, set by the handshake and running in real time
+    def now(self):
+        return self.rtc_time + timedelta(seconds=time.monotonic() - self.rtc_set_at)
+
+    # SERIAL OUTPUT
+    def write(self, data):
+        if self.master is None:
+            return
+        if self.pace_output:
+            now = time.monotonic()
+            self.wire_free_at = max(self.wire_free_at, now) + len(data) * 10 / self.current_baud_rate
+            if self.wire_free_at - now > 0.001:
+                time.sleep(self.wire_free_at - now)  # Serial.write blocks once the tx buffer is full
+        try:
+            os.write(self.master, data)
+        except OSError as e:
+            logger.debug(f'Simulator output dropped: {e}')
+
+    # Serial.println
+    def println(self, text=''):
+        self.lines_sent += 1
+        self.write(f'{text}\r\n'.encode('utf-8'))
+
+    # serializeJson + Serial.println
+    def println_json(self, doc):
+        self.println(json.dumps(doc, separators=(',', ':')))
+
+    # LOOP
+    def loop(self):
+        now = time.monotonic()
+        if self.last_loop is not None:
+            elapsed = now - self.last_loop
+            self.sim_ms += elapsed * 1000 * self.speed
+            self.thermal.step(elapsed * self.speed, self.heater_duty, self.is_cooling)
+        self.last_loop = now
+
+        # check for timeout (5 minutes without ping)
+        if self.millis() - self.last_ping_time > TIMEOUT_DURATION:
+            if not self.printed_no_ping:
+                self.println('No ping received for 5 minutes. Resetting and shutting down.')
+                self.printed_no_ping = True
+            self.status = EMERGENCY_STOP
+            self.last_shutdown_cause = 'Lost connection'
+            self.displaying_emergency = True
+            self.subscribed = False
+            self.run_emergency_stop()
+
+        self.temperature_room = self.thermal.reading()
+        if self.temperature_desired != 0:
+            self.temperature_threshold = self.temperature_room - self.temperature_desired
+
+        self.read_and_parse_serial()
+        self.check_baud_confirm_timeout()
+        self.check_baud_idle_timeout()
+        self.stream_telemetry()
+        if self.is_test_running:
+            self.run_test_sequence()
+
+        {
+            IDLE: self.handle_idle_state,
+            HEATING: self.handle_heating_state,
+            COOLING: self.handle_cooling_state,
+            EVALUATE: self.handle_evaluate_state,
+            EMERGENCY_STOP: self.handle_emergency_stop_state,
+        }[self.status]()
+
+    # SERIAL INPUT
+    def read_and_parse_serial(self):
+        while b'\n' in self.input:
+            line, self.input = self.input.split(b'\n', 1)
+            # readBytesUntil into a 1024 byte buffer: longer lines are cut into pieces
+            for start in range(0, max(len(line), 1), LINE_BUFFER - 1):
+                piece = line[start:start + LINE_BUFFER - 1]
+                if not piece:
+                    continue  # blank line, e.g. the separator in front of an emergency stop
+                self.lines_received += 1
+                try:
+                    doc = json.loads(piece.decode('utf-8', errors='replace'))
+                except json.JSONDecodeError:
+                    self.println('deserializeJson() failed: InvalidInput')
+                    self.println('Resetting buffer.')
+                    continue
+                self.parse_text_from_json(doc)
+
+    def parse_text_from_json(self, doc):
+        if not isinstance(doc, dict):
+            self.println('Error: Invalid JSON format')
+        elif 'handshake' in doc:
+            handshake = doc['handshake'] or {}
+            self.binary_telemetry = handshake.get('telemetry') == 'binary'
+            baud_rate = self.current_baud_rate
+            if 'baud_rates' in handshake:
+                baud_rate = self.choose_baud_rate(handshake['baud_rates'])
+            self.set_initial_timestamp(handshake)
+            self.last_host_contact = self.millis()
+            self.send_handshake(baud_rate)
+            if baud_rate != self.current_baud_rate:
+                self.current_baud_rate = baud_rate
+                self.baud_switch_time = self.millis()
+                self.awaiting_baud_confirm = True
+            self.last_shutdown_cause = ''
+        elif 'tests' in doc and self.system_switch:
+            for name, test in (doc['tests'] or {}).items():
+                self.parse_and_queue_test(name, test, len(self.test_queue))
+        elif 'commands' in doc:
+            self.parse_and_run_commands(doc['commands'] or {})
+        else:
+            self.println('Error: Invalid JSON format')
+
+    def parse_and_run_commands(self, commands):
+        for command, params in commands.items():
+            params = params if isinstance(params, dict) else {}
+            # an emergency stop is honoured first and regardless of the system switch
+            if command == 'EMERGENCY_STOP':
+                self.run_emergency_stop()
+                self.send_ping_response()
+                self.println('Emergency Stop initiated via command.')
+                continue
+            if command == 'BAUD_CONFIRM':
+                self.awaiting_baud_confirm = False
+                self.last_host_contact = self.millis()
+                self.println_json({'baud_confirm': {'baud_rate': self.current_baud_rate}})
+            if command == 'PING':
+                self.send_ping_response()
+                self.register_ping()
+            elif command == 'SUBSCRIBE':
+                self.start_subscription(params)
+                self.register_ping()
+            elif command == 'QUEUE_BEGIN':
+                self.begin_queue_upload(params)
+            elif command == 'QUEUE_TEST':
+                self.receive_queued_test(params)
+            if not self.system_switch:
+                return
+            if command == 'GET_TEST_QUEUE':
+                self.send_queue()
+            elif command == 'RUN_QUEUE':
+                if not self.is_test_running and self.test_queue:
+                    self.run_next_test()
+            elif command == 'SET_TEMP':
+                self.clear_tests()
+                temp = float(params.get('temp', 0))
+                self.set_temperature(temp)
+                self.println(f'Manual temp set to {temp:.2f}')
+                self.println(f'Duration: {int(params.get("duration", 0))}')
+                if params.get('override'):
+                    self.temp_override = True
+                    self.temp_limit = temp
+                else:
+                    self.temp_override = False
+                    self.temp_limit = TEMPERATURE_MAX
+            elif command == 'RESET':
+                self.clear_tests()
+                self.displaying_emergency = False
+                self.status = IDLE
+
+    # any sign of life from the app resets the connection timeout
+    def register_ping(self):
+        self.last_ping_time = self.millis()
+        self.last_host_contact = self.last_ping_time
+        self.printed_no_ping = False
+        self.displaying_emergency = False
+
+    # HANDSHAKE AND BAUD RATE
+    def set_initial_timestamp(self, handshake):
+        if 'timestamp' not in handshake:
+            self.println('Timestamp key not found in commandParams.')
+            return
+        try:
+            self.rtc_time = datetime.strptime(str(handshake['timestamp'])[:19], '%Y-%m-%dT%H:%M:%S')
+            self.rtc_set_at = time.monotonic()
+            self.println('RTC updated with initial timestamp from python app.')
+        except ValueError:
+            self.println('Error setting RTC time.')
+
+    def send_handshake(self, baud_rate):
+        handshake = {
+            'timestamp': self.now().strftime('%Y-%m-%dT%H:%M:%S'),
+            'machine_state': self.machine_state(),
+            'last_shutdown_cause': self.last_shutdown_cause,
+            'last_heat_time': self.last_heating_time or 'N/A',
+        }
+        if self.binary_telemetry:
+            handshake['telemetry'] = 'binary'
+        handshake['baud_rate'] = baud_rate
+        self.println_json({'handshake': handshake})
+
+    # fastest rate offered by the app that the board supports
+    def choose_baud_rate(self, offered):
+        for rate in SUPPORTED_BAUD_RATES:
+            if rate in offered:
+                return rate
+        return DEFAULT_BAUD_RATE
+
+    def check_baud_confirm_timeout(self):
+        if self.awaiting_baud_confirm and self.millis() - self.baud_switch_time > BAUD_CONFIRM_TIMEOUT:
+            self.awaiting_baud_confirm = False
+            self.current_baud_rate = DEFAULT_BAUD_RATE
+
+    # an app at another rate is not understood: back to the default rate, where a new handshake starts
+    def check_baud_idle_timeout(self):
+        if self.current_baud_rate != DEFAULT_BAUD_RATE and self.millis() - self.last_host_contact > BAUD_IDLE_TIMEOUT:
+            self.awaiting_baud_confirm = False
+            self.current_baud_rate = DEFAULT_BAUD_RATE
+
+    # TELEMETRY
+    def machine_state(self):
+        return telemetry.MACHINE_STATES[self.status]
+
+    # seconds left in the running sequence, 0 until its temperature is reached
+    def time_left(self):
+        sequences = self.current_test['chamber_sequences'] if self.current_test else []
+        if self.is_test_running and self.current_sequence_index < len(sequences) and \
+                self.is_temperature_reached(sequences[self.current_sequence_index]['temp']):
+            return int((self.current_duration - (self.test_millis() - self.sequence_start_time)) / 1000)
+        return 0
+
+    def send_ping_response(self):
+        if self.binary_telemetry:
+            self.write(telemetry.encode_frame(
+                alive=True, timestamp=self.now().timestamp(), machine_state=self.machine_state(),
+                current_temp=self.temperature_room, is_test_running=self.is_test_running,
+                current_test_index=self.current_test['index'] if self.current_test_name else None,
+                current_sequence=self.current_sequence_index + 1, desired_temp=self.temperature_desired,
+                current_duration=self.current_duration, time_left=self.time_left(),
+                queued_tests=len(self.test_queue)))
+            return
+        self.println_json({'ping_response': {
+            'alive': True,
+            'timestamp': self.now().strftime('%Y-%m-%dT%H:%M:%S'),
+            'machine_state': self.machine_state(),
+            'current_temp': self.temperature_room,
+            'test_status': {
+                'is_test_running': self.is_test_running,
+                'current_test': self.current_test_name,
+                'current_sequence': self.current_sequence_index + 1,
+                'desired_temp': self.temperature_desired,
+                'current_duration': self.current_duration,
+                'time_left': self.time_left(),
+                'queued_tests': len(self.test_queue),
+            },
+        }})
+
+    def start_subscription(self, params):
+        interval = int(params.get('interval', 0) or 0)
+        self.subscribed = interval > 0
+        self.subscription_interval = max(interval, MIN_SUBSCRIPTION_INTERVAL)
+        self.println_json({'subscribed': {'interval': self.subscription_interval if self.subscribed else 0}})
+        if self.subscribed:
+            self.send_ping_response()
+            self.last_status_sent = self.millis()
+            self.last_reported_status = self.status
+
+    # status on state changes and every subscription interval
+    def stream_telemetry(self):
+        if not self.subscribed:
+            return
+        if self.status != self.last_reported_status:
+            self.last_reported_status = self.status
+            self.println_json({'event': {'machine_state': self.machine_state()}})
+            self.send_ping_response()
+            self.last_status_sent = self.millis()
+        elif self.millis() - self.last_status_sent >= self.subscription_interval:
+            self.send_ping_response()
+            self.last_status_sent = self.millis()
+
+    # TEST QUEUE
+    # same checks as parseAndQueueTest, False if the test has no sequences
+    def parse_and_queue_test(self, name, test, index):
+        if not isinstance(test, dict) or 'chamber_sequences' not in test:
+            self.println("Error: Missing 'chamber_sequences' in test data")
+            return False
+        sequences = []
+        for sequence in test['chamber_sequences']:
+            if 'temp' not in sequence or 'duration' not in sequence:
+                self.println("Error: Missing 'temp' or 'duration' in JSON sequence")
+                break
+            sequences.append({'temp': float(sequence['temp']), 'duration': int(sequence['duration'])})
+        self.test_queue.append((name, {
+            'chamber_sequences': sequences,
+            'sketch': test.get('sketch'),
+            'expected_output': test.get('expected_output'),
+            'index': index,
+        }))
+        return True
+
+    def begin_queue_upload(self, params):
+        if not self.system_switch:
+            self.println_json({'queue_begin': {'error': 'system off'}})
+            return
+        self.queue_upload_count = int(params.get('count', 0) or 0)
+        self.queue_upload_next = 0
+        self.println_json({'queue_begin': {'count': self.queue_upload_count, 'window': QUEUE_UPLOAD_WINDOW}})
+
+    def send_queue_ack(self, seq, error=None):
+        ack = {'seq': seq, 'next': self.queue_upload_next}
+        if error:
+            ack['error'] = error
+        self.println_json({'queue_ack': ack})
+
+    # queue the test in a QUEUE_TEST frame, in order and only once
+    def receive_queued_test(self, params):
+        seq = int(params.get('seq', 0) or 0)
+        if seq < self.queue_upload_next:
+            self.send_queue_ack(seq)  # retransmission of a frame whose ack got lost, already queued
+            return
+        if seq > self.queue_upload_next or self.queue_upload_next >= self.queue_upload_count:
+            return  # an earlier frame went missing, the app resends from there after its timeout
+        error = None
+        if not self.system_switch:
+            error = 'system off'
+        elif not self.parse_and_queue_test(params.get('name', ''), params.get('test'),
+                                           params.get('index', len(self.test_queue))):
+            error = 'invalid test'
+        self.queue_upload_next += 1
+        self.send_queue_ack(seq, error)
+
+    def send_queue(self):
+        self.println_json({'queue': {'tests': {name: {
+            'chamber_sequences': test['chamber_sequences'],
+            'sketch': test['sketch'],
+            'expected_output': test['expected_output'],
+        } for name, test in self.test_queue}}})
+
+    def run_next_test(self):
+        if self.test_queue:
+            self.current_test_name, self.current_test = self.test_queue[0]
+            self.is_test_running = True
+            self.current_sequence_index = 0
+            self.set_temperature(self.current_test['chamber_sequences'][0]['temp'])
+            self.status = EVALUATE
+
+    def clear_tests(self):
+        self.is_test_running = False
+        self.current_sequence_index = 0
+        self.current_test_name = ''
+        self.sequence_start_time = 0
+        self.current_duration = 0
+        self.temperature_desired = 0
+        self.is_heating = False
+        self.is_cooling = False
+        self.heater_duty = 0.0
+        self.long_heating_flag = 0
+        self.test_queue = []
+        self.current_test = None
+
+    def run_emergency_stop(self):
+        self.clear_tests()
+        if self.temperature_room > ROOM_TEMP:
+            self.set_temperature(ROOM_TEMP)
+            self.status = COOLING
+
+    # TEST SEQUENCES
+    def is_temperature_reached(self, target_temp):
+        return target_temp - 0.5 <= self.temperature_room <= target_temp + 5
+
+    def run_test_sequence(self):
+        self.run_current_sequence()
+        if self.current_sequence_index >= len(self.current_test['chamber_sequences']):
+            self.temp_override = False
+            self.temp_limit = TEMPERATURE_MAX
+            self.println(f'Test completed: {self.current_test_name}')
+            self.is_test_running = False
+            # drop the finished test, the app sends the next ones as the queue drains
+            if self.test_queue:
+                self.test_queue.pop(0)
+            if not self.test_queue:
+                self.println('All tests completed!')
+                self.clear_tests()
+                return
+            self.run_next_test()
+
+    def run_current_sequence(self):
+        sequences = self.current_test['chamber_sequences']
+        if self.current_sequence_index >= len(sequences):
+            self.status = EVALUATE
+            return
+        sequence = sequences[self.current_sequence_index]
+        target_temp, duration = sequence['temp'], sequence['duration']
+        self.current_duration = duration
+
+        if not self.printed_running:
+            self.println(f'Running sequence: Target temp = {target_temp:.2f}°C '
+                         f'Duration = {duration // 60000} minutes')
+            self.printed_running = True
+
+        if not self.is_temperature_reached(target_temp):
+            if not self.printed_waiting:
+                self.println('Waiting for target temperature to be reached...')
+                self.printed_waiting = True
+            return
+
+        if self.sequence_start_time == 0:
+            self.sequence_start_time = self.test_millis()
+            self.println('Target temperature reached! Starting timer.')
+
+        if self.test_millis() - self.sequence_start_time >= duration:
+            self.println('Sequence completed.')
+            self.current_sequence_index += 1
+            self.sequence_start_time = 0
+            self.printed_waiting = False
+            self.printed_running = False
+            if self.current_sequence_index < len(sequences):
+                self.set_temperature(sequences[self.current_sequence_index]['temp'])
+
+    def set_temperature(self, temp):
+        current_limit = self.temp_limit if self.temp_override else TEMPERATURE_MAX
+        if temp >= current_limit:
+            self.temperature_desired = int(current_limit)
+        elif temp <= TEMPERATURE_MIN:
+            self.temperature_desired = TEMPERATURE_MIN
+            self.println('Specified temperature is lower than the minimum allowed temperature')
+            self.println(f'Setting temperature to {TEMPERATURE_MIN}°C')
+        else:
+            self.temperature_desired = int(temp)  # chamberState.temperatureDesired is an int
+            self.println(f'Setting temperature to {temp:.2f}°C')
+
+    # STATE MACHINE
+    def handle_idle_state(self):
+        if not self.system_switch:
+            self.status = EMERGENCY_STOP
+            return
+        if self.start_switch:
+            self.status = EVALUATE
+        self.heater_duty = 0.0
+        self.is_heating = False
+        self.is_cooling = False
+        self.long_heating_flag = 0
+
+    def handle_heating_state(self):
+        if not self.system_switch or not self.start_switch:
+            self.status = IDLE
+            return
+        self.is_cooling = False
+        if self.temperature_threshold > -0.1:
+            self.long_heating_flag = 0
+            self.is_heating = False
+            self.heater_duty = 0.0
+            self.last_heating_time = self.now().strftime('%Y-%m-%dT%H:%M:%S')
+            self.status = EVALUATE
+        else:
+            # adjustDutyCycleAndPeriod, averaged over the relay period
+            if self.temperature_threshold < -4:
+                self.heater_duty = 1.0
+                self.long_heating_flag = 1
+            else:
+                self.heater_duty = 0.0 if self.long_heating_flag else 0.8
+            self.is_heating = True
+
+    def handle_cooling_state(self):
+        if not self.system_switch or not self.start_switch:
+            self.status = IDLE
+            return
+        self.heater_duty = 0.0
+        if self.temperature_threshold < 0.1:
+            self.is_cooling = False
+            self.status = EVALUATE
+        else:
+            self.is_cooling = True
+
+    def handle_evaluate_state(self):
+        if not self.system_switch:
+            self.status = EMERGENCY_STOP
+            return
+        if not self.start_switch:
+            self.status = IDLE
+            return
+        if self.temperature_desired == 0:
+            return
+        if self.temperature_threshold > 0.4:
+            self.status = COOLING
+        elif self.temperature_threshold < -0.1:
+            self.status = HEATING
+
+    def handle_emergency_stop_state(self):
+        self.heater_duty = 0.0
+        self.is_heating = False
+        self.is_cooling = False
+        self.long_heating_flag = 0
+        if self.system_switch:  # switchSystem.held()
+            self.status = IDLE
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Temperature chamber control board simulator')
+    parser.add_argument('--speed', type=float, default=1.0, help='time acceleration of tests and temperatures')
+    parser.add_argument('--ambient', type=float, default=ROOM_TEMP, help='room temperature in °C')
+    parser.add_argument('--system-off', action='store_true', help='system switch off: tests and commands refused')
+    parser.add_argument('--no-pace', action='store_true', help='write output as fast as possible')
+    args = parser.parse_args()
+    simulator = ControlBoardSimulator(speed=args.speed, ambient=args.ambient, system_switch=not args.system_off,
+                                      pace_output=not args.no_pace)
+    print(f'Control board simulator running on {simulator.start()}, Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
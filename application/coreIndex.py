@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+from pathlib import Path
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+INDEX_FILE = Path.cwd() / 'installed_cores.json'
+CORE_LIST = ['arduino-cli', 'core', 'list', '--format', 'json']
+CORE_INSTALL = ['arduino-cli', 'core', 'install']
+
+
+# installed arduino cores (platform id -> version), kept on disk between sessions and read from arduino-cli
+# once at startup and after every core install, so uploads never have to run 'core list' themselves;
+# shared by the cli workers, arduinoUtils and the compile cache
+class CoreIndex:
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = Path(path)
+        self.lock = threading.Lock()  # a lookup during a refresh waits for the fresh list
+        self.platforms = self.load()
+        self.refreshed = False  # read from arduino-cli in this session
+        self.install_lock = threading.Lock()  # a second install of the same core waits and finds it installed
+        self.install_listeners = []  # called after every core install, before the cores are read again
+
+    def load(self):
+        try:
+            with self.path.open('r') as file:
+                return json.load(file).get('platforms', {})
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def save(self):
+        temporary = self.path.with_suffix('.tmp')
+        with temporary.open('w') as file:
+            json.dump({'platforms': self.platforms, 'refreshed': time.time()}, file, indent=4)
+        temporary.replace(self.path)
+
+    # read the installed cores from arduino-cli; run(command) returns its stdout or None
+    def refresh(self, run):
+        with self.lock:
+            self.refresh_locked(run)
+
+    # caller holds the lock; a failed read keeps the cores known so far
+    def refresh_locked(self, run):
+        output = run(CORE_LIST)
+        if output is None:
+            logger.warning('Could not read the installed cores, keeping the last known ones')
+            return
+        self.platforms = parse_core_versions(output)
+        self.refreshed = True
+        self.save()
+        logger.info(f'Installed cores: {self.platforms}')
+
+    # installed platform id -> version; read from arduino-cli only if no index was there to start with
+    def versions(self, run):
+        with self.lock:
+            if not self.refreshed and not self.platforms:
+                self.refresh_locked(run)
+            return dict(self.platforms)
+
+    # True if the core (platform) a board needs is installed
+    def is_installed(self, fqbn, run):
+        return platform_id(fqbn) in self.versions(run)
+
+    # call listener() after every core install, e.g. to drop what was read with the old cores
+    def add_install_listener(self, listener):
+        self.install_listeners.append(listener)
+
+    # the one place cores get installed: install the core a board needs if it is missing, let the listeners
+    # (the compile cache) drop what depends on the old cores, then read the installed cores again;
+    # True if it installed the core
+    def install_if_needed(self, fqbn, run):
+        with self.install_lock:
+            if self.is_installed(fqbn, run):
+                return False
+            platform = platform_id(fqbn)
+            logger.info(f'Core {platform} not installed. Installing...')
+            if run(CORE_INSTALL + [platform]) is None:
+                logger.warning(f'Installing core {platform} failed')
+            for listener in list(self.install_listeners):
+                listener()
+            self.refresh(run)  # builds with the new core get new keys
+            return True
+
+
+# 'package:architecture' of a fqbn, the platform 'core install' takes
+def platform_id(fqbn):
+    return ':'.join(fqbn.split(':')[:2])
+
+
+# platform id -> installed version from 'core list --format json' (older and newer arduino-cli layouts)
+def parse_core_versions(output):
+    try:
+        data = json.loads(output) if output else []
+    except ValueError:
+        return {}
+    platforms = data.get('platforms', []) if isinstance(data, dict) else data
+    versions = {}
+    for platform in platforms or []:
+        version = platform.get('installed_version') or platform.get('installed')
+        if platform.get('id') and version:
+            versions[platform['id']] = version
+    return versions
+
+
+core_index = CoreIndex()
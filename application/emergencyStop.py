@@ -0,0 +1,76 @@
+import time
+from threading import Lock
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+STOP_CONFIRM_TIMEOUT = 1.0  # seconds to see EMERGENCY_STOP in the telemetry before writing the stop again
+MAX_STOP_WRITES = 3  # writes of the same stop before giving up on the confirmation
+
+
+# timing of an emergency stop from the click until the control board reports the new state
+class EmergencyStopTracker:
+
+    def __init__(self):
+        self.lock = Lock()  # clicks come from the gui thread, confirmations from the worker thread
+        self.clicked_at = None  # None when no stop is waiting for confirmation
+        self.on_wire_at = None
+        self.last_write = None
+        self.writes = 0
+
+    # stop button clicked, a second click before the confirmation keeps the first click time
+    def clicked(self, at=None):
+        with self.lock:
+            if self.clicked_at is None:
+                self.clicked_at = time.monotonic() if at is None else at
+                self.on_wire_at = None
+                self.last_write = None
+                self.writes = 0
+
+    # the stop command has been transmitted
+    def written(self, at=None):
+        at = time.monotonic() if at is None else at
+        with self.lock:
+            self.writes += 1
+            self.last_write = at
+            if self.on_wire_at is None:
+                self.on_wire_at = at
+            if self.clicked_at is not None and self.writes == 1:
+                logger.info(f'Emergency stop on the wire {(at - self.clicked_at) * 1000:.1f} ms after the click')
+
+    # a stop is waiting for the control board to report EMERGENCY_STOP
+    def is_pending(self):
+        return self.clicked_at is not None
+
+    # no confirmation in time, the stop should be written again
+    def is_overdue(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            return self.clicked_at is not None and self.last_write is not None and \
+                now - self.last_write >= STOP_CONFIRM_TIMEOUT
+
+    # out of retries
+    def is_exhausted(self):
+        return self.writes >= MAX_STOP_WRITES
+
+    # seconds until the confirmation is overdue, None when no stop is pending
+    def next_deadline_in(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.clicked_at is None or self.last_write is None:
+                return None
+            return max(0.0, self.last_write + STOP_CONFIRM_TIMEOUT - now)
+
+    # finish the pending stop and return its latencies in ms (confirmed_ms is None when it was never confirmed)
+    def finish(self, confirmed=True, at=None):
+        at = time.monotonic() if at is None else at
+        with self.lock:
+            if self.clicked_at is None:
+                return None
+            latency = {
+                'wire_ms': (self.on_wire_at - self.clicked_at) * 1000 if self.on_wire_at is not None else None,
+                'confirmed_ms': (at - self.clicked_at) * 1000 if confirmed else None,
+                'writes': self.writes,
+            }
+            self.clicked_at = None
+        return latency
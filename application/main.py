@@ -1,5 +1,6 @@
 # system and PyQt5 imports
 import sys
+import threading
 import time
 from PyQt5.QtWidgets import QApplication, QMainWindow, QLabel, QWidget, QLineEdit, QListWidget, QVBoxLayout, QPushButton, QHBoxLayout, QListWidgetItem, QFrame, QSpacerItem, QSizePolicy, QMessageBox, QTabWidget, QProgressBar
 from PyQt5.QtGui import QIcon, QPixmap, QColor, QFont
@@ -13,6 +14,12 @@ from portSelector import PortSelector
 from testBoardWorker import TestBoardWorker
 from cliWorker import CliWorker, WifiCliWorker
 from wifiWorker import WifiWorker
+from portBroker import PortBroker
+from sessionCapture import SessionRecorder
+from compileCache import CompileCache, MAX_ENTRIES, MAX_MB
+from sketchPrecompiler import SketchPrecompiler, PRECOMPILE_WORKERS
+from coreIndex import core_index
+import arduinoUtils
 from config import Config
 from logger_config import setup_logger
 from mainTab import MainTab
@@ -26,6 +33,8 @@ logger = setup_logger(__name__)
 
 # Define default maximum allowed temperature
 MAX_ALLOWED_TEMP = 100
+# on close, how long a worker thread still running after its stop() gets before it is terminated
+SHUTDOWN_TIMEOUT_MS = 10000
 
 
 # create window class
@@ -54,6 +63,7 @@ class MainWindow(QMainWindow):
         self.cli_worker = None
         self.wifi_cli_worker = None
         self.wifi_worker = None
+        self.sketch_precompiler = None
 
         # create a dictionary for setting temp & duration
         self.input_dictionary = []
@@ -69,6 +79,18 @@ class MainWindow(QMainWindow):
         self.current_temperature = None
         self.machine_state = None
         self.timestamp = None
+        self.ping_interval = None  # current ping interval of the serial worker, in seconds
+        # owns the serial ports, so swapping workers does not reopen (and reset) the boards
+        # every byte on the ports goes to a capture file that sessionCapture.py can replay
+        self.session_recorder = SessionRecorder() if self.config.get('record_sessions', False) else None
+        self.port_broker = PortBroker(recorder=self.session_recorder)
+        # compiled sketches are reused while their sources, libraries, board and core stay the same
+        cache_limits = self.config.get('compile_cache', {})
+        self.compile_cache = CompileCache(max_entries=cache_limits.get('max_entries', MAX_ENTRIES),
+                                          max_mb=cache_limits.get('max_mb', MAX_MB))
+        # installed cores are read once per session, in the background; uploads never run 'core list'
+        threading.Thread(target=core_index.refresh, args=(arduinoUtils.run_cli_command,), name='core-index',
+                         daemon=True).start()
 
         # create qtimer instance: after 5 minutes of communication break with serial, control board is reset
         self.no_ping_timer = QTimer(self)
@@ -245,7 +267,13 @@ class MainWindow(QMainWindow):
         if self.selected_c_port and self.selected_t_port:
             if not hasattr(self, 'serial_worker') or self.serial_worker is None or not self.serial_worker.is_running:
                 try:
-                    self.serial_worker = SerialCaptureWorker(port=self.selected_c_port, baudrate=9600)
+                    # open at the rate negotiated last time, the board keeps it until it is reset or left idle
+                    self.serial_worker = SerialCaptureWorker(port=self.selected_c_port,
+                                                             baudrate=self.config.get_baud_rate(self.selected_c_port),
+                                                             telemetry_format=self.config.get('telemetry', 'binary'),
+                                                             ping_intervals=self.config.get('ping_interval'),
+                                                             queue_lookahead=self.config.get('queue_lookahead', 1),
+                                                             broker=self.port_broker)
                     self.serial_worker.update_listbox.connect(self.update_listbox_gui)
                     self.serial_worker.update_chamber_monitor.connect(self.update_chamber_monitor_gui)
                     self.emergency_stop_button.clicked.connect(self.on_emergency_stop_button_clicked)
@@ -259,6 +287,9 @@ class MainWindow(QMainWindow):
                     self.serial_worker.ping_timestamp_signal.connect(self.get_timestamp)
                     self.serial_worker.machine_state_signal.connect(self.emergency_stop_from_arduino)
                     self.serial_worker.test_number_signal.connect(self.update_test_number)
+                    self.serial_worker.baud_rate_negotiated.connect(self.config.set_baud_rate)
+                    self.serial_worker.ping_interval_signal.connect(self.update_ping_interval)
+                    self.serial_worker.emergency_stop_latency.connect(self.show_emergency_stop_latency)
                     self.serial_worker.start()  # start the worker thread
                     logger.info('Serial worker started successfully')
                     self.no_ping_alert = False
@@ -279,8 +310,9 @@ class MainWindow(QMainWindow):
 
             if not hasattr(self, 'test_board') or self.test_board is None or not self.test_board.is_running:
                 try:
-                    self.test_board = TestBoardWorker(self.test_data, self.test_number, port=self.selected_t_port, baudrate=9600)
-                    self.test_board.all_good.connect(self.reset_b_t_timer)
+                    self.test_board = TestBoardWorker(self.test_data, self.test_number, port=self.selected_t_port, baudrate=9600,
+                                                      broker=self.port_broker)
+                    self.test_board.output_summary.connect(self.on_output_summary)
                     self.test_board.start()  # start worker thread
                     logger.info('Test board worker started successfully')
 
@@ -304,7 +336,7 @@ class MainWindow(QMainWindow):
 
             logger.info(f'Starting Wifi Worker on port: {self.selected_t_wifi}')
 
-            self.wifi_worker = WifiWorker(port=self.selected_t_wifi, baudrate=9600)
+            self.wifi_worker = WifiWorker(port=self.selected_t_wifi, baudrate=9600, broker=self.port_broker)
             self.wifi_worker.output_received.connect(self.main_tab.update_wifi_output_listbox)
             self.wifi_worker.output_received.connect(self.check_wifi_output)
             self.wifi_worker.start()
@@ -315,7 +347,7 @@ class MainWindow(QMainWindow):
 
     # trigger emergency stop
     def on_emergency_stop_button_clicked(self):
-        self.serial_worker.trigger_emergency_stop.emit()
+        self.serial_worker.trigger_emergency_stop.emit(time.monotonic())  # click time for the latency report
         message = 'EMERGENCY STOP'
         self.test_interrupted_gui(message)
 
@@ -348,7 +380,7 @@ class MainWindow(QMainWindow):
 
             try:
                 logger.info('Initializing CLI worker for Wifi...')
-                self.wifi_cli_worker = WifiCliWorker(port=self.selected_t_wifi, baudrate=9600)
+                self.wifi_cli_worker = WifiCliWorker(port=self.selected_t_wifi, baudrate=9600, broker=self.port_broker)
                 self.wifi_cli_worker.finished.connect(self.start_wifi_worker)  # Start WiFiWorker after CLIWorker is done
                 self.wifi_cli_worker.output_received.connect(self.update_wifi_output_gui)
                 self.wifi_cli_worker.start()
@@ -417,9 +449,11 @@ class MainWindow(QMainWindow):
                 self.test_board.deleteLater()
                 logger.info('Test board worker temporarily deleted')
                 # initiate cli worker thread
-                self.cli_worker = CliWorker(port=self.selected_t_port, baudrate=9600)
+                self.cli_worker = CliWorker(port=self.selected_t_port, baudrate=9600, broker=self.port_broker,
+                                            compile_cache=self.compile_cache)
                 self.cli_worker.finished.connect(self.cleanup_cli_worker)  # connect finished signal
                 self.cli_worker.update_upper_listbox.connect(self.main_tab.cli_update_upper_listbox_gui)
+                self.cli_worker.cache_stats.connect(self.main_tab.update_build_cache_stats)
                 self.cli_worker.start()  # start cli worker thread
                 self.cli_worker.set_test_data_signal.emit(self.test_data, self.filepath, self.test_number)
                 logger.info('Cli worker started')
@@ -431,26 +465,25 @@ class MainWindow(QMainWindow):
     # clean up cli worker after it's done
     def cleanup_cli_worker(self):
         self.cli_worker.is_running = False
-        self.cli_worker.stop()
-        self.cli_worker.quit()
-        self.cli_worker.wait()
+        self.cli_worker.stop()  # returns as soon as the worker thread is done
         logger.info('Cli worker quit')
         self.cli_worker.deleteLater()
         logger.info('Cli worker deleted')
 
-        time.sleep(1.5)  # time for the port to fully close before restarting
-        # restart test board worker thread
-        self.test_board = TestBoardWorker(self.test_data, self.test_number, port=self.selected_t_port, baudrate=9600)
-        self.test_board.update_upper_listbox.connect(self.main_tab.update_test_output_listbox_gui)
-        self.test_board.update_upper_listbox.connect(self.check_output)
-        self.test_board.all_good.connect(self.reset_b_t_timer)
+        # the cli worker has already taken the port back from the upload
+        self.restart_test_board_after_upload()
+
+    # restart test board worker thread once the upload has released the port
+    def restart_test_board_after_upload(self):
+        self.test_board = TestBoardWorker(self.test_data, self.test_number, port=self.selected_t_port, baudrate=9600,
+                                          broker=self.port_broker)
+        self.test_board.output_summary.connect(self.on_output_summary)
         self.test_board.start()  # start test board thread
         self.test_board.is_running = True
 
         logger.info('Test board worker restarted')
         # update the gui
         self.main_tab.change_test_part_gui(self.test_data)
-        self.test_board.expected_outcome_listbox.connect(self.main_tab.check_output)
 
     # update test number for test coordination
     def update_test_number(self, message):
@@ -458,6 +491,8 @@ class MainWindow(QMainWindow):
         logger.info(f'Current test number: {self.test_number}')
         self.main_tab.update_test_number(self.test_number)
         self.queue_tab.update_test_number(self.test_number)
+        if self.test_board is not None:
+            self.test_board.set_test_number(self.test_number)  # the worker verifies against the new test
 
     # upload sketch for each test separately
     def upload_sketch_for_new_test(self, message):
@@ -473,9 +508,11 @@ class MainWindow(QMainWindow):
             logger.info('Test board worker temporarily deleted for subsequent sketch upload')
 
             # initiate cli worker thread
-            self.cli_worker = CliWorker(port=self.selected_t_port, baudrate=9600)
+            self.cli_worker = CliWorker(port=self.selected_t_port, baudrate=9600, broker=self.port_broker,
+                                        compile_cache=self.compile_cache)
             self.cli_worker.finished.connect(self.cleanup_cli_worker)  # connect finished signal
             self.cli_worker.update_upper_listbox.connect(self.main_tab.cli_update_upper_listbox_gui)
+            self.cli_worker.cache_stats.connect(self.main_tab.update_build_cache_stats)
             self.cli_worker.start()  # start cli worker thread
             self.cli_worker.set_test_data_signal.emit(self.test_data, self.filepath, self.test_number)
             logger.info('Cli worker started for new test upload')
@@ -488,21 +525,22 @@ class MainWindow(QMainWindow):
             logger.info('Cli being interrupted')
             self.cli_worker.finished.disconnect(self.cleanup_cli_worker)
             self.cli_worker.is_running = False
-            self.cli_worker.stop()
-            self.cli_worker.quit()
-            self.cli_worker.wait()
+            self.cli_worker.stop()  # kills a running arduino-cli command and returns right away
             logger.info('Cli worker quit bcs interrupted')
             self.cli_worker.deleteLater()
             logger.info('Cli worker deleted bcs interrupted')
-            time.sleep(1.5)  # time for the port to fully close before restarting
-
-            # restart test board worker thread
-            self.test_board = TestBoardWorker(self.test_data, self.test_number, port=self.selected_t_port, baudrate=9600)
-            self.test_board.all_good.connect(self.reset_b_t_timer)
-            self.test_board.start()  # start test board thread
-            self.test_board.is_running = True
-            logger.info('Test board worker restarted through cli interrupted')
-            self.main_tab.on_run_test_gui()
+            # the new test board worker waits on the broker until the port is back
+            self.restart_test_board_after_interrupt()
+
+    # restart test board worker thread after an interrupted upload
+    def restart_test_board_after_interrupt(self):
+        self.test_board = TestBoardWorker(self.test_data, self.test_number, port=self.selected_t_port, baudrate=9600,
+                                          broker=self.port_broker)
+        self.test_board.output_summary.connect(self.on_output_summary)
+        self.test_board.start()  # start test board thread
+        self.test_board.is_running = True
+        logger.info('Test board worker restarted through cli interrupted')
+        self.main_tab.on_run_test_gui()
 
     # load test file and store it in the app
     def load_test_file(self):
@@ -534,6 +572,7 @@ class MainWindow(QMainWindow):
                 self.serial_worker.trigger_add_test_data_to_queue.emit(test_data)
                 self.filepath = self.json_handler.get_filepath()
                 logger.info(f'Filepath from file handler: {self.filepath}')
+                self.precompile_sketches(test_data)
                 popups.show_info_message('info', 'Test file added to test queue')
             return
 
@@ -556,6 +595,7 @@ class MainWindow(QMainWindow):
                 self.serial_worker.trigger_add_test_data_to_queue.emit(test_data)
                 self.filepath = self.json_handler.get_filepath()
                 logger.info(f'Filepath from file handler: {self.filepath}')
+                self.precompile_sketches(test_data)
                 popups.show_info_message('info', 'Test file added to test queue')
             else:
                 return
@@ -571,10 +611,45 @@ class MainWindow(QMainWindow):
                 self.serial_worker.trigger_add_test_data_to_queue.emit(test_data)
                 self.filepath = self.json_handler.get_filepath()
                 logger.info(f'Filepath from file handler: {self.filepath}')
+                self.precompile_sketches(test_data)
                 popups.show_info_message('info', 'Test file added to test queue')
             else:
                 return
 
+    # compile every sketch of a loaded test file in the background, while the chamber heats up
+    def precompile_sketches(self, test_data):
+        self.retire_sketch_precompiler()  # a newly loaded file replaces the old one's builds
+        if not self.selected_t_port:
+            return
+        self.sketch_precompiler = SketchPrecompiler(test_data, self.filepath, self.selected_t_port, self.compile_cache,
+                                                    workers=self.config.get('precompile_workers', PRECOMPILE_WORKERS))
+        self.sketch_precompiler.progress.connect(self.main_tab.cli_update_upper_listbox_gui)
+        self.sketch_precompiler.compile_failures.connect(self.on_compile_failures)
+        self.sketch_precompiler.cache_stats.connect(self.main_tab.update_build_cache_stats)
+        self.sketch_precompiler.start()
+
+    # stop the previous precompiler; one whose thread is still winding down is kept alive until it has finished
+    def retire_sketch_precompiler(self):
+        precompiler, self.sketch_precompiler = self.sketch_precompiler, None
+        if precompiler is None:
+            return
+        precompiler.setParent(self)  # owned by the window, not destroyed with the last python reference
+        precompiler.finished.connect(precompiler.deleteLater)
+        if precompiler.isRunning():
+            precompiler.stop()  # waits STOP_TIMEOUT_MS at most, the thread may still be running after
+        if not precompiler.isRunning():
+            precompiler.deleteLater()
+
+    # report the sketches that do not compile before the run gets to them
+    def on_compile_failures(self, failures):
+        lines = []
+        for tests, sketch, error in failures:
+            reason = error.splitlines()[-1] if error else 'unknown error'
+            self.main_tab.cli_update_upper_listbox_gui(f'Compilation failed: {sketch}')
+            lines.append(f'{", ".join(tests)}: {sketch}\n    {reason}')
+        popups.show_error_message('Compilation failed',
+                                  f'{len(failures)} sketches of the test file do not compile:\n\n' + '\n'.join(lines))
+
     # clear test queue
     def clear_test_queue(self):
         if not self.serial_worker or not self.serial_worker.is_running:
@@ -782,20 +857,23 @@ class MainWindow(QMainWindow):
             else:
                 return
 
-    # compare expected test outcome with actual test board output
-    def check_output(self, output):
-            output = str(output)
-            expected_output = self.expected_output(self.test_data)
-            if output == '':
-                message = 'Waiting for test board output'
-                self.update_listbox_gui(message)
-            if output == expected_output:
-                return
+    # summary of the test board output, verified in the worker: incorrect output is listed while a test runs
+    def on_output_summary(self, summary):
+        if summary['new_lines']:
+            self.reset_b_t_timer()  # the test board is alive
+        mismatch = summary['last_mismatch']
+        if summary['new_failures'] and self.test_is_running:
+            date_str = datetime.now().strftime("%H:%M:%S")
+            if mismatch['lines'] > 1:
+                # position within a multi-line expected output
+                error_message = (f"{date_str}   line {mismatch['line'] + 1}, column {mismatch['column'] + 1}: "
+                                 f"{mismatch['received']}")
             else:
-                if self.test_is_running:
-                    date_str = datetime.now().strftime("%H:%M:%S")
-                    error_message = f"{date_str}   {output}"
-                    self.incorrect_output_gui(error_message)
+                error_message = f"{date_str}   {mismatch['received']}"
+            if summary['new_failures'] > 1:
+                error_message += f"   (and {summary['new_failures'] - 1} more incorrect)"
+            self.incorrect_output_gui(error_message)
+        self.main_tab.show_output_summary(summary)
 
     def check_wifi_output(self, output):
         output = str(output)
@@ -846,11 +924,29 @@ class MainWindow(QMainWindow):
         self.machine_state = message.get('machine_state')
         # create a displayable info string
         status = f'Current temp: {formatted_current_temp}°C | target temp: {desired_temp}°C | machine state: {self.machine_state}'
+        if self.ping_interval:
+            status += f' | ping every {self.ping_interval:g} s'
         self.chamber_monitor.clear()  # clear old data
         item = QListWidgetItem(status)  # add string as a widget
         item.setTextAlignment(Qt.AlignCenter)   # align it to center
         self.chamber_monitor.addItem(item)  # display it
 
+    # store the ping interval currently used by the serial worker, shown in the chamber monitor
+    def update_ping_interval(self, interval):
+        self.ping_interval = interval
+        logger.info(f'Ping interval is now {interval} s')
+
+    # show how long the last emergency stop took to reach and stop the control board
+    def show_emergency_stop_latency(self, latency):
+        wire = f'{latency["wire_ms"]:.0f} ms' if latency['wire_ms'] is not None else 'never'
+        if latency['confirmed_ms'] is None:
+            message = f'Emergency stop sent after {wire} but NOT confirmed by the control board'
+            self.incorrect_output_gui(message)
+        else:
+            message = f'Emergency stop sent after {wire}, confirmed after {latency["confirmed_ms"]:.0f} ms'
+            self.update_listbox_gui(message)
+        logger.info(message)
+
     # get timestamp from ping
     def get_timestamp(self, timestamp):
         if not timestamp:
@@ -1031,50 +1127,67 @@ class MainWindow(QMainWindow):
         if self.serial_worker is not None:
             if hasattr(self.serial_worker, 'is_running') and self.serial_worker.is_running:
                 logger.info("Stopping serial worker...")
-                self.serial_worker.stop()
-                self.serial_worker.quit()
-                self.serial_worker.wait()
+                self.serial_worker.stop()  # cancels blocking reads and waits for the thread
                 logger.info("Serial worker stopped.")
 
         # Gracefully stop the test board worker if it's running
         if self.test_board is not None:
             if hasattr(self.test_board, 'is_running') and self.test_board.is_running:
                 logger.info("Stopping test board worker...")
-                self.test_board.stop()
-                self.test_board.quit()
-                self.test_board.wait()
+                self.test_board.stop()  # cancels blocking reads and waits for the thread
                 logger.info("Test board worker stopped.")
 
+        # Stop precompiling the test file's sketches
+        if self.sketch_precompiler is not None and self.sketch_precompiler.isRunning():
+            logger.info("Stopping sketch precompiler...")
+            self.sketch_precompiler.stop()  # kills the compiles in progress
+
         # Stop the CLI worker if it's running
         if self.cli_worker is not None:
             if hasattr(self.cli_worker, 'is_running') and self.cli_worker.is_running:
                 logger.info("Stopping CLI worker...")
-                self.cli_worker.stop()
-                self.cli_worker.quit()
-                self.cli_worker.wait()
+                self.cli_worker.stop()  # cancels blocking reads and waits for the thread
                 logger.info("CLI worker stopped.")
 
         # Stop the Wifi CLI worker if it's running
         if self.wifi_cli_worker is not None:
             if hasattr(self.wifi_cli_worker, 'is_running') and self.wifi_cli_worker.is_running:
                 logger.info("Stopping Wifi CLI worker...")
-                self.wifi_cli_worker.stop()
-                self.wifi_cli_worker.quit()
-                self.wifi_cli_worker.wait()
+                self.wifi_cli_worker.stop()  # cancels blocking reads and waits for the thread
                 logger.info("CLI worker stopped.")
 
         # Stop the WiFi worker if it's running
         if self.wifi_worker is not None:
             if hasattr(self.wifi_worker, 'is_running') and self.wifi_worker.is_running:
                 logger.info("Stopping WiFi worker...")
-                self.wifi_worker.stop()
-                self.wifi_worker.quit()
-                self.wifi_worker.wait()
+                self.wifi_worker.stop()  # cancels blocking reads and waits for the thread
                 logger.info("WiFi worker stopped.")
 
+        self.port_broker.close_all()
+        self.wait_for_workers()
+        if self.session_recorder:
+            self.session_recorder.close()
         logger.info("Application is closing.")
         event.accept()  # ensure the application closes
 
+    # stop() waits STOP_TIMEOUT_MS at most; qt aborts if a thread is destroyed while it still runs, so wait for
+    # any worker still stuck in a blocking call, and terminate it if it does not end in time
+    def wait_for_workers(self):
+        workers = [self.serial_worker, self.test_board, self.cli_worker, self.wifi_cli_worker, self.wifi_worker,
+                   self.sketch_precompiler] + self.findChildren(SketchPrecompiler)  # retired precompilers too
+        for worker in workers:
+            try:
+                if worker is None or not worker.isRunning():
+                    continue
+            except RuntimeError:
+                continue  # already deleted after it finished
+            name = type(worker).__name__
+            logger.warning(f'{name} still running after stop, waiting for it')
+            if not worker.wait(SHUTDOWN_TIMEOUT_MS):
+                logger.error(f'{name} did not end within {SHUTDOWN_TIMEOUT_MS} ms, terminating it')
+                worker.terminate()
+                worker.wait()
+
 # method responsible for running the app
 def main():
     app = QApplication(sys.argv)
@@ -1082,5 +1195,7 @@ def main():
     window.show()
     sys.exit(app.exec_())
 
-main()
+
+if __name__ == '__main__':
+    main()
 
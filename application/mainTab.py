@@ -16,6 +16,7 @@ class MainTab(QWidget):
         self.test_data = test_data
         # test number (index, actually) for checking exp output correctly
         self.test_number = 0
+        self.output_correct = None  # colour the test output currently has, None before the first verdict
         self.initUI()
 
     def initUI(self):
@@ -52,6 +53,10 @@ class MainTab(QWidget):
                                       )
         self.run_button.setEnabled(False)
         test_output_layout.addWidget(self.instruction_listbox)
+        # compile cache statistics, shown from the first sketch upload on
+        self.build_cache_label = QLabel('', self)
+        self.build_cache_label.hide()
+        test_output_layout.addWidget(self.build_cache_label)
         test_part_layout.addLayout(test_button_layout)
 
         # add run tests button
@@ -135,6 +140,22 @@ class MainTab(QWidget):
         self.test_output_listbox.addItem(f'{message}')
         self.test_output_listbox.scrollToBottom()
 
+    # hit/miss statistics of the compile cache
+    def update_build_cache_stats(self, stats):
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = f'{stats["hits"] / lookups:.0%}' if lookups else '-'
+        self.build_cache_label.setText(f'Build cache: {stats["hits"]} hits, {stats["misses"]} misses ({hit_rate}), '
+                                       f'{stats["entries"]} builds, {stats["size_mb"]:.1f} MB')
+        self.build_cache_label.show()
+
+    # show how fast the test board output is coming in
+    def update_test_output_rate(self, lines_per_second, bytes_per_second):
+        if lines_per_second:
+            self.test_output_label.setText(f'Test Board Output  ({lines_per_second:,.0f} lines/s, '
+                                           f'{bytes_per_second / 1000:,.1f} kB/s)')
+        else:
+            self.test_output_label.setText('Test Board Output')
+
     # update exp output listbox
     def expected_output_listbox(self):
         expected_output = self.expected_output(self.test_data)
@@ -166,17 +187,19 @@ class MainTab(QWidget):
             else:
                 return
 
-    # check if output is as expected
-    def check_output(self, message):
-        message = str(message) if message else None
-        expected_output = self.expected_output(self.test_data)
-        # compare t-board output with expected test outcome
-        if str(expected_output) == message:
+    # latest test board line, coloured by the worker's latest verdict, and the output rate
+    def show_output_summary(self, summary):
+        if summary['new_lines'] and summary['latest'] is not None:
+            self.update_test_output_listbox_gui(summary['latest'])
+        self.update_test_output_rate(summary['lines_per_second'], summary['bytes_per_second'])
+        # style sheets are only set when the colour changes
+        correct = summary['correct']
+        if not summary['passed'] + summary['failed'] or correct == self.output_correct:
+            return
+        self.output_correct = correct
+        if correct:
             self.update_gui_correct()
-            logger.info('Correct test output')
         else:
-            logger.error(message)
-            # if no matches, handle as incorrect output
             self.update_gui_incorrect()
 
     # gui for correct output
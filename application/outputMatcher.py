@@ -0,0 +1,183 @@
+import os
+import re
+import time
+from serialReader import LineScanner
+
+WILDCARD = '***'  # stands for any text in a test's expected_output
+MATCH, MISMATCH, RESYNC = 'match', 'mismatch', 'resync'  # verdicts of BlockMatcher
+SUMMARY_INTERVAL = 0.25  # seconds between summaries to the gui, however fast the board prints
+RATE_INTERVAL = 1.0  # seconds over which lines/s and bytes/s are measured
+
+
+# expected output of one test, compiled once: a plain comparison for deterministic output,
+# a single compiled regex when it has *** wildcards
+class OutputMatcher:
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.expected_bytes = expected.encode('utf-8')
+        self.deterministic = WILDCARD not in expected
+        self.pattern = None
+        if not self.deterministic:
+            self.pattern = re.compile('.*'.join(re.escape(part) for part in expected.split(WILDCARD)), re.DOTALL)
+
+    # True if the line is the expected output
+    def matches(self, line):
+        if self.deterministic:
+            return line == self.expected
+        return self.pattern.fullmatch(line) is not None
+
+    # index of the first character where a line that does not match departs from the expected output
+    def mismatch_column(self, line):
+        if self.deterministic:
+            return len(os.path.commonprefix([line, self.expected]))
+        parts = self.expected.split(WILDCARD)
+        if not line.startswith(parts[0]):
+            return len(os.path.commonprefix([line, parts[0]]))
+        at = len(parts[0])
+        for part in parts[1:-1]:
+            found = line.find(part, at)
+            if found < 0:
+                return at
+            at = found + len(part)
+        return at  # the text after the last wildcard is missing
+
+
+# expected output of one or more lines, checked as the lines arrive: a state machine over the expected lines
+# that keeps only its position, so the output is never buffered or scanned twice
+class BlockMatcher:
+
+    def __init__(self, expected):
+        lines = expected if isinstance(expected, list) else expected.splitlines()
+        self.lines = [OutputMatcher(line) for line in lines] or [OutputMatcher('')]
+        self.fallback = fallback_table([line.expected for line in self.lines])
+        self.position = 0  # expected line the next received line is checked against
+        self.synced = True  # False from a mismatch until a whole block has matched again
+        self.scanner = LineScanner()
+        self.received = 0  # lines checked
+        self.blocks = 0  # complete blocks matched
+
+    # expected line the next received line is checked against
+    def current(self):
+        return self.lines[self.position]
+
+    # check one received line; a verdict dict once something is decided, None while a block is in progress
+    def feed_line(self, line):
+        self.received += 1
+        expected = self.lines[self.position]
+        if expected.matches(line):
+            self.position += 1
+            return self.complete_block() if self.position == len(self.lines) else None
+        verdict = {'verdict': MISMATCH, 'line': self.position, 'column': expected.mismatch_column(line),
+                   'expected': expected.expected, 'received': line, 'lines': len(self.lines)}
+        self.synced = False
+        # resynchronise: the longest start of the block that the lines received so far may still end in
+        position = self.fallback[self.position - 1] if self.position else 0
+        while position and not self.lines[position].matches(line):
+            position = self.fallback[position - 1]
+        # never completes the block here: the fallback is always shorter than the position that failed
+        self.position = position + 1 if self.lines[position].matches(line) else 0
+        return verdict
+
+    # received bytes, split into lines here; the verdicts in order
+    def feed(self, data):
+        verdicts = []
+
+        def handle_line(view):
+            line = str(view, 'utf-8', 'replace').strip()
+            if line:
+                verdict = self.feed_line(line)
+                if verdict:
+                    verdicts.append(verdict)
+
+        self.scanner.feed(data, handle_line)
+        return verdicts
+
+    def complete_block(self):
+        self.position = 0
+        self.blocks += 1
+        verdict = {'verdict': MATCH if self.synced else RESYNC, 'lines': len(self.lines)}
+        self.synced = True
+        return verdict
+
+    # start over, e.g. when the test board is reset
+    def reset(self):
+        self.position = 0
+        self.synced = True
+        self.scanner.clear()
+
+
+# knuth-morris-pratt failure function over the expected lines: for each prefix, the length of its longest
+# proper prefix that is also a suffix (lines with wildcards only count as equal to the same wildcard line)
+def fallback_table(lines):
+    table = [0] * len(lines)
+    length = 0
+    for index in range(1, len(lines)):
+        while length and lines[index] != lines[length]:
+            length = table[length - 1]
+        if lines[index] == lines[length]:
+            length += 1
+        table[index] = length
+    return table
+
+
+# running totals of a worker's verdicts, handed to the gui as one small dict at most every SUMMARY_INTERVAL
+class VerdictSummary:
+
+    def __init__(self):
+        self.passed = 0  # lines or blocks that matched
+        self.failed = 0  # mismatches
+        self.last_mismatch = None  # verdict dict of the latest mismatch
+        self.latest = None  # latest line received
+        self.correct = True  # False while the latest verdict is a mismatch
+        self.new_failures = 0  # mismatches since the last summary
+        self.lines = 0  # lines at the last summary
+        self.last_summary = 0.0
+        self.rate_started = time.monotonic()
+        self.rate_lines = 0
+        self.rate_bytes = 0
+        self.lines_per_second = 0.0
+        self.bytes_per_second = 0.0
+
+    # count a verdict of the matcher
+    def add(self, verdict):
+        if verdict['verdict'] == MISMATCH:
+            self.failed += 1
+            self.new_failures += 1
+            self.last_mismatch = verdict
+            self.correct = False
+        else:
+            self.passed += 1
+            self.correct = True
+
+    # summary dict once one is due and something has changed, None otherwise; final gives the last one
+    # with the rates back at zero
+    def take(self, now, lines, received_bytes, final=False):
+        if not final and now - self.last_summary < SUMMARY_INTERVAL:
+            return None
+        rate_changed = False
+        elapsed = now - self.rate_started
+        if final or elapsed >= RATE_INTERVAL:
+            lines_per_second = (lines - self.rate_lines) / elapsed if not final else 0.0
+            bytes_per_second = (received_bytes - self.rate_bytes) / elapsed if not final else 0.0
+            rate_changed = (lines_per_second, bytes_per_second) != (self.lines_per_second, self.bytes_per_second)
+            self.lines_per_second, self.bytes_per_second = lines_per_second, bytes_per_second
+            self.rate_started, self.rate_lines, self.rate_bytes = now, lines, received_bytes
+        if not final and lines == self.lines and not rate_changed:
+            return None
+        summary = {
+            'lines': lines,
+            'new_lines': lines - self.lines,
+            'passed': self.passed,
+            'failed': self.failed,
+            'new_failures': self.new_failures,
+            'last_mismatch': self.last_mismatch,
+            'latest': self.latest,
+            'correct': self.correct,
+            'lines_per_second': self.lines_per_second,
+            'bytes_per_second': self.bytes_per_second,
+        }
+        self.lines = lines
+        self.new_failures = 0
+        self.last_summary = now
+        return summary
@@ -0,0 +1,70 @@
+import time
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# default ping intervals in seconds, overridable through the 'ping_interval' config entry
+DEFAULT_PING_INTERVALS = {
+    'min': 0.25,        # close to a sequence transition
+    'active': 0.5,      # heating, cooling, evaluating
+    'idle': 2.0,        # nothing going on
+    'max': 8.0,         # upper bound when backing off
+}
+TRANSITION_WINDOW = 10.0  # seconds before the end of a sequence that count as 'near a transition'
+BACKOFF_FACTOR = 2.0  # interval multiplier for every missed ping response
+ACTIVE_STATES = ('HEATING', 'COOLING', 'EVALUATE')
+
+
+# decides when the next ping is due, based on machine state, time left and missed responses
+class PingScheduler:
+
+    def __init__(self, intervals=None):
+        self.intervals = dict(DEFAULT_PING_INTERVALS)
+        if intervals:
+            self.intervals.update({key: float(value) for key, value in intervals.items() if key in self.intervals})
+        self.base_interval = self.intervals['active']  # interval chosen from the last known state
+        self.interval = self.base_interval  # interval in use, including backoff
+        self.missed = 0  # consecutive ping responses that never came
+        self.last_ping = 0.0
+
+    # seconds until the next ping should be sent
+    def next_ping_in(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.last_ping + self.interval - now)
+
+    # check if a ping should be sent now
+    def is_due(self, now=None):
+        return self.next_ping_in(now) == 0.0
+
+    # a ping has just been sent
+    def ping_sent(self, now=None):
+        self.last_ping = time.monotonic() if now is None else now
+
+    # a ping response arrived: pick the interval for this state and stop backing off
+    def on_response(self, machine_state, time_left, is_test_running):
+        if is_test_running and 0 < time_left <= TRANSITION_WINDOW:
+            interval = self.intervals['min']
+        elif machine_state in ACTIVE_STATES or is_test_running:
+            interval = self.intervals['active']
+        else:
+            interval = self.intervals['idle']
+        self.base_interval = self.clamp(interval)
+        self.missed = 0
+        return self.update(self.base_interval)
+
+    # a ping response is missing: back off exponentially
+    def on_missed(self):
+        self.missed += 1
+        return self.update(self.clamp(self.base_interval * BACKOFF_FACTOR ** self.missed))
+
+    # keep an interval inside the configured bounds
+    def clamp(self, interval):
+        return min(self.intervals['max'], max(self.intervals['min'], interval))
+
+    # set the interval in use, returning True when it changed
+    def update(self, interval):
+        if interval == self.interval:
+            return False
+        logger.info(f'Ping interval changed from {self.interval:.2f} s to {interval:.2f} s')
+        self.interval = interval
+        return True
@@ -0,0 +1,286 @@
+import os
+import threading
+import time
+from queue import Queue, Empty, Full
+import serial
+from serial.tools import list_ports
+from logger_config import setup_logger
+from serialReader import LineFramer
+from serialTransport import SerialTransport
+
+logger = setup_logger(__name__)
+
+BOOT_TIME = 1.0  # seconds an arduino needs after the reset that comes with opening its port
+REACQUIRE_POLL = 0.05  # seconds between checks for a device that is re-enumerating
+REACQUIRE_TIMEOUT = 15.0  # give up on a device that does not come back after an upload
+CHANNEL_BACKLOG = 1000  # lines (or chunks) a channel holds for its subscriber, the oldest are dropped beyond
+
+
+# check if a device is currently present (pty and tty paths exist, com ports are listed)
+def device_present(device):
+    if os.path.exists(device):
+        return True
+    return any(port.device == device for port in list_ports.comports())
+
+
+# a subscriber's view of a brokered port, with the same interface the workers use on a SerialTransport
+class BrokerChannel:
+
+    def __init__(self, brokered_port, name, raw=False):
+        self.brokered_port = brokered_port
+        self.port = brokered_port.device
+        self.name = name
+        self.raw = raw  # raw channels get byte chunks, the others complete lines
+        self.ser = None  # the port belongs to the broker
+        self.items = Queue(maxsize=CHANNEL_BACKLOG)  # a subscriber that stops reading cannot grow it forever
+        self.dropped = 0  # items dropped because the subscriber fell behind
+        self.cancelled = threading.Event()
+        self.closed = False
+
+    # wait until the broker has the port open and the board has booted; False if cancelled meanwhile
+    def open(self, settle=0.0):
+        return self.brokered_port.wait_ready(self.cancelled)
+
+    # the channel is subscribed, even while the port itself is released for an upload
+    def is_open(self):
+        return not self.closed
+
+    # sleep that returns early, with False, once the channel is cancelled
+    def wait(self, seconds):
+        if seconds <= 0:
+            return not self.cancelled.is_set()
+        return not self.cancelled.wait(seconds)
+
+    # called by the port's reader thread; drops the oldest item when the subscriber has fallen behind
+    def deliver(self, item):
+        while True:
+            try:
+                self.items.put_nowait(item)
+                return
+            except Full:
+                try:
+                    self.items.get_nowait()
+                except Empty:
+                    continue
+                if self.dropped == 0:
+                    logger.warning(f'{self.name} is not reading {self.port}, dropping its oldest data')
+                self.dropped += 1
+
+    # next line (or byte chunk on raw channels); None on cancel or once timeout seconds have passed
+    def readline(self, timeout=None):
+        if self.cancelled.is_set():
+            return None
+        try:
+            return self.items.get(timeout=timeout)  # cancel() puts None to wake this up
+        except Empty:
+            return None
+
+    # next byte chunk on a raw channel, b'' on cancel or once timeout seconds have passed
+    def read_available(self, timeout=None):
+        return self.readline(timeout) or b''
+
+    # write to the shared port
+    def write(self, data):
+        self.brokered_port.write(data)
+
+    # wake up a blocked read, the subscription stays
+    def cancel(self):
+        self.cancelled.set()
+        self.deliver(None)
+
+    # unsubscribe, the broker keeps the port open for the next subscriber
+    def close(self):
+        if self.closed:
+            return
+        self.cancel()
+        self.closed = True
+        self.brokered_port.unsubscribe(self)
+
+
+# one physical port: opened once, read by a single thread and fanned out to every channel
+class BrokeredPort:
+
+    def __init__(self, device, baudrate, recorder=None):
+        self.device = device
+        self.baudrate = baudrate
+        self.recorder = recorder
+        self.transport = SerialTransport(device, baudrate, recorder=recorder)
+        self.lock = threading.Lock()  # guards opening, releasing and the channel list
+        self.channels = []
+        self.ready = threading.Event()  # open and past the boot time
+        self.released = False  # handed over for an upload, nobody may reopen it
+        self.reader = None
+
+    # add a subscriber
+    def subscribe(self, channel):
+        with self.lock:
+            self.channels.append(channel)
+
+    # remove a subscriber
+    def unsubscribe(self, channel):
+        with self.lock:
+            if channel in self.channels:
+                self.channels.remove(channel)
+
+    # open the port if nobody has yet and wait for the board to boot; False when cancelled or timed out
+    def wait_ready(self, cancelled, timeout=REACQUIRE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while not cancelled.is_set():
+            if self.ready.is_set():
+                return True
+            if not self.released and self.try_open(cancelled):
+                return True
+            if time.monotonic() >= deadline:
+                logger.error(f'{self.device} did not become available within {timeout:g} s')
+                return False
+            cancelled.wait(REACQUIRE_POLL)
+        return False
+
+    # open the port once the device is present, True when it is open and the board has booted
+    def try_open(self, cancelled):
+        with self.lock:
+            if self.ready.is_set():
+                return True
+            if self.released or not device_present(self.device):
+                return False
+            try:
+                self.transport = SerialTransport(self.device, self.baudrate, recorder=self.recorder)
+                self.transport.open()
+            except serial.SerialException as e:
+                logger.debug(f'{self.device} not ready yet: {e}')
+                return False
+            opened_at = time.monotonic()
+            self.reader = threading.Thread(target=self.read_loop, args=(self.transport,),
+                                           name=f'broker-{self.device}', daemon=True)
+            self.reader.start()
+        logger.info(f'Broker opened {self.device} at {self.baudrate} baud')
+        # opening resets the board, wait for it to boot before anyone writes
+        if cancelled.wait(max(0.0, opened_at + BOOT_TIME - time.monotonic())):
+            return False
+        with self.lock:
+            if self.transport.is_open() and not self.released:
+                self.ready.set()
+        return self.ready.is_set()
+
+    # read everything from the port and hand it to every subscriber
+    def read_loop(self, transport):
+        framer = LineFramer()
+        try:
+            while True:
+                data = transport.read_available()
+                if not data:
+                    break  # transport closed
+                with self.lock:
+                    channels = list(self.channels)
+                # raw subscribers split lines themselves, only decode them here for the others
+                lines = framer.feed(data) if not all(channel.raw for channel in channels) else ()
+                for channel in channels:
+                    if channel.raw:
+                        channel.deliver(data)
+                    else:
+                        for line in lines:
+                            channel.deliver(line)
+        except (serial.SerialException, OSError, TypeError) as e:
+            logger.error(f'Broker lost {self.device}: {e}')
+            with self.lock:
+                self.ready.clear()
+            transport.close()  # the next wait_ready reopens it once the device is back
+
+    # write to the port if it is open
+    def write(self, data):
+        if not self.ready.is_set():
+            logger.warning(f'{self.device} is not available, dropping {len(data)} bytes')
+            return
+        self.transport.write(data)
+
+    # close the port for someone else (arduino-cli upload), subscribers stay and just see no data
+    def release(self):
+        with self.lock:
+            self.released = True
+            self.ready.clear()
+            transport = self.transport
+        transport.close()
+        logger.info(f'Broker released {self.device}')
+
+    # take the port back as soon as the device has re-enumerated
+    def reacquire(self, cancelled, timeout=REACQUIRE_TIMEOUT):
+        with self.lock:
+            self.released = False
+        started = time.monotonic()
+        if self.wait_ready(cancelled, timeout):
+            logger.info(f'Broker reacquired {self.device} after {time.monotonic() - started:.2f} s')
+            return True
+        return False
+
+    # close for good
+    def close(self):
+        with self.lock:
+            self.released = True
+            self.ready.clear()
+            channels = list(self.channels)
+            transport = self.transport
+        for channel in channels:
+            channel.cancel()
+        transport.close()
+
+
+# owns every serial port of the app and multiplexes the line-based ones to their subscribers
+class PortBroker:
+
+    def __init__(self, recorder=None):
+        self.lock = threading.Lock()
+        self.recorder = recorder  # SessionRecorder given to every transport, if sessions are recorded
+        self.ports = {}  # device -> BrokeredPort
+        self.transports = {}  # device -> SerialTransport used exclusively by one worker
+
+    # get a channel on a shared port, opened on first use and kept open between subscribers
+    def subscribe(self, device, baudrate, name, raw=False):
+        with self.lock:
+            if device in self.transports:
+                raise ValueError(f'{device} is used exclusively and cannot be shared')
+            brokered_port = self.ports.get(device)
+            if brokered_port is None:
+                brokered_port = self.ports[device] = BrokeredPort(device, baudrate, self.recorder)
+            elif brokered_port.baudrate != baudrate:
+                logger.warning(f'{name} asked for {baudrate} baud on {device}, '
+                               f'which is shared at {brokered_port.baudrate} baud')
+        channel = BrokerChannel(brokered_port, name, raw)
+        brokered_port.subscribe(channel)
+        logger.info(f'{name} subscribed to {device}')
+        return channel
+
+    # get the transport of a port that one worker drives on its own (e.g. baud rate switching)
+    def exclusive(self, device, baudrate):
+        with self.lock:
+            if device in self.ports:
+                raise ValueError(f'{device} is shared and cannot be used exclusively')
+            transport = self.transports.get(device)
+            if transport is None:
+                transport = self.transports[device] = SerialTransport(device, baudrate, recorder=self.recorder)
+            transport.baudrate = baudrate
+            return transport
+
+    # close a shared port for an upload
+    def release(self, device):
+        brokered_port = self.ports.get(device)
+        if brokered_port:
+            brokered_port.release()
+
+    # reopen a released port as soon as it is back, blocking until then (or cancelled/timed out)
+    def reacquire(self, device, cancelled=None, timeout=REACQUIRE_TIMEOUT):
+        brokered_port = self.ports.get(device)
+        if brokered_port is None:
+            return False
+        return brokered_port.reacquire(cancelled or threading.Event(), timeout)
+
+    # close every port, on shutdown
+    def close_all(self):
+        with self.lock:
+            ports = list(self.ports.values())
+            transports = list(self.transports.values())
+            self.ports.clear()
+            self.transports.clear()
+        for brokered_port in ports:
+            brokered_port.close()
+        for transport in transports:
+            transport.close()
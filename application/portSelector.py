@@ -31,7 +31,7 @@ class PortSelector(QWidget):
 
         self.refresh_button = QPushButton('refresh')
         self.refresh_button.setFixedSize(80, 37)
-        self.refresh_button.clicked.connect(self.refresh_ports)
+        self.refresh_button.clicked.connect(lambda: self.refresh_ports(refresh=True))
 
         self.enable_wifi_checkbox = QCheckBox('Enable Wifi')
         self.enable_wifi_checkbox.setChecked(False)
@@ -137,12 +137,12 @@ class PortSelector(QWidget):
                     break
         else: return
 
-    # refresh ports (independent of config)
-    def refresh_ports(self):
+    # refresh ports (independent of config); the refresh button always lists the boards again
+    def refresh_ports(self, refresh=False):
         logger.info('Refreshing available ports...')
         self.ports_refreshed.emit()  # emit signal to re-enable start button click
         try:
-            ports_and_boards = arduinoUtils.get_arduino_boards()  # should be [(port, board_name), (port, board_name)]
+            ports_and_boards = arduinoUtils.get_arduino_boards(refresh)  # should be [(port, board_name), (port, board_name)]
             if not ports_and_boards:
                 logger.warning('No boards connected')
                 return None
@@ -0,0 +1,122 @@
+import json
+import time
+from threading import Lock
+import commands
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+MAX_FRAME_BYTES = 1000  # the firmware reads each line into a 1024 byte buffer
+DEFAULT_WINDOW = 2  # frames in flight when the control board does not say otherwise
+WINDOW_BYTES = 512  # bytes in flight, keeps the control board's serial receive buffer from overflowing
+ACK_TIMEOUT = 1.0  # seconds to wait for an ack on top of the time the frame needs on the wire
+MAX_RETRIES = 5  # retransmissions of the same frame before the upload is given up
+
+
+# encoded QUEUE_TEST frame for a test at a plan index
+def encode_frame(seq, name, test, index):
+    return json.dumps(commands.queue_test(seq, name, test, index))
+
+
+# tests too big for the control board's line buffer
+def oversized_tests(tests, first_index=0):
+    return [name for seq, (name, test) in enumerate(tests.items())
+            if len(encode_frame(seq, name, test, first_index + seq)) + 1 > MAX_FRAME_BYTES]
+
+
+# go-back-n upload of the test queue, one test per QUEUE_TEST frame, acknowledged by sequence number
+class QueueUpload:
+
+    def __init__(self, tests, byte_time, first_index=0, window=DEFAULT_WINDOW, ack_timeout=ACK_TIMEOUT):
+        self.lock = Lock()  # started from the gui thread, acks and timeouts are handled in the worker thread
+        self.names = list(tests)
+        # frames carry the plan index so the control board can report which test it is running
+        self.frames = [encode_frame(seq, name, tests[name], first_index + seq) for seq, name in enumerate(self.names)]
+        self.byte_time = byte_time  # seconds one byte takes on the wire at the current baud rate
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.started = False  # the control board answered QUEUE_BEGIN
+        self.base = 0  # oldest frame not acknowledged yet
+        self.next_seq = 0  # next frame to send
+        self.deadlines = {}  # seq -> time its ack is due
+        self.retries = 0  # retransmissions of the frame at base
+        self.rejected = []  # (name, error) for tests the control board refused
+        self.failed = False
+        self.started_at = time.monotonic()
+
+    # the control board is ready for frames, it may ask for a smaller or larger window
+    def start(self, window=None):
+        with self.lock:
+            if window:
+                self.window = max(1, int(window))
+            self.started = True
+
+    # all tests acknowledged
+    def is_complete(self):
+        return self.base >= len(self.frames)
+
+    # upload still needs attention
+    def is_active(self):
+        return self.started and not self.failed and not self.is_complete()
+
+    # frames that fit into the window right now, marked as sent
+    def take_sendable(self, now=None):
+        now = time.monotonic() if now is None else now
+        sendable = []
+        with self.lock:
+            if not self.is_active():
+                return sendable
+            in_flight = sum(len(self.frames[seq]) + 1 for seq in range(self.base, self.next_seq))
+            while self.next_seq < len(self.frames) and self.next_seq - self.base < self.window:
+                size = len(self.frames[self.next_seq]) + 1
+                # always allow one frame, otherwise stay inside the byte window
+                if self.next_seq > self.base and in_flight + size > WINDOW_BYTES:
+                    break
+                in_flight += size
+                # the ack cannot come before every byte up to this frame has gone out
+                self.deadlines[self.next_seq] = now + self.ack_timeout + in_flight * self.byte_time
+                sendable.append(self.frames[self.next_seq])
+                self.next_seq += 1
+        return sendable
+
+    # cumulative ack: every frame before next_expected has been received, returns True on completion
+    def on_ack(self, seq, next_expected, error=None):
+        with self.lock:
+            if not self.started:
+                return False  # late ack from an earlier upload
+            if error and seq < len(self.names):
+                logger.warning(f'Control board rejected test {self.names[seq]}: {error}')
+                self.rejected.append((self.names[seq], error))
+            if next_expected > self.base:
+                for acked in range(self.base, min(next_expected, self.next_seq)):
+                    self.deadlines.pop(acked, None)
+                self.base = min(next_expected, len(self.frames))
+                self.next_seq = max(self.next_seq, self.base)
+                self.retries = 0
+            return self.is_complete()
+
+    # go back to the oldest unacknowledged frame once its ack is overdue, returns False when giving up
+    def check_timeout(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if not self.is_active() or self.base >= self.next_seq:
+                return True
+            if now < self.deadlines.get(self.base, now):
+                return True
+            self.retries += 1
+            if self.retries > MAX_RETRIES:
+                logger.error(f'No ack for test {self.names[self.base]} after {MAX_RETRIES} retries, upload aborted')
+                self.failed = True
+                return False
+            logger.warning(f'No ack for test {self.names[self.base]}, resending from frame {self.base}')
+            self.next_seq = self.base
+            self.deadlines.clear()
+            return True
+
+    # seconds until the oldest ack is due, None when nothing is in flight
+    def next_deadline_in(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if not self.is_active() or self.base >= self.next_seq:
+                return None
+            return max(0.0, self.deadlines.get(self.base, now) - now)
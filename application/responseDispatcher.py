@@ -0,0 +1,80 @@
+import json
+import re
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# known text lines from the control board firmware, in priority order: (name, regex matched at line start)
+TEXT_RESPONSES = [
+    ('setting', r'Setting|Target temperature reached!'),
+    ('test_completed', r'.*?Test completed:'),  # may follow other output on the same line
+    ('waiting', r'Waiting'),
+    ('sequence_complete', r'Sequence complete'),
+    ('all_tests_completed', r'All tests completed!'),
+    ('emergency_stop', r'Emergency Stop initiated'),
+]
+
+
+# classify control board lines in one pass and route them to their handlers
+class ResponseDispatcher:
+
+    def __init__(self, text_handlers, json_handlers, fallback, json_hook=None, frame_decoder=None):
+        # one alternation regex over every known message, the matching group names the handler
+        self.text_regex = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in TEXT_RESPONSES))
+        self.text_handlers = text_handlers  # name -> handler(line)
+        self.json_handlers = json_handlers  # top-level key -> handler(payload)
+        self.fallback = fallback  # handler(line) for everything else
+        # called first with (key, payload) for every json response, returns True if it consumed it
+        self.json_hook = json_hook
+        # turns a binary frame into (key, payload), routed like a json response
+        self.frame_decoder = frame_decoder
+
+    # route one stripped line (or binary frame)
+    def dispatch(self, line):
+        if isinstance(line, bytes):
+            self.dispatch_frame(line)
+            return
+        if line.startswith('{'):
+            self.dispatch_json(line)
+            return
+        match = self.text_regex.match(line)
+        if match:
+            handler = self.text_handlers.get(match.lastgroup)
+            if handler:
+                handler(line)
+                return
+        self.fallback(line)
+
+    # parse a json line once and route each top-level key with its pre-parsed payload
+    def dispatch_json(self, line):
+        try:
+            parsed = json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning(f'Could not parse json from arduino: {line}')
+            self.fallback(line)
+            return
+        if not isinstance(parsed, dict):
+            self.fallback(line)
+            return
+        for key, payload in parsed.items():
+            if not self.route(key, payload):
+                self.fallback(line)
+
+    # decode a binary frame and route its payload
+    def dispatch_frame(self, frame):
+        if not self.frame_decoder:
+            logger.warning(f'Binary frame received but no decoder is set: {frame.hex()}')
+            return
+        key, payload = self.frame_decoder(frame)
+        if not self.route(key, payload):
+            logger.warning(f'No handler for binary frame {key}')
+
+    # hand a parsed payload to the request hook or its handler, return False if nobody took it
+    def route(self, key, payload):
+        if self.json_hook and self.json_hook(key, payload):
+            return True
+        handler = self.json_handlers.get(key)
+        if handler:
+            handler(payload)
+            return True
+        return False
@@ -4,11 +4,30 @@ import serial
 import json
 from logger_config import setup_logger
 import commands
+import telemetry
 from datetime import datetime
-from queue import Queue
+from queue import Queue, Empty
+from threading import Lock
+from concurrent.futures import Future
+from serialReader import SerialReader, BacklogMetrics, LineFramer
+from serialRequests import PendingRequests
+from serialTransport import SerialTransport, STOP_TIMEOUT_MS
+from pingScheduler import PingScheduler
+from telemetrySubscription import TelemetrySubscription
+from queueUpload import QueueUpload, oversized_tests
+from testQueue import TestQueue, DEFAULT_LOOKAHEAD
+from emergencyStop import EmergencyStopTracker
+from responseDispatcher import ResponseDispatcher
 
 logger = setup_logger(__name__)
 
+# the control board always boots at this rate, faster ones are negotiated in the handshake
+DEFAULT_BAUD_RATE = 9600
+# rates offered to the control board, fastest first
+SUPPORTED_BAUD_RATES = [230400, 115200]
+# put on the response queue to wake the worker loop for work handed over from the gui thread
+WAKE_UP = object()
+
 
 class SerialCaptureWorker(QThread):
 
@@ -17,7 +36,7 @@ class SerialCaptureWorker(QThread):
     trigger_reset = pyqtSignal()  # signal form main to reset control board
     trigger_add_test_data_to_queue = pyqtSignal(dict)  # signal from main to add test data to queue
     update_listbox = pyqtSignal(str)  # signal to update listbox
-    trigger_emergency_stop = pyqtSignal()
+    trigger_emergency_stop = pyqtSignal(float)  # monotonic time of the click
     machine_state_signal = pyqtSignal(str)
     ping_timestamp_signal = pyqtSignal(str)
     # signals to main to update running test info
@@ -32,14 +51,26 @@ class SerialCaptureWorker(QThread):
     upload_sketch_again_signal = pyqtSignal(str)
     alert_all_tests_complete_signal = pyqtSignal()  # signal to update gui when last test sequence is complete
     serial_is_closed_signal = pyqtSignal()  # prevent 'temp setting' if no serial connection
+    baud_rate_negotiated = pyqtSignal(str, int)  # port and baud rate agreed with the control board
+    ping_interval_signal = pyqtSignal(float)  # current ping interval in seconds
+    emergency_stop_latency = pyqtSignal(dict)  # click-to-wire and click-to-confirmed times of a stop in ms
 
-    def __init__(self, port, baudrate, timeout=5):
+    def __init__(self, port, baudrate=DEFAULT_BAUD_RATE, timeout=5, telemetry_format='binary',
+                 baud_rates=SUPPORTED_BAUD_RATES, ping_intervals=None, queue_lookahead=DEFAULT_LOOKAHEAD,
+                 broker=None):
         super().__init__()
         # serial setup variables
         self.port = port
         self.baudrate = baudrate
+        self.opening_baud_rate = baudrate  # the handshake is tried at this rate and at the default in turn
         self.timeout = timeout
+        # ping response format to ask for in the handshake ('binary' or 'json'), json until the board agrees
+        self.requested_telemetry = telemetry_format
+        self.telemetry = 'json'
+        self.offered_baud_rates = baud_rates  # empty to stay at the opening baud rate
 
+        # reads end as soon as stop() closes it; the worker switches baud rates, so it keeps the port to itself
+        self.transport = broker.exclusive(port, baudrate) if broker else SerialTransport(port, baudrate)
         self.ser = None  # future serial connection object
         self.is_open = True
         self.is_running = True  # flag to keep the thread running
@@ -48,6 +79,14 @@ class SerialCaptureWorker(QThread):
         # timing setup to control thread flow and communication with control board
         self.last_ping = time.time()
         self.last_readout = time.time()
+        # ping interval follows the machine state and backs off when responses go missing
+        self.ping_scheduler = PingScheduler(ping_intervals)
+        # push-mode status stream, replaces polling once the control board confirms it
+        self.subscription = TelemetrySubscription()
+        # seconds to wait for the matching response before a request times out
+        # baud_confirm must time out before the firmware gives up on the new rate (2 s)
+        self.request_timeouts = {'handshake': 5.0, 'ping_response': 2.0, 'baud_confirm': 1.5,
+                                 'subscribed': 2.0, 'queue_begin': 2.0}
 
         # connect signals from main
         self.trigger_run_tests.connect(self.run_tests)
@@ -60,6 +99,7 @@ class SerialCaptureWorker(QThread):
 
         # class variables
         self.sent_handshake = False
+        self.handshake_done = False
         self.alive = False
         self.timestamp = None
         self.machine_state = None
@@ -72,9 +112,20 @@ class SerialCaptureWorker(QThread):
         self.current_temperature = None
         self.test_number = 0
         self.queued_tests = 0
-        self.test_queue = {}  # space for test queue from arduino
-        # set up que for processing responses from serial
+        # the test plan lives here, the control board only gets the running test and the next few
+        self.test_queue = TestQueue(queue_lookahead)
+        self.queue_upload = None  # chunked test queue upload in progress
+        self.queue_lock = Lock()  # one upload at a time, feeding starts from the gui and the worker thread
+        self.run_when_fed = False  # restart the queue once the next test has reached the control board
+        self.queue_clear_requested = False  # set from the gui thread, the queue is cleared by the worker thread
+        # set up que for processing responses from serial: (arrival time, line) tuples filled by the reader thread
         self.response_queue = Queue()
+        self.reader = None  # future serial reader thread
+        self.write_lock = self.transport.write_lock  # serialise writes coming from different threads
+        self.stop_tracker = EmergencyStopTracker()  # latency of the last emergency stop
+        self.requests = PendingRequests()  # commands in flight, resolved by their response type
+        self.backlog = BacklogMetrics()  # depth and age of the response queue per drained batch
+        self.dispatcher = self.build_dispatcher()  # routes every line from the control board
 
     # CORE THREAD METHODS
     # set up serial communication
@@ -84,12 +135,12 @@ class SerialCaptureWorker(QThread):
         if baudrate:
             self.baudrate = baudrate
         try:
-            time.sleep(0.1)
-            self.ser = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+            self.transport.port = self.port
+            self.transport.baudrate = self.baudrate
+            ready = self.transport.open(settle=1)  # make sure arduino is ready, unless stopped meanwhile
+            self.ser = self.transport.ser
             logger.info(f'Connected to arduino port: {self.port}')
-            time.sleep(1)  # make sure arduino is ready
-
-            return True
+            return ready and self.is_running  # stop() may have come before open() cleared the cancel
         except serial.SerialException as e:
             logger.exception(f'Error during serial setup of Serial Capture worker thread: {e}')
             return False
@@ -97,43 +148,58 @@ class SerialCaptureWorker(QThread):
     # main method to run the thread
     def run(self):
         if not self.serial_setup():
-            logger.error(f'Failed to connect to {self.port}')
-            self.no_port_connection.emit()
+            if self.is_running:
+                logger.error(f'Failed to connect to {self.port}')
+                self.no_port_connection.emit()
+            self.stop()
             return
         logger.info('Thread is running')
+        # dedicated reader thread: wakes on incoming bytes and queues complete lines
+        # binary telemetry frames are recognised by the framer and passed on as bytes
+        framer = LineFramer(frame_sync=telemetry.FRAME_SYNC, frame_size=telemetry.FRAME_SIZE,
+                            frame_check=telemetry.is_valid_frame)
+        self.reader = SerialReader(self.transport, self.response_queue, framer=framer)
+        self.reader.start()
+        self.serial_running_and_happy.emit()
+        self.ping_interval_signal.emit(self.ping_scheduler.interval)  # the gui shows the rate before its first change
         # wrap the whole while-loop in a try-except statement to prevent crashes in case of system failure
         try:
             while self.is_running:
                 if self.is_stopped:
-                    time.sleep(0.1)
+                    self.transport.wait(0.1)
                     continue
 
-                try:
-                    if not self.ser or not self.ser.is_open:
-                        time.sleep(0.1)
+                # (re)send handshake until the control board has answered it
+                self.handshake()
+                # wait for the next line, but never past the next ping, watchdog check or request deadline
+                if self.subscription.active:
+                    wait = self.subscription.next_check_in()
+                else:
+                    wait = self.ping_scheduler.next_ping_in()
+                for deadline in (self.requests.next_deadline_in(), self.next_queue_upload_deadline(),
+                                 self.stop_tracker.next_deadline_in()):
+                    if deadline is not None:
+                        wait = min(wait, deadline)
+                # take everything that is pending in one go and process it in arrival order
+                batch = self.next_batch(wait)
+                if self.queue_clear_requested:
+                    self.apply_test_queue_clear()
+                for response in batch:
+                    if response is WAKE_UP:
                         continue
-
-                    self.serial_running_and_happy.emit()
-                    # send handshake
-                    self.handshake()
-                    time.sleep(0.1)
-                    # read incoming serial data
-                    response = self.ser.readline().decode('utf-8').strip()  # continuous readout from serial
-                    if response:
-                        self.process_response(response)  # update and show curated responses
-                    # make sure responses added to que by send_json be processed as well
-                    if not self.response_queue.empty():
-                        response = self.response_queue.get()
-                        self.process_response(response)
-                    if time.time() - self.last_ping >= 0.5:
-                        self.last_ping = time.time()
-                        self.trigger_ping()
-
-                except serial.SerialException as e:
-                    logger.exception(f'Serial error in Serial Capture worker thread: {e}')
-                    self.is_running = False
-
-                time.sleep(0.1)  # avoid excessive cpu usage
+                    if response is None:
+                        # reader ended: serial error or port closed
+                        if self.reader.error:
+                            logger.error(f'Serial error in Serial Capture worker thread: {self.reader.error}')
+                        self.is_running = False
+                        break
+                    self.process_response(response)  # update and show curated responses
+                if not self.is_running:
+                    break
+                self.requests.expire()
+                self.check_emergency_stop()
+                self.pump_queue_upload()
+                self.keep_telemetry_flowing()
         except Exception as e:
             # catch any other unexpected exceptions
             logger.exception(f'Unexpected error: {e}')
@@ -141,24 +207,36 @@ class SerialCaptureWorker(QThread):
 
         self.stop()
 
+    # block until at least one line is pending (or timeout), then drain the whole backlog
+    def next_batch(self, timeout):
+        try:
+            batch = [self.response_queue.get(timeout=timeout)]
+        except Empty:
+            return []
+        while True:
+            try:
+                batch.append(self.response_queue.get_nowait())
+            except Empty:
+                break
+        self.backlog.record(batch)
+        return [response for _, response in batch]
+
     # method to stop the serial communication
     def stop(self):
         self.is_running = False  # Stop the worker thread loop
+        if self.reader:
+            self.reader.stop()
+        self.requests.cancel_all()
+        # closing the transport wakes the reader, whose end marker wakes the loop in run()
+        self.transport.close()
         try:
-            if self.ser and self.ser.is_open:
-                self.ser.close()  # Close the serial connection
-                logger.info(f"Connection to {self.port} closed successfully.")
-        except serial.SerialException as e:
-            logger.error(f"Serial exception while closing connection to {self.port}: {e}")
+            self.quit()  # Gracefully terminate the thread
+            # stop() also runs at the end of run(), where the thread cannot wait for itself
+            if QThread.currentThread() is not self:
+                self.wait(STOP_TIMEOUT_MS)
+            logger.info("Serial Capture Worker thread exited successfully.")
         except Exception as e:
-            logger.error(f"Unexpected error while closing connection to {self.port}: {e}")
-        finally:
-            try:
-                self.quit()  # Gracefully terminate the thread
-                self.wait()  # Ensure thread termination before cleanup
-                logger.info("Serial Capture Worker thread exited successfully.")
-            except Exception as e:
-                logger.error(f"Error during thread termination: {e}")
+            logger.error(f"Error during thread termination: {e}")
 
 
     # BASIC COMMUNICATION WITH CONTROL BOARD
@@ -170,22 +248,66 @@ class SerialCaptureWorker(QThread):
 
         time = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
         # insert timestamp into handshake
-        handshake = commands.handshake(time)
+        handshake = commands.handshake(time,
+                                       self.requested_telemetry if self.requested_telemetry != 'json' else None,
+                                       self.offered_baud_rates)
         logger.info(f'Sending handshake: {handshake}')
+        # prevent handshake from being sent again while waiting for the answer
+        self.sent_handshake = True
         # send handshake to arduino
-        self.send_json_to_arduino(handshake)
+        future = self.send_request(handshake)
+        future.add_done_callback(self.on_handshake_response)
         logger.info(f'Handshake sent to arduino: {handshake}')
-        try:
-            # decode arduino response
-            handshake_response = self.ser.readline().decode('utf-8').strip()
-            # convert response string to dictionary
-            parsed_response = json.loads(handshake_response)
-            logger.info(f'Response to handshake: {parsed_response}')
-        except json.JSONDecodeError as e:
-            logger.exception(f'Failed to parse arduino response: {e}')
-
-        # prevent handshake from being sent again
-        self.sent_handshake = True
+
+    # handshake answered or timed out
+    def on_handshake_response(self, future):
+        if future.cancelled():
+            return
+        if future.exception():
+            # the board is either still at the rate negotiated before the app restarted or back at the default
+            other = DEFAULT_BAUD_RATE if self.baudrate != DEFAULT_BAUD_RATE else self.opening_baud_rate
+            if other != self.baudrate and self.set_port_baud_rate(other):
+                logger.warning(f'No response to handshake, sending it again at {other} baud')
+            else:
+                logger.warning('No response to handshake, sending it again')
+            self.sent_handshake = False
+            return
+        self.handle_handshake(future.result())
+
+    # poll with PING until the control board streams status on its own, then watch that stream
+    def keep_telemetry_flowing(self):
+        if self.subscription.active:
+            if self.subscription.is_stale():
+                logger.warning('Telemetry stream stopped, polling again until it is back')
+                self.subscription.stop()
+                self.subscribe()
+            elif self.subscription.renew_due():
+                self.subscribe()  # renewing also tells the firmware the app is still alive
+            return
+        if self.handshake_done and self.subscription.supported and not self.subscription.pending:
+            self.subscribe()
+        if self.ping_scheduler.is_due():
+            self.ping_scheduler.ping_sent()
+            self.last_ping = time.time()
+            self.trigger_ping()
+
+    # ask the control board to push status frames at the current ping interval
+    def subscribe(self):
+        interval = self.ping_scheduler.interval
+        self.subscription.pending = True
+        future = self.send_request(commands.subscribe(int(interval * 1000)))
+        future.add_done_callback(lambda done: self.on_subscribed(done, interval))
+
+    # subscription confirmed or timed out
+    def on_subscribed(self, future, interval):
+        if future.cancelled():
+            return
+        if future.exception():
+            self.subscription.subscribe_failed()
+            return
+        if not self.subscription.active:
+            logger.info(f'Control board streams status every {interval:g} s, polling stopped')
+        self.subscription.start(interval)
 
     # trigger ping
     def trigger_ping(self):
@@ -195,37 +317,53 @@ class SerialCaptureWorker(QThread):
     def ping(self):
         logger.info(f'Test number at the beginning of ping: {self.test_number}')
         ping = commands.ping()  # create ping command
-        self.send_json_to_arduino(ping)  # send ping to arduino
-        try:
-            ping_response = self.ser.readline().decode('utf-8').strip()
-            # convert response string to dictionary
-            parsed_response = json.loads(ping_response)
-            if 'ping_response' in parsed_response:
-                ping_data = parsed_response['ping_response']
-                # get all the data from ping & store it in class variables
-                self.alive = ping_data.get('alive', False)
-                logger.info(self.alive)
-                self.timestamp = ping_data.get('timestamp', '')
-                self.ping_timestamp_signal.emit(self.timestamp)
-                self.machine_state = ping_data.get('machine_state', '')
-                logger.info(self.machine_state)
-                self.machine_state_signal.emit(self.machine_state)
-                # extract test status information and emit signals for gui updates
-                self.current_temperature = ping_data.get('current_temp', 0)
-                logger.info(f'Current temperature received from ping: {self.current_temperature}')
-                test_status = ping_data.get('test_status', {})
-                self.is_test_running = test_status.get('is_test_running', False)
-                self.current_test = test_status.get('current_test', '')
-                self.current_sequence = test_status.get('current_sequence', 0)
-                self.desired_temp = test_status.get('desired_temp', 0)
-                # get duration and time left, and convert them for display
-                self.current_duration = test_status.get('current_duration', 0) / 60000
-                self.time_left = test_status.get('time_left', 0) / 60
-                self.queued_tests = test_status.get('queued_tests', 0)
-                self.emit_test_status()
-                self.display_info()
-        except json.JSONDecodeError as e:
-            logger.exception(f'Failed to decode ping response as json: {e}')
+        future = self.send_request(ping)  # send ping to arduino without waiting for the answer
+        future.add_done_callback(self.on_ping_response)
+
+    # ping answered or timed out
+    def on_ping_response(self, future):
+        if future.cancelled():
+            return
+        if future.exception():
+            logger.warning(f'Ping failed: {future.exception()}')
+            if self.ping_scheduler.on_missed():
+                self.ping_interval_signal.emit(self.ping_scheduler.interval)
+            return
+        self.handle_ping_response(future.result())
+
+    # store ping response data in class variables and update the gui
+    def handle_ping_response(self, ping_data):
+        self.subscription.frame_received()
+        # get all the data from ping & store it in class variables
+        self.alive = ping_data.get('alive', False)
+        logger.info(self.alive)
+        self.timestamp = ping_data.get('timestamp', '')
+        self.ping_timestamp_signal.emit(self.timestamp)
+        self.machine_state = ping_data.get('machine_state', '')
+        logger.info(self.machine_state)
+        self.machine_state_signal.emit(self.machine_state)
+        if self.machine_state == 'EMERGENCY_STOP' and self.stop_tracker.is_pending():
+            self.confirm_emergency_stop()
+        # extract test status information and emit signals for gui updates
+        self.current_temperature = ping_data.get('current_temp', 0)
+        logger.info(f'Current temperature received from ping: {self.current_temperature}')
+        test_status = ping_data.get('test_status', {})
+        self.is_test_running = test_status.get('is_test_running', False)
+        self.current_test = test_status.get('current_test', '')
+        self.current_sequence = test_status.get('current_sequence', 0)
+        self.desired_temp = test_status.get('desired_temp', 0)
+        # get duration and time left, and convert them for display
+        self.current_duration = test_status.get('current_duration', 0) / 60000
+        self.time_left = test_status.get('time_left', 0) / 60
+        # the control board only knows the few tests it holds, the plan is counted here
+        self.queued_tests = self.test_queue.remaining() if self.test_queue.names else test_status.get('queued_tests', 0)
+        # adapt the ping rate: fast near sequence transitions and while heating/cooling, slow when idle
+        if self.ping_scheduler.on_response(self.machine_state, test_status.get('time_left', 0), self.is_test_running):
+            self.ping_interval_signal.emit(self.ping_scheduler.interval)
+            if self.subscription.active and not self.subscription.pending:
+                self.subscribe()  # stream at the new rate
+        self.emit_test_status()
+        self.display_info()
 
     # MORE ADVANCED COMMUNICATION WITH TEST BOARD
     # run all tests
@@ -233,25 +371,112 @@ class SerialCaptureWorker(QThread):
         run_queue = commands.run_all_tests()
         self.send_json_to_arduino(run_queue)
 
-    # add tests to test queue
+    # add tests to the test queue, the control board gets them one by one as it needs them
     def add_to_test_queue(self, test_data):
         self.test_number = 0
-        if test_data is not None and 'tests' in test_data:
-            full_tests_json = {'tests': test_data["tests"]}
-            self.send_json_to_arduino(full_tests_json)  # send the data to arduino
-            logger.info(f'Sending full test json: {full_tests_json}')
-            # log and print status
-            logger.info(f'Adding {len(test_data["tests"])} tests to test queue on Arduino')
-            self.get_test_queue_from_arduino()
-        else:
+        if test_data is None or 'tests' not in test_data:
             # handle case when no test data is found
             logger.warning('No test data found on file')
+            return
+        tests = test_data['tests']
+        oversized = oversized_tests(tests, len(self.test_queue.names))
+        if oversized:
+            logger.error(f'Tests too large for the control board, nothing queued: {oversized}')
+            self.update_listbox.emit(f'Tests too large to queue: {", ".join(oversized)}')
+            return
+        self.test_queue.extend(tests)
+        logger.info(f'Added {len(tests)} tests to test queue, {self.test_queue.remaining()} waiting')
+        self.emit_test_queue()
+        self.feed_test_queue()
+
+    # upload the tests the control board should hold next, one upload at a time
+    def feed_test_queue(self):
+        with self.queue_lock:
+            if self.queue_upload:
+                return  # fed again once the running upload is done
+            first_index, tests = self.test_queue.due()
+            if not tests:
+                return
+            upload = QueueUpload(tests, byte_time=10 / self.baudrate, first_index=first_index)  # 8N1: ten bits per byte
+            self.queue_upload = upload
+        logger.info(f'Uploading {list(tests)} to test queue on Arduino')
+        future = self.send_request(commands.queue_begin(len(tests)))
+        future.add_done_callback(lambda done: self.on_queue_begin(done, upload, tests))
+
+    # control board ready for the upload, or firmware without chunked uploads
+    def on_queue_begin(self, future, upload, tests):
+        if future.cancelled() or upload is not self.queue_upload:
+            return
+        if future.exception():
+            # older firmware: fall back to a single line, which it truncates past its buffer size
+            logger.warning('Control board does not support chunked queue uploads, sending the tests at once')
+            self.send_json_to_arduino({'tests': tests})
+            self.queue_upload_done(upload)
+            return
+        begin = future.result()
+        if 'error' in begin:
+            logger.error(f'Control board refused the test queue: {begin["error"]}')
+            self.update_listbox.emit(f'Test queue refused: {begin["error"]}')
+            self.queue_upload = None
+            return
+        upload.start(begin.get('window'))
+        self.pump_queue_upload()
 
-    # get test queue from arduino
-    def get_test_queue_from_arduino(self):
-        get_queue = commands.get_test_queue()
-        logger.info('Sending command to arduino to get test queue')
-        self.send_json_to_arduino(get_queue)
+    # retransmit overdue frames and fill the send window
+    def pump_queue_upload(self):
+        upload = self.queue_upload
+        if not upload or not upload.is_active():
+            return
+        if not upload.check_timeout():
+            # the tests stay due and go out again with the next feed
+            self.queue_upload = None
+            self.update_listbox.emit('Test queue upload failed, control board stopped answering')
+            return
+        for frame in upload.take_sendable():
+            self.write_line(frame)
+
+    # seconds until the oldest queue frame needs its ack
+    def next_queue_upload_deadline(self):
+        upload = self.queue_upload
+        return upload.next_deadline_in() if upload else None
+
+    # control board acknowledged one or more queue frames
+    def on_queue_ack(self, ack):
+        upload = self.queue_upload
+        if not upload:
+            return
+        if upload.on_ack(ack.get('seq', -1), ack.get('next', 0), ack.get('error')):
+            elapsed = time.monotonic() - upload.started_at
+            queued = len(upload.names) - len(upload.rejected)
+            logger.info(f'Queued {queued} of {len(upload.names)} tests on Arduino in {elapsed:.2f} s')
+            self.queue_upload_done(upload)
+        else:
+            self.pump_queue_upload()
+
+    # tests are on the control board: feed more if due and restart a queue that ran dry
+    def queue_upload_done(self, upload):
+        self.test_queue.mark_fed(len(upload.names))
+        self.test_queue.skip(name for name, _ in upload.rejected)
+        self.queue_upload = None
+        self.feed_test_queue()
+        if self.run_when_fed and not self.queue_upload:
+            self.run_when_fed = False
+            self.run_tests()
+
+    # the control board dropped its tests; called from the gui thread, so the worker thread that owns the
+    # queue and upload state does the clearing
+    def clear_test_queue(self):
+        self.queue_clear_requested = True
+        self.response_queue.put((time.monotonic(), WAKE_UP))
+
+    # forget the plan and show the empty queue; worker thread
+    def apply_test_queue_clear(self):
+        self.queue_clear_requested = False
+        with self.queue_lock:
+            self.queue_upload = None
+            self.run_when_fed = False
+            self.test_queue.clear()
+        self.emit_test_queue()
 
     # set temp & duration from the gui
     def set_temp(self, input_dictionary, override):
@@ -268,16 +493,59 @@ class SerialCaptureWorker(QThread):
         reset = commands.reset()
         self.send_json_to_arduino(reset)
         logger.info('Resetting control board')
-        self.get_test_queue_from_arduino()
-
-    # emergency stop
-    def emergency_stop(self):
-        stop = commands.emergency_stop()
-        self.send_json_to_arduino(stop)
+        self.clear_test_queue()
+
+    # emergency stop: runs in the gui thread and goes straight to the port, ahead of anything still queued
+    def emergency_stop(self, clicked_at=None):
+        self.stop_tracker.clicked(clicked_at)
+        if not self.write_emergency_stop() and not self.stop_tracker.writes:
+            # nothing went out, so there is no stop to wait for: report it unconfirmed instead of leaving it pending
+            self.emergency_stop_latency.emit(self.stop_tracker.finish(confirmed=False))
+            return
         logger.info('Emergency stop issued')
-        self.get_test_queue_from_arduino()
+        self.clear_test_queue()
+
+    # drop unsent output and write the stop, returning once it has been transmitted; False if it was not sent
+    def write_emergency_stop(self):
+        # the leading newline ends any half-sent line, so the firmware cannot glue the stop onto it
+        line = '\n' + json.dumps(commands.emergency_stop()) + '\n'
+        try:
+            if not self.ser or not self.ser.is_open:
+                logger.warning('Serial connection not established or not open, emergency stop not sent')
+                return False
+            # commands still waiting in the output buffer are void now
+            self.transport.write_now(line.encode('utf-8'))
+            self.stop_tracker.written()
+            return True
+        except (serial.SerialException, OSError) as e:
+            logger.error(f'Error sending emergency stop: {e}')
+            return False
+
+    # the control board reports EMERGENCY_STOP: the pending stop is confirmed
+    def confirm_emergency_stop(self):
+        latency = self.stop_tracker.finish()
+        if latency:
+            logger.info(f'Emergency stop confirmed {latency["confirmed_ms"]:.1f} ms after the click '
+                        f'(on the wire after {latency["wire_ms"]:.1f} ms, {latency["writes"]} write(s))')
+            self.emergency_stop_latency.emit(latency)
+
+    # write the stop again while the control board has not confirmed it
+    def check_emergency_stop(self):
+        if not self.stop_tracker.is_overdue():
+            return
+        if self.stop_tracker.is_exhausted():
+            latency = self.stop_tracker.finish(confirmed=False)
+            logger.error(f'Emergency stop not confirmed by the control board after {latency["writes"]} writes')
+            self.emergency_stop_latency.emit(latency)
+            return
+        logger.warning('Emergency stop not confirmed yet, sending it again')
+        self.write_emergency_stop()
 
     # SENDING STUFF TO MAIN APP
+    # show the host copy of the test queue
+    def emit_test_queue(self):
+        self.update_test_data_from_queue.emit(self.test_queue.as_dict())
+
     # prep running test info updates to be emitted
     def emit_test_status(self):
         test_status_data = {
@@ -300,69 +568,183 @@ class SerialCaptureWorker(QThread):
         self.update_chamber_monitor.emit(relevant_info)
 
     # DECODING AND ENCODING TOOLS
-    # senf json to arduino
+    # send json to arduino
     def send_json_to_arduino(self, test_data):
-        json_data = json.dumps(test_data)  # convert python dictionary to json
+        self.write_line(json.dumps(test_data))  # convert python dictionary to json
+
+    # write one line of json to arduino
+    def write_line(self, json_data):
         try:
             if not self.ser or not self.ser.is_open:
                 logger.warning('Serial connection not established or not open')
                 return
-            self.ser.write((json_data + '\n').encode('utf-8'))
-            time.sleep(0.01)
+            # writes may come from the gui thread as well as from this one, the transport serialises them
+            self.transport.write((json_data + '\n').encode('utf-8'))
             logger.info(f'Sent to arduino: {json_data}')
-            # blocking method within thread
-            while self.ser.in_waiting > 0:
-                response = self.ser.readline().decode('utf-8').strip()
-                logger.info(f'Response from Arduino: {response}')
-                # capture all serial responses for thread to process properly
-                self.response_queue.put(response)
+            # responses are collected by the reader thread, nothing to wait for here
         except serial.SerialException as e:
             logger.error(f'Error sending JSON: {e}')
 
-    # process serial response
+    # send a command and get a future that resolves with the matching response payload
+    def send_request(self, command, timeout=None):
+        response_key = commands.expected_response(command)
+        if response_key is None:
+            # nothing to wait for: resolve as soon as the command is written
+            future = Future()
+            self.send_json_to_arduino(command)
+            future.set_result(None)
+            return future
+        if timeout is None:
+            timeout = self.request_timeouts.get(response_key, 5.0)
+        # register before writing so a fast answer cannot slip past
+        future = self.requests.add(response_key, timeout)
+        self.send_json_to_arduino(command)
+        return future
+
+    # process serial response: classify it once and hand it to its handler
     def process_response(self, response):
-        logger.debug(f'Raw response: {repr(response)}')
-        clean_response = response.strip()  # remove leading/trailing whitespace
-        logger.debug(f'Cleaned response: {repr(clean_response)}')
-
-        # list of responses to be picked up
-        trigger_responses = ['Setting', 'Target temperature reached!']
-        if any(response.strip().startswith(trigger) for trigger in trigger_responses):
-            self.update_listbox.emit(response)  # emit signal to update listbox
-            logger.info(f'{response}')
-        elif 'Test completed:' in response.strip():
-            logger.info(f'Response from Arduino: {response}')
-            logger.info(f'Sending signal to upload sketch for new test')
-            self.test_number += 1
-            logger.info(f'Test number: {self.test_number}')
-            self.test_number_signal.emit(self.test_number)
-            message = f'Test {self.test_number} complete'
-            logger.info(message)
-            logger.info('About to emit signal for a upload btw tests')
-            self.upload_sketch_again_signal.emit(message)
-            logger.info('Signal for new upload btw tests emitted')
-        elif response.strip().startswith('Waiting'):
-            self.update_listbox.emit(response)  # emit signal to update listbox
-            logger.info(f'Response to WAITING: {response}')
-            self.sequence_has_been_advanced = False
-        elif response.strip().startswith('Sequence complete'):
-            if not self.sequence_has_been_advanced:
-                self.next_sequence_progress.emit()
-                logger.info('Sending signal to start new sequence progress bar')
-                self.sequence_complete.emit('sequence complete')
-                self.sequence_has_been_advanced = True
-        elif response.strip().startswith('All tests completed!'):
-            self.alert_all_tests_complete_signal.emit()
-        elif 'queue' in response.strip():
-            queue_response = response
-            parsed_response = json.loads(queue_response)
-            queue = parsed_response['queue']
-            logger.info(f'Current test queue on Arduino: {queue}')
-            self.update_test_data_from_queue.emit(queue)
-            if 'queue' in parsed_response:
-                queue = parsed_response['queue']
-                logger.info(f'Current test queue on Arduino: {queue}')
-                self.update_test_data_from_queue.emit(queue)
+        self.dispatcher.dispatch(response)
+
+    # build the dispatch table for everything the control board sends
+    def build_dispatcher(self):
+        text_handlers = {
+            'setting': self.on_setting_response,
+            'test_completed': self.on_test_completed,
+            'waiting': self.on_waiting,
+            'sequence_complete': self.on_sequence_complete,
+            'all_tests_completed': self.on_all_tests_completed,
+            'emergency_stop': self.on_emergency_stop_ack,
+        }
+        json_handlers = {
+            'ping_response': self.handle_ping_response,
+            'queue': self.handle_queue,
+            'handshake': self.handle_handshake,
+            'event': self.handle_event,
+            'queue_ack': self.on_queue_ack,
+        }
+        # json answers to pending requests are resolved before the handlers see them
+        return ResponseDispatcher(text_handlers, json_handlers, self.on_other_response,
+                                  json_hook=self.requests.resolve, frame_decoder=self.decode_telemetry_frame)
+
+    # binary telemetry frame -> ping_response payload, test index mapped back to its name
+    def decode_telemetry_frame(self, frame):
+        return 'ping_response', telemetry.decode_frame(frame, self.test_queue.names)
+
+    # 'Setting ...' and 'Target temperature reached!'
+    def on_setting_response(self, response):
+        self.update_listbox.emit(response)  # emit signal to update listbox
+        logger.info(f'{response}')
+
+    # a test is done: feed the control board and trigger the sketch upload for the next one
+    def on_test_completed(self, response):
+        logger.info(f'Response from Arduino: {response}')
+        self.test_queue.complete(response.split('Test completed:', 1)[1].strip())
+        self.feed_test_queue()
+        self.test_number += 1
+        logger.info(f'Test number: {self.test_number}')
+        self.test_number_signal.emit(self.test_number)
+        message = f'Test {self.test_number} complete'
+        logger.info(message)
+        self.upload_sketch_again_signal.emit(message)
+        logger.info('Signal for new upload btw tests emitted')
+
+    # waiting for target temperature
+    def on_waiting(self, response):
+        self.update_listbox.emit(response)  # emit signal to update listbox
+        logger.info(f'Response to WAITING: {response}')
+        self.sequence_has_been_advanced = False
+
+    # sequence complete: advance the progress bar once
+    def on_sequence_complete(self, response):
+        if not self.sequence_has_been_advanced:
+            self.next_sequence_progress.emit()
+            logger.info('Sending signal to start new sequence progress bar')
+            self.sequence_complete.emit('sequence complete')
+            self.sequence_has_been_advanced = True
+
+    # control board ran out of tests: either the plan is done or the next test was late
+    def on_all_tests_completed(self, response):
+        if self.test_queue.remaining():
+            logger.warning('Control board ran out of tests before the next one arrived, restarting the queue')
+            self.run_when_fed = True
+            self.feed_test_queue()
+            if not self.queue_upload:
+                self.run_when_fed = False
+                self.run_tests()
+            return
+        self.test_queue.clear()
+        self.alert_all_tests_complete_signal.emit()
+
+    # the firmware acknowledges a commanded stop with this line; its state only reads EMERGENCY_STOP
+    # when the system switch is off, a warm chamber reports COOLING instead
+    def on_emergency_stop_ack(self, response):
+        self.update_listbox.emit(response)
+        if self.stop_tracker.is_pending():
+            self.confirm_emergency_stop()
+
+    # queue sent without a pending request, the app's own copy stays authoritative
+    def handle_queue(self, queue):
+        logger.info(f'Current test queue on Arduino: {queue}')
+
+    # handshake sent without a pending request
+    def handle_handshake(self, handshake):
+        logger.info(f'Response to handshake: {handshake}')
+        self.handshake_done = True
+        # older firmware ignores the telemetry request and keeps answering pings in json
+        self.telemetry = handshake.get('telemetry', 'json')
+        logger.info(f'Ping responses will arrive as {self.telemetry}')
+        # the firmware switches right after sending its handshake, follow it and confirm
+        baud_rate = handshake.get('baud_rate')
+        if baud_rate and baud_rate != self.baudrate:
+            self.switch_baud_rate(baud_rate)
+
+    # move the open port to a new baud rate and check that the control board is there
+    def switch_baud_rate(self, baud_rate):
+        previous = self.baudrate
+        logger.info(f'Switching {self.port} from {previous} to {baud_rate} baud')
+        if not self.set_port_baud_rate(baud_rate):
+            return
+        future = self.send_request(commands.baud_confirm())
+        future.add_done_callback(lambda done: self.on_baud_confirm(done, baud_rate))
+
+    # confirmation round trip at the new baud rate answered or timed out
+    def on_baud_confirm(self, future, baud_rate):
+        if future.cancelled():
+            return
+        if future.exception():
+            # the firmware falls back on its own when it does not hear the confirmation
+            logger.warning(f'No confirmation at {baud_rate} baud, falling back to {DEFAULT_BAUD_RATE}')
+            self.set_port_baud_rate(DEFAULT_BAUD_RATE)
         else:
-            logger.info(f'Complete response from arduino: {response}')
+            logger.info(f'Control board confirmed {baud_rate} baud')
+        self.baud_rate_negotiated.emit(self.port, self.baudrate)
+
+    # reconfigure the serial port in place, dropping any half-received line
+    def set_port_baud_rate(self, baud_rate):
+        if not self.ser or not self.ser.is_open:
+            logger.warning(f'Cannot switch {self.port} to {baud_rate} baud, the port is not open')
+            return False
+        try:
+            with self.write_lock:
+                self.ser.flush()
+                self.ser.baudrate = baud_rate
+            self.baudrate = baud_rate
+            if self.reader:
+                self.reader.clear_framer()
+            return True
+        except (serial.SerialException, ValueError) as e:
+            logger.error(f'Could not switch {self.port} to {baud_rate} baud: {e}')
+            return False
 
+    # event pushed by the control board on a state change
+    def handle_event(self, event):
+        logger.info(f'Event from arduino: {event}')
+        if 'machine_state' in event:
+            self.machine_state = event['machine_state']
+            self.machine_state_signal.emit(self.machine_state)
+            if self.machine_state == 'EMERGENCY_STOP' and self.stop_tracker.is_pending():
+                self.confirm_emergency_stop()
+
+    # anything else
+    def on_other_response(self, response):
+        logger.info(f'Complete response from arduino: {response}')
@@ -0,0 +1,203 @@
+import threading
+import time
+from queue import Queue
+import serial
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+# split a raw byte stream into complete lines, keeping partial lines for the next chunk
+# optionally recognises fixed-size binary frames that start with a sync prefix and hands them out as bytes
+class LineFramer:
+
+    def __init__(self, encoding='utf-8', frame_sync=None, frame_size=0, frame_check=None):
+        self.encoding = encoding
+        self.buffer = bytearray()
+        self.frame_sync = frame_sync
+        self.frame_size = frame_size
+        self.frame_check = frame_check  # callable(bytes) -> bool, rejects false syncs
+
+    # add received bytes and return every complete line (decoded and stripped) or binary frame
+    def feed(self, data):
+        self.buffer.extend(data)
+        if not self.frame_sync:
+            return self.split_lines()
+        return self.split_lines_and_frames()
+
+    # text-only fast path
+    def split_lines(self):
+        end = self.buffer.rfind(b'\n')
+        if end < 0:
+            return []
+        complete = self.buffer[:end]
+        del self.buffer[:end + 1]
+        lines = []
+        for raw_line in complete.split(b'\n'):
+            line = raw_line.decode(self.encoding, errors='replace').strip()
+            if line:
+                lines.append(line)
+        return lines
+
+    # mixed text and binary frames
+    def split_lines_and_frames(self):
+        buffer = self.buffer
+        items = []
+        start = 0
+        while start < len(buffer):
+            if buffer.startswith(self.frame_sync, start):
+                if len(buffer) - start < self.frame_size:
+                    break  # wait for the rest of the frame
+                frame = bytes(buffer[start:start + self.frame_size])
+                if self.frame_check is None or self.frame_check(frame):
+                    items.append(frame)
+                    start += self.frame_size
+                    continue
+                start += 1  # false sync: skip a byte and keep looking
+                continue
+            end = buffer.find(b'\n', start)
+            # a frame may follow text that was not terminated by a newline
+            sync_at = buffer.find(self.frame_sync, start, end if end >= 0 else len(buffer))
+            if sync_at >= 0:
+                end = sync_at
+            elif end < 0:
+                break
+            line = buffer[start:end].decode(self.encoding, errors='replace').strip()
+            if line:
+                items.append(line)
+            start = end if end == sync_at else end + 1
+        del buffer[:start]
+        return items
+
+    # drop whatever partial line is left
+    def clear(self):
+        self.buffer.clear()
+
+
+# split a raw byte stream into lines without copying or decoding them: every complete line goes to a
+# callback as a memoryview into one reusable buffer, only valid during that call
+class LineScanner:
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.lines = 0  # lines handed out since creation
+        self.bytes = 0  # bytes fed since creation
+
+    # add received bytes and call handle_line(view) for every complete, non-empty line (\r\n or \n)
+    def feed(self, data, handle_line):
+        buffer = self.buffer
+        buffer += data
+        self.bytes += len(data)
+        start = 0
+        with memoryview(buffer) as view:
+            while True:
+                end = buffer.find(b'\n', start)
+                if end < 0:
+                    break
+                stop = end - 1 if end > start and buffer[end - 1] == 0x0D else end
+                if stop > start:
+                    handle_line(view[start:stop])
+                    self.lines += 1
+                start = end + 1
+        # one move of the partial line to the front, once the views are released
+        if start:
+            del buffer[:start]
+
+    # drop whatever partial line is left
+    def clear(self):
+        self.buffer.clear()
+
+
+# reader thread that wakes on incoming bytes and queues complete lines with their arrival time
+class SerialReader(threading.Thread):
+
+    def __init__(self, transport, line_queue=None, name='serial-reader', framer=None):
+        super().__init__(name=name, daemon=True)
+        self.transport = transport  # SerialTransport, cancelling it ends the reader at once
+        self.line_queue = line_queue if line_queue is not None else Queue()
+        self.framer = framer if framer is not None else LineFramer()
+        self.is_running = True
+        self.error = None  # serial exception that ended the reader, if any
+        self.clear_requested = threading.Event()  # drop the partial line before the next feed, see clear_framer()
+
+    def run(self):
+        logger.info(f'Serial reader started on {self.transport.port}')
+        try:
+            while self.is_running:
+                # block until at least one byte arrives, then take everything already buffered
+                data = self.transport.read_available()
+                if not data:
+                    break  # transport cancelled
+                arrived = time.monotonic()
+                if self.clear_requested.is_set():
+                    self.clear_requested.clear()
+                    self.framer.clear()
+                for line in self.framer.feed(data):
+                    self.line_queue.put((arrived, line))
+        except (serial.SerialException, OSError, TypeError) as e:
+            # closing the port from another thread also ends up here
+            if self.is_running:
+                logger.error(f'Serial reader on {self.transport.port} stopped: {e}')
+                self.error = e
+        finally:
+            self.is_running = False
+            self.line_queue.put((time.monotonic(), None))  # wake up the consumer
+        logger.info(f'Serial reader on {self.transport.port} exited')
+
+    # drop the partial line, e.g. after a baud rate change; done by the reader thread itself, which may be
+    # in the middle of a feed right now
+    def clear_framer(self):
+        self.clear_requested.set()
+
+    # stop the reader, waking it up if it is blocked in a read
+    def stop(self):
+        self.is_running = False
+        self.transport.cancel()
+
+
+# depth and age of queued lines, measured each time the consumer drains the queue
+class BacklogMetrics:
+
+    def __init__(self, report_interval=10.0):
+        self.report_interval = report_interval  # seconds between log reports
+        self.last_report = time.monotonic()
+        self.last_depth = 0
+        self.last_age = 0.0
+        self.peak_depth = 0  # since the start, the window maxima are reset with every report
+        self.peak_age = 0.0
+        self.reset_window()
+
+    # start a new reporting window
+    def reset_window(self):
+        self.batches = 0
+        self.lines = 0
+        self.max_depth = 0
+        self.max_age = 0.0
+
+    # record one drained batch of (arrival time, line) tuples
+    def record(self, batch):
+        now = time.monotonic()
+        self.last_depth = len(batch)
+        self.last_age = now - batch[0][0]  # oldest item waited the longest
+        self.batches += 1
+        self.lines += self.last_depth
+        self.max_depth = max(self.max_depth, self.last_depth)
+        self.max_age = max(self.max_age, self.last_age)
+        self.peak_depth = max(self.peak_depth, self.last_depth)
+        self.peak_age = max(self.peak_age, self.last_age)
+        if now - self.last_report >= self.report_interval:
+            logger.info(f'Response backlog: {self.lines} lines in {self.batches} batches, '
+                        f'max depth {self.max_depth}, max age {self.max_age * 1000:.1f} ms')
+            self.last_report = now
+            self.reset_window()
+
+    # current values and the peaks since the start, reported by the control board benchmark
+    def snapshot(self):
+        return {
+            'depth': self.last_depth,
+            'age_ms': self.last_age * 1000,
+            'max_depth': self.max_depth,
+            'max_age_ms': self.max_age * 1000,
+            'peak_depth': self.peak_depth,
+            'peak_age_ms': self.peak_age * 1000,
+        }
@@ -0,0 +1,63 @@
+import time
+from collections import deque
+from concurrent.futures import Future
+from threading import Lock
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+# bookkeeping for commands waiting on a response of a given type
+class PendingRequests:
+
+    def __init__(self):
+        self.lock = Lock()  # requests are added from the gui thread and resolved from the worker thread
+        self.pending = {}  # response key -> deque of (deadline, future, name), oldest first
+
+    # register a request and return the future that resolves with its response payload
+    def add(self, response_key, timeout, name=None):
+        future = Future()
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            self.pending.setdefault(response_key, deque()).append((deadline, future, name or response_key))
+        return future
+
+    # hand a response to the oldest request waiting for it, return False if nobody was waiting
+    def resolve(self, response_key, payload):
+        with self.lock:
+            waiting = self.pending.get(response_key)
+            if not waiting:
+                return False
+            _, future, _ = waiting.popleft()
+        future.set_result(payload)  # callbacks run outside the lock
+        return True
+
+    # fail every request whose deadline has passed
+    def expire(self, now=None):
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self.lock:
+            for waiting in self.pending.values():
+                while waiting and waiting[0][0] <= now:
+                    expired.append(waiting.popleft())
+        for _, future, name in expired:
+            logger.warning(f'No response to {name} in time')
+            future.set_exception(TimeoutError(f'No response to {name}'))
+        return len(expired)
+
+    # seconds until the next deadline, None when nothing is pending
+    def next_deadline_in(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            deadlines = [waiting[0][0] for waiting in self.pending.values() if waiting]
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - now)
+
+    # cancel everything, e.g. when the connection goes down
+    def cancel_all(self):
+        with self.lock:
+            cancelled = [future for waiting in self.pending.values() for _, future, _ in waiting]
+            self.pending.clear()
+        for future in cancelled:
+            future.cancel()
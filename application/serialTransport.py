@@ -0,0 +1,122 @@
+import threading
+import time
+import serial
+from logger_config import setup_logger
+from serialReader import LineFramer
+
+logger = setup_logger(__name__)
+
+READ_TIMEOUT = 0.5  # seconds a single read may block, cancel() wakes it up earlier
+FALLBACK_READ_TIMEOUT = 0.05  # for port types that cannot cancel a blocking read
+STOP_TIMEOUT_MS = 1000  # upper bound for waiting on a worker thread after its transport is closed
+
+
+# serial port shared by the workers: blocking reads that cancel() ends at once, and serialised writes
+class SerialTransport:
+
+    def __init__(self, port, baudrate, encoding='utf-8', recorder=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.recorder = recorder  # SessionRecorder that gets every byte in both directions, if any
+        self.ser = None
+        self.cancelled = threading.Event()  # set by cancel() and close(), ends every read and wait
+        self.write_lock = threading.Lock()  # writes may come from the gui thread as well as the worker
+        self.read_lock = threading.Lock()  # held around every read, close() takes it so no read sees a closed port
+        self.framer = LineFramer(encoding)  # partial lines for readline()
+        self.lines = []  # complete lines not handed out yet
+
+    # open the port, then give the board time to boot; False if cancelled in the meantime; clears an earlier
+    # cancel so a transport can be reopened, callers check their own stop flag afterwards
+    def open(self, settle=0.0):
+        self.cancelled.clear()
+        self.ser = serial.Serial(self.port, self.baudrate, timeout=READ_TIMEOUT)
+        if self.recorder:
+            self.recorder.channel(self.port, self.baudrate)
+        if not hasattr(self.ser, 'cancel_read'):
+            self.ser.timeout = FALLBACK_READ_TIMEOUT
+        return self.wait(settle)
+
+    # check if the port is usable
+    def is_open(self):
+        return self.ser is not None and self.ser.is_open
+
+    # sleep that returns early, with False, once the transport is cancelled
+    def wait(self, seconds):
+        if seconds <= 0:
+            return not self.cancelled.is_set()
+        return not self.cancelled.wait(seconds)
+
+    # block until at least one byte arrives, then take everything already buffered; b'' on cancel or once
+    # timeout seconds have passed (checked after each read, so up to READ_TIMEOUT later)
+    def read_available(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.cancelled.is_set():
+            data = self.read_chunk()
+            if data or (deadline is not None and time.monotonic() >= deadline):
+                return data
+        return b''
+
+    # one read of up to a timeout, plus whatever else is already buffered
+    def read_chunk(self):
+        with self.read_lock:
+            if self.cancelled.is_set():
+                return b''
+            data = self.ser.read(1)
+            if data:
+                waiting = self.ser.in_waiting
+                if waiting:
+                    data += self.ser.read(waiting)
+                if self.recorder:
+                    self.recorder.received(self.port, data)
+            return data
+
+    # next complete line, decoded and stripped; None on cancel or once timeout seconds have passed
+    def readline(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.lines:
+            if self.cancelled.is_set():
+                return None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            data = self.read_chunk()
+            if data:
+                self.lines.extend(self.framer.feed(data))
+        return self.lines.pop(0)
+
+    # write bytes without interleaving with other writers
+    def write(self, data):
+        with self.write_lock:
+            self.ser.write(data)
+        if self.recorder:
+            self.recorder.sent(self.port, data)
+
+    # discard output that has not gone out yet, write data and wait until it has been transmitted
+    def write_now(self, data):
+        with self.write_lock:
+            self.ser.reset_output_buffer()
+            self.ser.write(data)
+            self.ser.flush()
+        if self.recorder:
+            self.recorder.sent(self.port, data)
+
+    # wake up every blocked read and wait; the port stays open
+    def cancel(self):
+        self.cancelled.set()
+        if self.ser is not None and hasattr(self.ser, 'cancel_read'):
+            try:
+                self.ser.cancel_read()
+            except (serial.SerialException, OSError) as e:
+                logger.debug(f'Could not cancel read on {self.port}: {e}')
+
+    # cancel pending reads and close the port
+    def close(self):
+        self.cancel()
+        if self.ser is None or not self.ser.is_open:
+            return
+        try:
+            # cancel() has woken any blocked read, wait for it to let go of the port
+            with self.read_lock, self.write_lock:
+                self.ser.close()
+            logger.info(f'Connection to {self.port} closed successfully.')
+        except (serial.SerialException, OSError) as e:
+            logger.error(f'Serial exception while closing connection to {self.port}: {e}')
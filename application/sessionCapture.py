@@ -0,0 +1,249 @@
+import argparse
+import json
+import mmap
+import os
+import pty
+import struct
+import threading
+import time
+import tty
+from datetime import datetime
+from pathlib import Path
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# usage: python sessionCapture.py info <capture>
+#        python sessionCapture.py replay <capture> [--speed 10 | --max]   (one pseudo-terminal per recorded port)
+
+# capture file: MAGIC, then records of RECORD header + payload, appended as the bytes go over the wire
+MAGIC = b'TCCAP1\n\x00'
+RECORD = struct.Struct('<dIBB')  # host monotonic time (s), payload length, channel id, kind
+CHANNEL, RX, TX, INFO = range(4)  # kinds: channel declaration (json), received bytes, sent bytes, session info (json)
+SESSION_CHANNEL = 255  # channel id of the session info records, never given to a port
+FLUSH_INTERVAL = 1.0  # seconds between flushes to disk, a crash loses at most this much
+MAX_CAPTURES = 20  # oldest captures are removed beyond this count
+MAX_CAPTURE_BYTES = 2 * 1024 ** 3  # or once all captures together take more than this
+CAPTURE_DIRECTORY = Path.cwd() / 'captures'
+
+
+# append-only recording of every byte on every port, shared by all transports of the app
+class SessionRecorder:
+
+    def __init__(self, path=None):
+        if path is None:
+            CAPTURE_DIRECTORY.mkdir(exist_ok=True)
+            prune_captures(CAPTURE_DIRECTORY, MAX_CAPTURES - 1, MAX_CAPTURE_BYTES)
+            path = CAPTURE_DIRECTORY / f'{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}.cap'
+        self.path = Path(path)
+        self.lock = threading.Lock()  # every reader thread and writer records into the same file
+        self.file = self.path.open('ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.channels = {}  # port -> channel id
+        self.append(SESSION_CHANNEL, INFO, json.dumps({'started': datetime.now().isoformat(timespec='seconds')}).encode())
+        self.file.flush()  # a capture is readable from the start, even while the app still records
+        self.closing = threading.Event()
+        # flushed on a timer rather than by the records, so a quiet line is on disk too
+        self.flusher = threading.Thread(target=self.flush_loop, name='session-flush', daemon=True)
+        self.flusher.start()
+        logger.info(f'Recording serial session to {self.path}')
+
+    # id of a port, declared in the file the first time it is seen
+    def channel(self, port, baudrate=None):
+        with self.lock:
+            channel = self.channels.get(port)
+            if channel is None:
+                channel = self.channels[port] = len(self.channels)
+                # declared under the lock, so no data record of the port can come first
+                self.write_record(time.monotonic(), channel, CHANNEL,
+                                  json.dumps({'port': port, 'baudrate': baudrate}).encode())
+            return channel
+
+    # bytes received from a port
+    def received(self, port, data, at=None):
+        self.append(self.channel(port), RX, data, at)
+
+    # bytes sent to a port
+    def sent(self, port, data, at=None):
+        self.append(self.channel(port), TX, data, at)
+
+    def append(self, channel, kind, data, at=None):
+        with self.lock:
+            self.write_record(time.monotonic() if at is None else at, channel, kind, data)
+
+    # caller holds the lock
+    def write_record(self, at, channel, kind, data):
+        if self.file is None:
+            return
+        self.file.write(RECORD.pack(at, len(data), channel, kind))
+        self.file.write(data)
+
+    # write the buffered records to disk every FLUSH_INTERVAL until closed
+    def flush_loop(self):
+        while not self.closing.wait(FLUSH_INTERVAL):
+            with self.lock:
+                if self.file is not None:
+                    self.file.flush()
+
+    def close(self):
+        self.closing.set()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+# keep the newest keep captures in directory, and only as many of them as fit in max_bytes together
+def prune_captures(directory, keep, max_bytes=None):
+    captures = sorted(Path(directory).glob('*.cap'), key=lambda path: path.stat().st_mtime, reverse=True)
+    kept_bytes = 0
+    for index, path in enumerate(captures):
+        kept_bytes += path.stat().st_size
+        if index < keep and (max_bytes is None or kept_bytes <= max_bytes):
+            continue
+        try:
+            path.unlink()
+        except OSError as e:
+            logger.warning(f'Could not remove old capture {path}: {e}')
+
+
+# newest capture in directory, None if there is none
+def latest_capture(directory=CAPTURE_DIRECTORY):
+    captures = sorted(Path(directory).glob('*.cap'), key=lambda path: path.stat().st_mtime)
+    return captures[-1] if captures else None
+
+
+# a capture file, memory-mapped so hours of traffic are read straight from the page cache
+class SessionReplay:
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = self.path.open('rb')
+        self.map = None
+        if self.path.stat().st_size < len(MAGIC):
+            self.close()
+            raise ValueError(f'{path} is not a serial session capture')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a serial session capture')
+        self.channels = {}  # channel id -> {'port': ..., 'baudrate': ...}
+
+    # every record as (time, channel id, kind, payload as a memoryview into the map); a record cut off
+    # by a crash ends the iteration
+    def records(self):
+        view = memoryview(self.map)
+        offset = len(MAGIC)
+        end = len(self.map)
+        while offset + RECORD.size <= end:
+            at, length, channel, kind = RECORD.unpack_from(self.map, offset)
+            offset += RECORD.size
+            if offset + length > end:
+                break
+            payload = view[offset:offset + length]
+            offset += length
+            if kind == CHANNEL:
+                self.channels[channel] = json.loads(bytes(payload))
+            yield at, channel, kind, payload
+
+    # received bytes per port in recorded order, paced at speed times the original rate (None: no pacing)
+    def play(self, speed=1.0, kinds=(RX,)):
+        started = None
+        first = None
+        for at, channel, kind, payload in self.records():
+            if kind not in kinds:
+                continue
+            if speed:
+                if started is None:
+                    started, first = time.monotonic(), at
+                delay = (at - first) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            yield self.channels.get(channel, {}).get('port', str(channel)), payload
+
+    # bytes and time span per port and direction
+    def summary(self):
+        totals = {}
+        first = last = None
+        for at, channel, kind, payload in self.records():
+            if kind in (RX, TX):
+                first = at if first is None else first
+                last = at
+                key = (self.channels.get(channel, {}).get('port', str(channel)), 'rx' if kind == RX else 'tx')
+                totals[key] = totals.get(key, 0) + len(payload)
+        return totals, (last - first) if first is not None else 0.0
+
+    def close(self):
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # payload views are still alive, the map is unmapped with the last of them
+            self.map = None
+        self.file.close()
+
+
+# replay the received bytes of a capture into one pseudo-terminal per recorded port, for the app to open
+def replay_to_ptys(path, speed=1.0):
+    replay = SessionReplay(path)
+    terminals = {}  # recorded port -> (master fd, slave fd, device)
+
+    def terminal(port):
+        if port not in terminals:
+            master, slave = pty.openpty()
+            tty.setraw(slave)
+            os.set_blocking(master, False)
+            terminals[port] = (master, slave, os.ttyname(slave))
+            print(f'{port} -> {terminals[port][2]}')
+        return terminals[port][0]
+
+    # declare every port first, so the app can be pointed at all of them before the data starts
+    for at, channel, kind, payload in replay.records():
+        if kind == CHANNEL:
+            terminal(replay.channels[channel]['port'])
+    input('Open the ports in the app, then press Enter to start the replay')
+    started = time.monotonic()
+    total = 0
+    dropped = 0
+    try:
+        for port, payload in replay.play(speed):
+            # bytes nobody reads are lost once the terminal buffer is full, as on a real port
+            try:
+                written = os.write(terminal(port), payload)
+            except BlockingIOError:
+                written = 0
+            total += written
+            dropped += len(payload) - written
+    finally:
+        print(f'Replayed {total} bytes in {time.monotonic() - started:.1f} s, {dropped} bytes dropped')
+        replay.close()
+        input('Press Enter to close the ports')
+        for master, slave, _ in terminals.values():
+            os.close(master)
+            os.close(slave)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serial session captures')
+    parser.add_argument('command', choices=['info', 'replay'])
+    parser.add_argument('capture', nargs='?', help='capture file, the newest one when left out')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 1 is real time')
+    parser.add_argument('--max', action='store_true', help='replay as fast as possible')
+    args = parser.parse_args()
+    path = args.capture or latest_capture()
+    if not path:
+        parser.error(f'no capture given and none found in {CAPTURE_DIRECTORY}')
+    if args.command == 'info':
+        replay = SessionReplay(path)
+        totals, span = replay.summary()
+        print(f'{path}: {span:.1f} s')
+        for (port, direction), size in sorted(totals.items()):
+            print(f'  {port} {direction}: {size} bytes')
+        replay.close()
+    else:
+        replay_to_ptys(path, None if args.max else args.speed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import multiprocessing
+import os
+import signal
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from PyQt5.QtCore import QThread, pyqtSignal
+import arduinoUtils
+from cliWorker import full_sketch_path
+from logger_config import setup_logger
+from serialTransport import STOP_TIMEOUT_MS
+
+logger = setup_logger(__name__)
+
+PRECOMPILE_WORKERS = min(4, os.cpu_count() or 1)  # arduino-cli compiles run in parallel up to this many
+stop_event = None  # in pool processes: set by SketchPrecompiler.stop()
+
+
+# runs in every pool process as it starts
+def init_pool_process(event):
+    global stop_event
+    stop_event = event
+
+
+# run one arduino-cli compile in a pool process, killed once stop_event is set; (return code, stderr)
+def compile_in_process(command):
+    if stop_event is not None and stop_event.is_set():
+        return None, 'stopped'
+    # own process group, so the compiler processes it starts can be killed with it
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                               start_new_session=(os.name == 'posix'))
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=0.1)
+            return process.returncode, stderr
+        except subprocess.TimeoutExpired:
+            if stop_event is not None and stop_event.is_set():
+                if os.name == 'posix':
+                    os.killpg(process.pid, signal.SIGKILL)
+                else:
+                    process.kill()
+                process.communicate()
+                return None, 'stopped'
+
+
+# unique sketches of a test file, full path -> names of the tests that upload it, in test order
+def plan_sketches(test_data, filepath):
+    sketches = {}
+    if not test_data or not filepath:
+        return sketches
+    for test_key, test in test_data.get('tests', {}).items():
+        sketch_path = test.get('sketch', '')
+        if sketch_path:
+            sketches.setdefault(full_sketch_path(filepath, sketch_path), []).append(test_key)
+    return sketches
+
+
+# compiles every sketch of a freshly loaded test file into the compile cache while the chamber heats up,
+# so compile errors show before the run and each test only has to flash its build
+class SketchPrecompiler(QThread):
+
+    progress = pyqtSignal(str)  # messages for the instruction listbox
+    compile_failures = pyqtSignal(list)  # (test names, sketch, error) of every sketch that did not compile
+    cache_stats = pyqtSignal(dict)  # hit/miss counts of the compile cache once all builds are done
+
+    def __init__(self, test_data, filepath, port, compile_cache, workers=PRECOMPILE_WORKERS):
+        super().__init__()
+        self.test_data = test_data
+        self.filepath = filepath
+        self.port = port  # test board, whose fqbn the sketches are compiled for
+        self.compile_cache = compile_cache
+        self.workers = workers
+        self.pool = None
+        self.context = multiprocessing.get_context('spawn')  # not forked from a thread of a running qt app
+        self.stop_event = self.context.Event()  # kills the compiles in progress
+        self.is_running = True
+
+    def run(self):
+        sketches = plan_sketches(self.test_data, self.filepath)
+        if not sketches or not self.is_running:
+            return
+        fqbn = arduinoUtils.detect_board(self.port)
+        if not self.is_running:
+            return
+        if not fqbn:
+            logger.warning(f'No board detected on {self.port}: sketches are compiled per test')
+            self.progress.emit('Test board not detected: sketches are compiled per test')
+            return
+        arduinoUtils.install_core_if_needed(fqbn)  # also updates the compile cache
+
+        failures = []
+        builds = {}  # key -> sketch, each build compiled once however many tests use it
+        for sketch, tests in sketches.items():
+            if not self.is_running:
+                return  # every key reads the sketch and its libraries, stop between them
+            if not Path(sketch).exists():
+                failures.append((tests, sketch, 'sketch not found'))
+                continue
+            key = self.compile_cache.key(fqbn, sketch, arduinoUtils.run_cli_command)
+            if key not in builds and not self.compile_cache.contains(key):
+                builds[key] = sketch
+        if not self.is_running:
+            return
+        # cli workers wait for these instead of compiling them too; a build compiling elsewhere already is left to it
+        builds = {key: sketch for key, sketch in builds.items() if self.compile_cache.begin(key)}
+        logger.info(f'Precompiling {len(builds)} of {len(sketches)} sketches for {fqbn}')
+        if builds:
+            self.progress.emit(f'Precompiling {len(builds)} sketches for test board')
+            failures += self.compile_all(builds, fqbn, sketches)
+        if failures:
+            self.compile_failures.emit(failures)
+        elif self.is_running:
+            self.progress.emit(f'All {len(sketches)} sketches compiled')
+        self.cache_stats.emit(self.compile_cache.stats())
+
+    # compile the claimed builds in a process pool and store each one as it finishes; the failures
+    def compile_all(self, builds, fqbn, sketches):
+        failures = []
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context,
+                                        initializer=init_pool_process, initargs=(self.stop_event,))
+        try:
+            futures = {}
+            for key, sketch in builds.items():
+                command = ['arduino-cli', 'compile', '--fqbn', fqbn, sketch,
+                           '--output-dir', str(self.compile_cache.staging_directory(key))]
+                futures[self.pool.submit(compile_in_process, command)] = key
+            for future in as_completed(futures):
+                key = futures[future]
+                sketch = builds[key]
+                try:
+                    returncode, stderr = future.result()
+                except Exception as e:  # the pool broke down
+                    returncode, stderr = None, str(e)
+                if returncode == 0:
+                    self.compile_cache.store(key, sketch, fqbn)
+                    logger.info(f'Precompiled {sketch}')
+                elif self.is_running:
+                    logger.warning(f'Precompiling {sketch} failed: {stderr}')
+                    failures.append((sketches[sketch], sketch, stderr.strip()))
+                self.compile_cache.end(key)
+        finally:
+            self.pool.shutdown(wait=False)
+            for key in builds:
+                self.compile_cache.end(key)  # never leave a worker waiting for a build that will not come
+        return failures
+
+    # kill the compiles in progress; the ones that have not started return at once
+    def stop(self):
+        self.is_running = False
+        self.stop_event.set()
+        if QThread.currentThread() is not self:
+            self.wait(STOP_TIMEOUT_MS)
+        logger.info('Sketch precompiler stopped')
@@ -0,0 +1,85 @@
+import struct
+from datetime import datetime, timezone
+
+# binary ping_response frame, negotiated in the handshake ("telemetry": "binary")
+# layout must match TelemetryFrame in the firmware, all fields little-endian:
+#   sync (2) | version | flags | machine_state | current_sequence | current_test | queued_tests |
+#   timestamp (unix s) | current_temp (c°C) | desired_temp (c°C) | current_duration (ms) | time_left (s) | crc16
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_VERSION = 1
+FRAME = struct.Struct('<2sBBBBHHIhhIiH')
+FRAME_SIZE = FRAME.size
+
+FLAG_ALIVE = 0x01
+FLAG_TEST_RUNNING = 0x02
+NO_TEST = 0xFFFF  # current_test index when no test is loaded
+
+# machine state codes, same order as the firmware's state defines
+MACHINE_STATES = ['IDLE', 'HEATING', 'COOLING', 'EVALUATE', 'EMERGENCY_STOP']
+
+
+# crc-16/ccitt-false lookup table
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+
+
+CRC16_TABLE = _crc16_table()
+
+
+# crc-16/ccitt-false (poly 0x1021, init 0xffff), same as crc16() in the firmware
+def crc16(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC16_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+# check sync, version and crc of a complete frame
+def is_valid_frame(frame):
+    if len(frame) != FRAME_SIZE or frame[:2] != FRAME_SYNC or frame[2] != FRAME_VERSION:
+        return False
+    crc, = struct.unpack_from('<H', frame, FRAME_SIZE - 2)
+    return crc16(frame[2:-2]) == crc
+
+
+# decode a frame into the same structure as the json ping_response
+def decode_frame(frame, test_names=()):
+    (_, _, flags, state, sequence, test_index, queued_tests, timestamp,
+     current_temp, desired_temp, current_duration, time_left, _) = FRAME.unpack(frame)
+    if test_index != NO_TEST and test_index < len(test_names):
+        current_test = test_names[test_index]
+    else:
+        current_test = ''
+    return {
+        'alive': bool(flags & FLAG_ALIVE),
+        'timestamp': datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine_state': MACHINE_STATES[state] if state < len(MACHINE_STATES) else 'UNKNOWN',
+        'current_temp': current_temp / 100,
+        'test_status': {
+            'is_test_running': bool(flags & FLAG_TEST_RUNNING),
+            'current_test': current_test,
+            'current_sequence': sequence,
+            'desired_temp': desired_temp / 100,
+            'current_duration': current_duration,
+            'time_left': time_left,
+            'queued_tests': queued_tests,
+        },
+    }
+
+
+# build a frame from ping_response-like values (used for simulation and tests of the decoder)
+def encode_frame(alive, timestamp, machine_state, current_temp, is_test_running, current_test_index,
+                 current_sequence, desired_temp, current_duration, time_left, queued_tests):
+    flags = (FLAG_ALIVE if alive else 0) | (FLAG_TEST_RUNNING if is_test_running else 0)
+    state = MACHINE_STATES.index(machine_state) if machine_state in MACHINE_STATES else 0xFF
+    test_index = NO_TEST if current_test_index is None else current_test_index
+    body = FRAME.pack(FRAME_SYNC, FRAME_VERSION, flags, state, current_sequence, test_index, queued_tests,
+                      int(timestamp), round(current_temp * 100), round(desired_temp * 100),
+                      int(current_duration), int(time_left), 0)
+    return body[:-2] + struct.pack('<H', crc16(body[2:-2]))
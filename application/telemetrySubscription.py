@@ -0,0 +1,71 @@
+import time
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+RENEW_INTERVAL = 60.0  # seconds between subscription renewals, which also keep the firmware's ping timeout at bay
+STALE_FACTOR = 3  # the stream counts as stopped after this many missed status frames
+MIN_STALE_TIMEOUT = 2.0  # ...but never sooner than this many seconds
+MAX_SUBSCRIBE_ATTEMPTS = 3  # unanswered SUBSCRIBE commands in a row before falling back to polling
+
+
+# state of the push-mode telemetry stream and the watchdog that notices when it stops
+class TelemetrySubscription:
+
+    def __init__(self):
+        self.active = False  # status frames are being streamed
+        self.pending = False  # a SUBSCRIBE command is waiting for its answer
+        self.supported = True  # set to False when the firmware never answers SUBSCRIBE
+        self.interval = None  # streaming interval in seconds
+        self.last_frame = 0.0
+        self.last_renew = 0.0
+        self.failed_attempts = 0
+
+    # the control board confirmed the subscription
+    def start(self, interval, now=None):
+        now = time.monotonic() if now is None else now
+        self.active = True
+        self.pending = False
+        self.interval = interval
+        self.last_frame = now
+        self.last_renew = now
+        self.failed_attempts = 0
+
+    # the stream stopped or was never confirmed
+    def stop(self):
+        self.active = False
+        self.pending = False
+
+    # a SUBSCRIBE command went unanswered, returns False once polling should take over for good
+    def subscribe_failed(self):
+        self.pending = False
+        self.failed_attempts += 1
+        if self.failed_attempts >= MAX_SUBSCRIBE_ATTEMPTS:
+            logger.warning('Control board does not answer SUBSCRIBE, staying with ping polling')
+            self.supported = False
+        return self.supported
+
+    # a status frame arrived
+    def frame_received(self, now=None):
+        self.last_frame = time.monotonic() if now is None else now
+
+    # seconds without a frame before the watchdog fires
+    def stale_timeout(self):
+        return max(MIN_STALE_TIMEOUT, STALE_FACTOR * (self.interval or 0))
+
+    # watchdog: no status frame for too long
+    def is_stale(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.active and now - self.last_frame > self.stale_timeout()
+
+    # time to renew the subscription
+    def renew_due(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.active and not self.pending and now - self.last_renew >= RENEW_INTERVAL
+
+    # seconds until the watchdog or the renewal needs attention
+    def next_check_in(self, now=None):
+        now = time.monotonic() if now is None else now
+        stale_at = self.last_frame + self.stale_timeout()
+        renew_at = self.last_renew + RENEW_INTERVAL
+        return max(0.0, min(stale_at, renew_at) - now)
@@ -0,0 +1,146 @@
+import argparse
+import fcntl
+import os
+import pty
+import random
+import string
+import struct
+import termios
+import threading
+import time
+import tty
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# usage: python testBoardSimulator.py [--rate 1000] [--burst 50] [--incorrect 0.1] [--corrupt 0.01]
+
+ALPHABET = string.ascii_uppercase  # what the sketches under tests/ print
+OS_BUFFER = 4096  # bytes the receiving side may hold before further lines are lost
+
+
+# a test board sketch on a pseudo-terminal: prints the expected line at a set rate, in bursts if asked,
+# with a share of incorrect and corrupted lines; lines that do not fit the receiver's buffer are dropped
+class TestBoardSimulator:
+
+    def __init__(self, line=ALPHABET, line_rate=2.0, line_length=None, burst=1, incorrect_rate=0.0,
+                 corrupt_rate=0.0, os_buffer=OS_BUFFER, seed=None):
+        # longer lines repeat the pattern, e.g. line_length=100 for 100 letters
+        self.line = (line * (line_length // len(line) + 1))[:line_length] if line_length else line
+        self.line_rate = line_rate  # average lines per second
+        self.burst = max(1, burst)  # lines written back to back, followed by a pause that keeps the average
+        self.incorrect_rate = incorrect_rate  # share of lines with one wrong letter
+        self.corrupt_rate = corrupt_rate  # share of lines with one byte garbled on the wire
+        self.os_buffer = os_buffer
+        self.random = random.Random(seed)
+        self.master = None
+        self.slave = None
+        self.device = None
+        self.thread = None
+        self.running = threading.Event()
+        self.sent = []  # (monotonic send time, line was correct) for every line that was delivered
+        self.dropped = 0
+        self.kinds = {'correct': 0, 'incorrect': 0, 'corrupt': 0}
+
+    # create the pseudo-terminal and return the device the app should open
+    def open(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.device = os.ttyname(self.slave)
+        return self.device
+
+    # start printing lines in a background thread
+    def start(self, count=None):
+        if self.device is None:
+            self.open()
+        self.running.set()
+        self.thread = threading.Thread(target=self.run, args=(count,), name='test-board-simulator', daemon=True)
+        self.thread.start()
+        logger.info(f'Test board simulator on {self.device}: {self.line_rate:g} lines/s, bursts of {self.burst}')
+        return self.device
+
+    # stop printing and remove the pseudo-terminal
+    def stop(self):
+        self.running.clear()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    # wait until count lines have been printed (all of them when started without a count)
+    def join(self, timeout=None):
+        if self.thread:
+            self.thread.join(timeout)
+
+    def run(self, count):
+        interval = self.burst / self.line_rate
+        next_burst = time.monotonic()
+        printed = 0
+        while self.running.is_set() and (count is None or printed < count):
+            delay = next_burst - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            for _ in range(self.burst if count is None else min(self.burst, count - printed)):
+                self.print_line()
+                printed += 1
+            next_burst += interval
+
+    # one Serial.println of the expected line, or a wrong or garbled one
+    def print_line(self):
+        roll = self.random.random()
+        data = self.line.encode('ascii')
+        if roll < self.corrupt_rate:
+            kind = 'corrupt'
+            position = self.random.randrange(len(data))
+            data = data[:position] + bytes([self.random.randrange(0x80, 0xFF)]) + data[position + 1:]
+        elif roll < self.corrupt_rate + self.incorrect_rate:
+            kind = 'incorrect'
+            position = self.random.randrange(len(data))
+            wrong = self.random.choice([letter for letter in ALPHABET if letter != self.line[position]])
+            data = data[:position] + wrong.encode('ascii') + data[position + 1:]
+        else:
+            kind = 'correct'
+        data += b'\r\n'
+        self.kinds[kind] += 1
+        # a line that no longer fits the receiver's buffer is lost, as on a uart that nobody reads fast enough
+        if self.waiting() + len(data) > self.os_buffer:
+            self.dropped += 1
+            return
+        try:
+            os.write(self.master, data)
+        except (BlockingIOError, OSError):
+            self.dropped += 1
+            return
+        self.sent.append((time.monotonic(), kind == 'correct'))
+
+    # bytes written but not read by the app yet
+    def waiting(self):
+        try:
+            return struct.unpack('i', fcntl.ioctl(self.slave, termios.TIOCINQ, b'\0' * 4))[0]
+        except OSError:
+            return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Test board output simulator')
+    parser.add_argument('--rate', type=float, default=2.0, help='average lines per second')
+    parser.add_argument('--length', type=int, default=None, help='line length, the alphabet repeated')
+    parser.add_argument('--burst', type=int, default=1, help='lines printed back to back')
+    parser.add_argument('--incorrect', type=float, default=0.0, help='share of lines with a wrong letter')
+    parser.add_argument('--corrupt', type=float, default=0.0, help='share of lines with a garbled byte')
+    args = parser.parse_args()
+    simulator = TestBoardSimulator(line_rate=args.rate, line_length=args.length, burst=args.burst,
+                                   incorrect_rate=args.incorrect, corrupt_rate=args.corrupt)
+    print(f'Test board simulator running on {simulator.start()}, Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
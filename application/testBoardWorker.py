@@ -1,24 +1,31 @@
 from PyQt5.QtCore import QThread, pyqtSignal, QTimer
 import time
 import serial
-import re
 from logger_config import setup_logger
+from outputMatcher import BlockMatcher, VerdictSummary, SUMMARY_INTERVAL
+from serialReader import LineScanner
+from serialTransport import SerialTransport, STOP_TIMEOUT_MS
 
 logger = setup_logger(__name__)
 
 
 class TestBoardWorker(QThread):
 
-    update_upper_listbox = pyqtSignal(str)  # signal to update instruction listbox
-    expected_outcome_listbox = pyqtSignal(str)  # signal to show expected test outcome
-    all_good = pyqtSignal()
+    # verdicts, latest line and rates, at most every SUMMARY_INTERVAL however fast the board prints
+    output_summary = pyqtSignal(dict)
 
-    def __init__(self, test_data, test_number, port, baudrate, timeout=5):
+    def __init__(self, test_data, test_number, port, baudrate, timeout=5, broker=None):
         super().__init__()
         self.test_data = test_data
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
+        # reads end as soon as stop() closes it; through the broker the port stays open between workers
+        # raw byte chunks, split into lines here without a copy or decode per line
+        self.transport = broker.subscribe(port, baudrate, 'test board worker', raw=True) if broker else SerialTransport(port, baudrate)
+        self.scanner = LineScanner()
+        self.matchers = {}  # test key -> BlockMatcher, compiled once per test
+        self.summary = VerdictSummary()  # output is verified here, the gui only gets the totals
         self.ser = None  # future serial connection object
         self.is_open = True
         self.is_running = True  # flag to keep the thread running
@@ -26,6 +33,7 @@ class TestBoardWorker(QThread):
         self.last_command_time = time.time()
         # test number (index, actually) for checking exp output correctly
         self.test_number = test_number
+        self.matcher = self.matcher_for(test_number)
 
     # set up serial communication
     def serial_setup(self, port=None, baudrate=None):
@@ -34,10 +42,12 @@ class TestBoardWorker(QThread):
         if baudrate:
             self.baudrate = baudrate
         try:
-            self.ser = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+            self.transport.port = self.port
+            self.transport.baudrate = self.baudrate
+            ready = self.transport.open(settle=1)  # make sure arduino is ready, unless stopped meanwhile
+            self.ser = self.transport.ser
             logger.info(f'Test board worker connected to arduino port: {self.port}')
-            time.sleep(1)  # make sure arduino is ready
-            return True
+            return ready and self.is_running  # stop() may have come before open() cleared the cancel
         except serial.SerialException as e:
             logger.exception(f'Error during serial setup: {e}')
             return False
@@ -45,118 +55,95 @@ class TestBoardWorker(QThread):
     # main operating method for serial response readout
     def run(self):
         if not self.serial_setup():
-            logger.error(f'Test board worker failed to connect to {self.port}')
+            if self.is_running:
+                logger.error(f'Test board worker failed to connect to {self.port}')
+            self.stop()
             return
         logger.info('Test board thread is running')
         # wrap the whole while-loop in a try-except statement to prevent crashes in case of system failure
         try:
             while self.is_running:
                 if self.is_stopped:
-                    time.sleep(0.1)
+                    self.transport.wait(0.1)
                     continue
                 try:
-                    if self.ser and self.ser.is_open:
-                        # continuous readout from serial
-                        response = self.ser.readline().decode('utf-8').strip()
-                        if response:
-                            self.show_response(response)
+                    if self.transport.is_open():
+                        # everything received so far in one read; b'' when nothing came in time to send
+                        # the next summary, or once stop() closes the transport
+                        data = self.transport.read_available(SUMMARY_INTERVAL)
+                        if data:
+                            self.scanner.feed(data, self.handle_line)
+                        self.emit_summary()
                 except serial.SerialException as e:
-                    logger.exception(f'Serial error: {e}')
+                    if self.is_running:
+                        logger.exception(f'Serial error: {e}')
                     self.is_running = False
-                time.sleep(0.1)  # avoid excessive cpu usage
         except Exception as e:
             # catch any other unexpected exceptions
             logger.exception(f'Unexpected error: {e}')
             self.is_running = False
 
+        self.emit_summary(final=True)
         self.stop()
 
     # method to stop the serial communication
     def stop(self):
         self.is_running = False  # Stop the worker thread loop
+        self.transport.close()  # wakes up a pending readline at once
         try:
-            if self.ser and self.ser.is_open:
-                self.ser.close()  # Close the serial connection
-                logger.info(f"Connection to {self.port} closed successfully.")
-        except serial.SerialException as e:
-            logger.error(f"Serial exception while closing connection to {self.port}: {e}")
+            self.quit()  # Gracefully terminate the thread
+            # stop() also runs at the end of run(), where the thread cannot wait for itself
+            if QThread.currentThread() is not self:
+                self.wait(STOP_TIMEOUT_MS)
+            logger.info("Test Board Worker thread exited successfully.")
         except Exception as e:
-            logger.error(f"Unexpected error while closing connection to {self.port}: {e}")
-        finally:
-            try:
-                self.quit()  # Gracefully terminate the thread
-                self.wait()  # Ensure thread termination before cleanup
-                logger.info("Test Board Worker thread exited successfully.")
-            except Exception as e:
-                logger.error(f"Error during thread termination: {e}")
-
-    # show serial response
-    def show_response(self, response):
-        if response:
-            printout = f'{response}'
-            if self.test_data:
-                message = self.extract_deterministic_part(printout)  # extract deterministic output part
-                self.update_upper_listbox.emit(message)  # emit signal to update listbox
-                self.expected_outcome_listbox.emit(message)  # emit signal to update expected outcome
-                self.all_good.emit()
-            else:
-                self.update_upper_listbox.emit(printout)  # emit signal to update listbox
-                self.expected_outcome_listbox.emit(printout)  # emit signal to update expected outcome
-                self.all_good.emit()
+            logger.error(f"Error during thread termination: {e}")
 
-    # DETERMINISTIC AND NON-DETERMINISTIC OUTPUT READOUT
-    # extract expected test outcome from test file
-    def expected_output(self, test_data):
-        if test_data is not None and 'tests' in test_data:
-            all_tests = [key for key in test_data['tests'].keys()]
-            current_test_index = self.test_number
-            if current_test_index < len(all_tests):
-                current_test_key = all_tests[current_test_index]
-                test = self.test_data['tests'][current_test_key]
-                logger.info(test)
-                expected_output = test.get('expected_output', '')  # get pertinent exp output
-                return expected_output
-            return
+    # switch to another test of the file; its matcher is compiled on first use and kept
+    def set_test_number(self, test_number):
+        self.test_number = test_number
+        self.matcher = self.matcher_for(test_number)
+        if self.matcher is not None:
+            self.matcher.reset()  # the new test's output starts a fresh block
 
-    # get expected pattern
-    def get_expected_pattern(self):
-        if self.test_data:
-            expected_output = self.expected_output(self.test_data)
-            regex_pattern = self.encode_pattern(expected_output)
-            logger.debug(f'Getting expected pattern: {regex_pattern}')
-            return regex_pattern
-        return
+    # compiled expected output of a test, None without test data
+    def matcher_for(self, test_number):
+        if not self.test_data or 'tests' not in self.test_data:
+            return None
+        all_tests = list(self.test_data['tests'])
+        if test_number >= len(all_tests):
+            return None
+        test_key = all_tests[test_number]
+        if test_key not in self.matchers:
+            expected = self.test_data['tests'][test_key].get('expected_output', '')
+            self.matchers[test_key] = BlockMatcher(expected)
+            logger.info(f'Expected output of {test_key}: {expected}')
+        return self.matchers[test_key]
 
-    # encode pattern
-    def encode_pattern(self, expected_pattern):
-        if '***' in expected_pattern:
-            # escape special characters and use '(.*)' as a placeholder for non-deterministic parts
-            regex_pattern = re.escape(expected_pattern).replace(r'\*\*\*', '(.*)')
+    # one line from the scanner, a memoryview that is only valid during this call
+    def handle_line(self, line):
+        matcher = self.matcher
+        expected = matcher.current() if matcher is not None else None
+        if expected is not None and expected.deterministic and line == expected.expected_bytes:
+            # correct output is compared as bytes and shown as the expected string, nothing is decoded
+            response = expected.expected
         else:
-            regex_pattern = expected_pattern
-        regex_pattern = f'^{regex_pattern}$'
-        logger.debug(f'Encoding pattern: {regex_pattern}')
-        return regex_pattern
+            response = str(line, 'utf-8', 'replace').strip()
+            if not response:
+                return
+        self.check_response(response)
+
+    # DETERMINISTIC AND NON-DETERMINISTIC OUTPUT READOUT
+    # advance the test's matcher by one line and count its verdict once one is reached
+    def check_response(self, response):
+        self.summary.latest = response
+        if self.matcher is not None:
+            verdict = self.matcher.feed_line(response)
+            if verdict:
+                self.summary.add(verdict)
 
-    # extract deterministic test output part
-    def extract_deterministic_part(self, message):
-        regex_pattern = self.get_expected_pattern()
-        match = re.match(regex_pattern, message)
-        logger.debug('About to search for matches')
-        if match:
-            if '(.*)' in regex_pattern:
-                # non-deterministic part is captured as the first group in the match
-                non_deterministic_part = match.group(1) if match.lastindex is not None else ''
-                # extract non-deterministic captured group '(.*)'
-                deterministic_parts = re.split(r'\(\.\*\)', regex_pattern)
-                deterministic_output = "".join(deterministic_parts)
-                if non_deterministic_part:
-                    logger.info(f'Non-deterministic output: {non_deterministic_part}')
-                logger.debug(f'Deterministic_output: {deterministic_output}')
-                return deterministic_output
-            else:
-                # if the pattern is fully deterministic, return the message as-is
-                logger.debug(f'Fully deterministic match: {message}')
-                return message
-        logger.debug(f'No matches found, the message is: {message}')
-        return message
+    # send the gui a summary if one is due
+    def emit_summary(self, final=False):
+        summary = self.summary.take(time.monotonic(), self.scanner.lines, self.scanner.bytes, final)
+        if summary:
+            self.output_summary.emit(summary)
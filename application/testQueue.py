@@ -0,0 +1,74 @@
+from threading import Lock
+from logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+DEFAULT_LOOKAHEAD = 1  # tests kept on the control board after the one it is running
+
+
+# the test plan as the app knows it; the control board only ever holds the next few tests
+class TestQueue:
+
+    def __init__(self, lookahead=DEFAULT_LOOKAHEAD):
+        self.lock = Lock()  # tests are added from the gui thread, progress comes in on the worker thread
+        self.lookahead = max(0, int(lookahead))
+        self.names = []  # plan order, index is what the control board reports as current test
+        self.tests = {}  # name -> test definition
+        self.position = 0  # tests completed so far
+        self.fed = 0  # tests handed to the control board so far
+        self.skipped = set()  # tests the control board refused, they keep their index but never run
+
+    # add tests to the end of the plan
+    def extend(self, tests):
+        with self.lock:
+            for name, test in tests.items():
+                if name in self.tests:
+                    logger.warning(f'Test {name} is already queued, skipping it')
+                    continue
+                self.names.append(name)
+                self.tests[name] = test
+
+    # forget the whole plan, e.g. after a reset or an emergency stop
+    def clear(self):
+        with self.lock:
+            self.names = []
+            self.tests = {}
+            self.position = 0
+            self.fed = 0
+            self.skipped = set()
+
+    # tests that should be on the control board but are not yet: (first plan index, {name: test})
+    def due(self):
+        with self.lock:
+            end = min(len(self.names), self.position + 1 + self.lookahead)
+            return self.fed, {name: self.tests[name] for name in self.names[self.fed:end]}
+
+    # count tests as handed to the control board
+    def mark_fed(self, count):
+        with self.lock:
+            self.fed = min(len(self.names), self.fed + count)
+
+    # tests the control board refused
+    def skip(self, names):
+        with self.lock:
+            self.skipped.update(names)
+
+    # a test finished on the control board
+    def complete(self, name):
+        with self.lock:
+            if name in self.names[self.position:]:
+                self.position = self.names.index(name, self.position) + 1
+            else:
+                # unnamed or unknown completion, assume the plan moved on by one
+                self.position = min(len(self.names), self.position + 1)
+            self.fed = max(self.fed, self.position)
+
+    # tests not completed yet, including the running one
+    def remaining(self):
+        with self.lock:
+            return sum(1 for name in self.names[self.position:] if name not in self.skipped)
+
+    # the whole plan in the same shape the control board used to send it, for the gui
+    def as_dict(self):
+        with self.lock:
+            return {'tests': {name: self.tests[name] for name in self.names}}
@@ -6,6 +6,7 @@ from logger_config import setup_logger
 import commands
 from datetime import datetime
 from queue import Queue
+from serialTransport import SerialTransport, STOP_TIMEOUT_MS
 
 logger = setup_logger(__name__)
 
@@ -14,12 +15,14 @@ class WifiWorker(QThread):
 
     output_received = pyqtSignal(str)
 
-    def __init__(self, port, baudrate, timeout=5):
+    def __init__(self, port, baudrate, timeout=5, broker=None):
         super().__init__()
         # serial setup variables
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
+        # reads end as soon as stop() closes it; through the broker the port stays open between workers
+        self.transport = broker.subscribe(port, baudrate, 'wifi worker') if broker else SerialTransport(port, baudrate)
         self.ser = None  # future serial connection object
         self.is_open = True
         self.is_running = True  # flag to keep the thread running
@@ -34,10 +37,12 @@ class WifiWorker(QThread):
         if baudrate:
             self.baudrate = baudrate
         try:
-            self.ser = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
+            self.transport.port = self.port
+            self.transport.baudrate = self.baudrate
+            ready = self.transport.open(settle=1)  # make sure arduino is ready, unless stopped meanwhile
+            self.ser = self.transport.ser
             logger.info(f'Wifi worker connected to arduino port: {self.port}')
-            time.sleep(1)  # make sure arduino is ready
-            return True
+            return ready and self.is_running  # stop() may have come before open() cleared the cancel
         except serial.SerialException as e:
             logger.exception(f'Error during serial setup of Wifi worker: {e}')
             return False
@@ -46,7 +51,9 @@ class WifiWorker(QThread):
     def run(self):
         # Ensure the serial setup is successful before entering the loop
         if not self.serial_setup():
-            logger.error(f"Wifi worker failed to connect to port: {self.port}")
+            if self.is_running:
+                logger.error(f"Wifi worker failed to connect to port: {self.port}")
+            self.stop()
             return
 
         logger.info("Wifi worker thread started.")
@@ -54,21 +61,22 @@ class WifiWorker(QThread):
             while self.is_running:  # Main thread loop
                 if self.is_stopped:
                     logger.debug("Wifi worker is stopped. Waiting...")
-                    time.sleep(0.1)  # Small delay to avoid excessive CPU usage
+                    self.transport.wait(0.1)  # Small delay to avoid excessive CPU usage
                     continue
 
                 # Check if the serial connection is still valid
-                if not self.ser or not self.ser.is_open:
+                if not self.transport.is_open():
                     logger.warning(f"Wifi worker lost connection to port: {self.port}")
                     self.stop()  # Gracefully stop the worker
                     break
 
                 try:
                     # Read data from the serial port
-                    response = self.ser.readline().decode('utf-8').strip()
+                    # returns None after timeout seconds of silence, or at once when stop() closes the transport
+                    response = self.transport.readline(timeout=self.timeout)
                     if response:
                         self.show_response(response)  # Process and display the response
-                    else:
+                    elif self.is_running:
                         logger.info('[Wifi] No data received from the serial port.')
 
                     # Send periodic logs or actions to keep track of activity
@@ -77,11 +85,10 @@ class WifiWorker(QThread):
                         logger.info("WiFi worker thread is running smoothly.")
 
                 except serial.SerialException as e:
-                    logger.exception(f"Serial exception in WiFi worker: {e}")
+                    if self.is_running:
+                        logger.exception(f"Serial exception in WiFi worker: {e}")
                     self.is_running = False  # Exit the main loop
 
-                time.sleep(0.1)  # Avoid excessive CPU usage
-
         except Exception as e:
             logger.exception(f"Unexpected exception in WiFi worker: {e}")
             self.is_running = False  # Stop the worker on unexpected error
@@ -92,21 +99,15 @@ class WifiWorker(QThread):
     # method to stop the serial communication
     def stop(self):
         self.is_running = False  # Stop the worker thread loop
+        self.transport.close()  # wakes up a pending readline at once
         try:
-            if self.ser and self.ser.is_open:
-                self.ser.close()  # Close the serial connection
-                logger.info(f"Connection to {self.port} closed successfully.")
-        except serial.SerialException as e:
-            logger.error(f"Serial exception while closing connection to {self.port}: {e}")
+            self.quit()  # Gracefully terminate the thread
+            # stop() also runs at the end of run(), where the thread cannot wait for itself
+            if QThread.currentThread() is not self:
+                self.wait(STOP_TIMEOUT_MS)
+            logger.info("Wifi Worker thread exited successfully.")
         except Exception as e:
-            logger.error(f"Unexpected error while closing connection to {self.port}: {e}")
-        finally:
-            try:
-                self.quit()  # Gracefully terminate the thread
-                self.wait()  # Ensure thread termination before cleanup
-                logger.info("Wifi Worker thread exited successfully.")
-            except Exception as e:
-                logger.error(f"Error during thread termination: {e}")
+            logger.error(f"Error during thread termination: {e}")
 
 
     # show serial response
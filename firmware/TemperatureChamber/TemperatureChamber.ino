@@ -137,6 +137,7 @@ struct Test {
     std::vector<Sequence> sequences;
     String sketch;
     String expectedOutput;
+    unsigned int planIndex;     // position in the app's test plan, reported as current test
 };
 
 // Test variables
@@ -146,10 +147,10 @@ int currentSequenceIndex = 0;
 unsigned long sequenceStartTime = 0;
 unsigned long currentDuration = 0;
 
-// queue for tests
+// queue for tests: the app owns the test plan and only sends the running test and the next few,
+// finished tests are removed so the front of the queue is always the current one
 std::vector<Test> testQueue;
 std::vector<String> testNames;
-int currentTestIndex = 0;
 String currentTestName = "";
 
 // avoid printing ad infinitum in condition checks in loop
@@ -183,9 +184,58 @@ const unsigned long TIMEOUT_DURATION = 300000;
 
 bool displayingEmergency = false;
 
+// Binary telemetry: compact ping response frame, enabled when the handshake asks for it
+#define TELEMETRY_SYNC_1    0xA5
+#define TELEMETRY_SYNC_2    0x5A
+#define TELEMETRY_VERSION   1
+#define TELEMETRY_ALIVE     0x01
+#define TELEMETRY_RUNNING   0x02
+#define TELEMETRY_NO_TEST   0xFFFF
+
+// Layout must match telemetry.py in the python app (little-endian, no padding)
+struct __attribute__((packed)) TelemetryFrame {
+    uint8_t sync[2];
+    uint8_t version;
+    uint8_t flags;
+    uint8_t machineState;
+    uint8_t currentSequence;
+    uint16_t currentTest;       // index in the app's test plan
+    uint16_t queuedTests;
+    uint32_t timestamp;         // unix time from the RTC
+    int16_t currentTemp;        // hundredths of a degree
+    int16_t desiredTemp;        // hundredths of a degree
+    uint32_t currentDuration;   // ms
+    int32_t timeLeft;           // s
+    uint16_t crc;               // crc-16/ccitt-false over version..timeLeft
+};
+
+bool binaryTelemetry = false;
+
+// Baud rate: always boot at the default, switch to a faster one negotiated in the handshake
+#define DEFAULT_BAUD_RATE   9600
+#define BAUD_CONFIRM_TIMEOUT 2000   // ms to wait for the app to confirm a new baud rate
+#define BAUD_IDLE_TIMEOUT   90000   // ms without handshake or ping before going back to the default rate
+const unsigned long supportedBaudRates[] = {230400, 115200, 57600};
+unsigned long currentBaudRate = DEFAULT_BAUD_RATE;
+unsigned long baudSwitchTime = 0;
+bool awaitingBaudConfirm = false;
+unsigned long lastHostContact = 0;
+
+// Push-mode telemetry: stream status at a fixed interval and report state changes right away
+#define MIN_SUBSCRIPTION_INTERVAL 100   // ms
+bool subscribed = false;
+unsigned long subscriptionInterval = 0;
+unsigned long lastStatusSent = 0;
+int lastReportedStatus = -1;
+
+// Chunked test queue upload: one test per QUEUE_TEST frame, each acknowledged with the next expected seq
+#define QUEUE_UPLOAD_WINDOW 2   // frames the app may have in flight, keeps the serial rx buffer from overflowing
+unsigned int queueUploadCount = 0;
+unsigned int queueUploadNext = 0;
+
 void setup() {
     // Initialise Serial
-    Serial.begin(9600);
+    Serial.begin(DEFAULT_BAUD_RATE);
 
     // Initialize RTC
     if (!RTC.begin()) {
@@ -246,17 +296,64 @@ void setInitialTimestamp(JsonObject& commandParams) {
     }
 }
 
-void sendHandshake() {
+void sendHandshake(unsigned long baudRate) {
     StaticJsonDocument<512> handshakeDoc;
     handshakeDoc["handshake"]["timestamp"] = getCurrentTimestamp();
     handshakeDoc["handshake"]["machine_state"] = getMachineState();
     handshakeDoc["handshake"]["last_shutdown_cause"] = lastShutdownCause;
     handshakeDoc["handshake"]["last_heat_time"] = getLastHeatingTime();
+    if (binaryTelemetry) {
+        handshakeDoc["handshake"]["telemetry"] = "binary";
+    }
+    handshakeDoc["handshake"]["baud_rate"] = baudRate;    // rate used after this response
 
     serializeJson(handshakeDoc, Serial);
     Serial.println();
 }
 
+// pick the fastest rate offered by the app that this board supports
+unsigned long chooseBaudRate(JsonArray offeredRates) {
+    for (unsigned long rate : supportedBaudRates) {
+        for (JsonVariant offered : offeredRates) {
+            if (offered.as<unsigned long>() == rate) {
+                return rate;
+            }
+        }
+    }
+    return DEFAULT_BAUD_RATE;
+}
+
+void switchBaudRate(unsigned long baudRate) {
+    Serial.flush();     // let the handshake response leave at the old rate
+    Serial.end();
+    Serial.begin(baudRate);
+    currentBaudRate = baudRate;
+}
+
+void sendBaudConfirm() {
+    StaticJsonDocument<64> confirmDoc;
+    confirmDoc["baud_confirm"]["baud_rate"] = currentBaudRate;
+    serializeJson(confirmDoc, Serial);
+    Serial.println();
+}
+
+// fall back to the default rate if the app never confirmed the new one
+void checkBaudConfirmTimeout() {
+    if (awaitingBaudConfirm && millis() - baudSwitchTime > BAUD_CONFIRM_TIMEOUT) {
+        awaitingBaudConfirm = false;
+        switchBaudRate(DEFAULT_BAUD_RATE);
+    }
+}
+
+// a restarted app, or one that missed the confirmation, may talk at another rate: when nothing it understands
+// has arrived for a while, go back to the default rate, where a new handshake always starts
+void checkBaudIdleTimeout() {
+    if (currentBaudRate != DEFAULT_BAUD_RATE && millis() - lastHostContact > BAUD_IDLE_TIMEOUT) {
+        awaitingBaudConfirm = false;
+        switchBaudRate(DEFAULT_BAUD_RATE);
+    }
+}
+
 float getTemperature() {
     float roomTemperature = 0;
     sensors1.setWaitForConversion(false);
@@ -352,35 +449,90 @@ void queueTest(const Test& test, const String& testName) {
     testNames.push_back(testName);
 }
 
+// parse one test and add it to the queue, false if it is missing its sequences
+bool parseAndQueueTest(const String& testName, JsonObject& testJson, unsigned int planIndex) {
+    // check for required fields
+    if (!testJson.containsKey("chamber_sequences")) {
+        Serial.println("Error: Missing 'chamber_sequences' in test data");
+        return false;
+    }
+    Test newTest;
+    JsonArray sequences = testJson["chamber_sequences"];
+
+    newTest.sketch = testJson["sketch"].as<String>();
+    newTest.expectedOutput = testJson["expected_output"].as<String>();
+    newTest.planIndex = planIndex;
+
+    for (JsonObject sequence : sequences) {
+        if (!sequence.containsKey("temp") || !sequence.containsKey("duration")) {
+            Serial.println("Error: Missing 'temp' or 'duration' in JSON sequence");
+            break;  // Other sequences will not be queued if a sequence is missing key values
+        }
+        Sequence newSequence;
+
+        newSequence.targetTemp = sequence["temp"].as<float>();
+        newSequence.duration = sequence["duration"].as<unsigned long>();
+        newTest.sequences.push_back(newSequence);
+    }
+    queueTest(newTest, testName);
+    return true;
+}
+
 // parse tests and add to queue by name
 void parseAndQueueTests(JsonObject& tests) {
     for (JsonPair testPair : tests) {
         JsonObject testJson = testPair.value().as<JsonObject>();
-        // check for required fields
-        if (!testJson.containsKey("chamber_sequences")) {
-            Serial.println("Error: Missing 'chamber_sequences' in test data");
-            continue;
-        }
-        Test newTest;
-        String testName = testPair.key().c_str();
-        JsonArray sequences = testJson["chamber_sequences"];
+        parseAndQueueTest(String(testPair.key().c_str()), testJson, testQueue.size());
+    }
+}
 
-        newTest.sketch = testJson["sketch"].as<String>();
-        newTest.expectedOutput = testJson["expected_output"].as<String>();
+// start a chunked upload, the app sends QUEUE_TEST frames once it has the answer
+void beginQueueUpload(JsonObject& commandParams) {
+    StaticJsonDocument<96> beginDoc;
+    JsonObject begin = beginDoc.createNestedObject("queue_begin");
+    if (!systemSwitchState) {
+        begin["error"] = "system off";
+    } else {
+        queueUploadCount = commandParams["count"] | 0U;
+        queueUploadNext = 0;
+        begin["count"] = queueUploadCount;
+        begin["window"] = QUEUE_UPLOAD_WINDOW;
+    }
+    serializeJson(beginDoc, Serial);
+    Serial.println();
+}
 
-        for (JsonObject sequence : sequences) {
-            if (!sequence.containsKey("temp") || !sequence.containsKey("duration")) {
-                Serial.println("Error: Missing 'temp' or 'duration' in JSON sequence");
-                break;  // Other sequences will not be queued if a sequence is missing key values
-            }
-            Sequence newSequence;
+void sendQueueAck(unsigned int seq, const char* error) {
+    StaticJsonDocument<96> ackDoc;
+    JsonObject ack = ackDoc.createNestedObject("queue_ack");
+    ack["seq"] = seq;
+    ack["next"] = queueUploadNext;
+    if (error) {
+        ack["error"] = error;
+    }
+    serializeJson(ackDoc, Serial);
+    Serial.println();
+}
 
-            newSequence.targetTemp = sequence["temp"].as<float>();
-            newSequence.duration = sequence["duration"].as<unsigned long>();
-            newTest.sequences.push_back(newSequence);
-        }
-        queueTest(newTest, testName);
+// queue the test in a QUEUE_TEST frame, in order and only once
+void receiveQueuedTest(JsonObject& commandParams) {
+    unsigned int seq = commandParams["seq"] | 0U;
+    if (seq < queueUploadNext) {
+        sendQueueAck(seq, nullptr);     // retransmission of a frame whose ack got lost, already queued
+        return;
+    }
+    if (seq > queueUploadNext || queueUploadNext >= queueUploadCount) {
+        return;     // an earlier frame went missing, the app resends from there after its timeout
+    }
+    const char* error = nullptr;
+    JsonObject testJson = commandParams["test"];
+    if (!systemSwitchState) {
+        error = "system off";
+    } else if (!parseAndQueueTest(commandParams["name"].as<String>(), testJson, commandParams["index"] | testQueue.size())) {
+        error = "invalid test";
     }
+    queueUploadNext++;
+    sendQueueAck(seq, error);
 }
 
 void runQueue() {
@@ -390,11 +542,11 @@ void runQueue() {
 }
 
 void runNextTest() {
-    if (currentTestIndex < testQueue.size()) {
-        currentTest = testQueue[currentTestIndex];
+    if (testQueue.size() > 0) {
+        currentTest = testQueue.front();
         isTestRunning = true;
         currentSequenceIndex = 0;
-        currentTestName = testNames[currentTestIndex];
+        currentTestName = testNames.front();
         setTemperature(currentTest.sequences[currentSequenceIndex].targetTemp);
         status = EVALUATE;
     }
@@ -403,7 +555,6 @@ void runNextTest() {
 void clearTests() {
     isTestRunning = false;
     currentSequenceIndex = 0;
-    currentTestIndex = 0;
     currentTestName = "";
     sequenceStartTime = 0;
     currentDuration = 0;
@@ -435,15 +586,29 @@ void parseAndRunCommands(JsonObject& commands) {
         String command = commandPair.key().c_str();
         JsonObject commandParams = commandPair.value().as<JsonObject>();
 
+        // an emergency stop is honoured first and regardless of the system switch
+        if (command == "EMERGENCY_STOP") {
+            runEmergencyStop();
+            sendPingResponse();
+            Serial.println("Emergency Stop initiated via command.");
+            continue;
+        }
+        if (command == "BAUD_CONFIRM") {
+            awaitingBaudConfirm = false;
+            lastHostContact = millis();
+            sendBaudConfirm();
+        }
         if (command == "PING") {
             sendPingResponse();
-            lastPingTime = millis();
-            printedNoPing = false;
-            if (displayingEmergency) {
-                displayingEmergency = false;
-                lcd.clear();
-            }
-        } 
+            registerPing();
+        } else if (command == "SUBSCRIBE") {
+            startSubscription(commandParams);
+            registerPing();
+        } else if (command == "QUEUE_BEGIN") {
+            beginQueueUpload(commandParams);
+        } else if (command == "QUEUE_TEST") {
+            receiveQueuedTest(commandParams);
+        }
         if (!systemSwitchState) {
             return;
         }
@@ -467,11 +632,58 @@ void parseAndRunCommands(JsonObject& commands) {
             clearTests();
             displayingEmergency = false;
             status = IDLE;
-        } else if (command == "EMERGENCY_STOP") {
-            runEmergencyStop();
-            sendPingResponse();
-            Serial.println("Emergency Stop initiated via command.");
-        } 
+        }
+    }
+}
+
+// any sign of life from the app resets the connection timeout
+void registerPing() {
+    lastPingTime = millis();
+    lastHostContact = lastPingTime;
+    printedNoPing = false;
+    if (displayingEmergency) {
+        displayingEmergency = false;
+        lcd.clear();
+    }
+}
+
+void startSubscription(JsonObject& commandParams) {
+    unsigned long interval = commandParams["interval"] | 0UL;
+    subscribed = interval > 0;
+    subscriptionInterval = max(interval, (unsigned long)MIN_SUBSCRIPTION_INTERVAL);
+
+    StaticJsonDocument<64> subscribedDoc;
+    subscribedDoc["subscribed"]["interval"] = subscribed ? subscriptionInterval : 0;
+    serializeJson(subscribedDoc, Serial);
+    Serial.println();
+
+    if (subscribed) {
+        sendPingResponse();
+        lastStatusSent = millis();
+        lastReportedStatus = status;
+    }
+}
+
+void sendStateEvent() {
+    StaticJsonDocument<64> eventDoc;
+    eventDoc["event"]["machine_state"] = getMachineState();
+    serializeJson(eventDoc, Serial);
+    Serial.println();
+}
+
+// send status on state changes and every subscription interval
+void streamTelemetry() {
+    if (!subscribed) {
+        return;
+    }
+    if (status != lastReportedStatus) {
+        lastReportedStatus = status;
+        sendStateEvent();
+        sendPingResponse();
+        lastStatusSent = millis();
+    } else if (millis() - lastStatusSent >= subscriptionInterval) {
+        sendPingResponse();
+        lastStatusSent = millis();
     }
 }
 
@@ -483,7 +695,52 @@ void runEmergencyStop() {
     }
 }
 
+uint16_t crc16(const uint8_t* data, size_t length) {
+    uint16_t crc = 0xFFFF;
+    for (size_t i = 0; i < length; i++) {
+        crc ^= (uint16_t)data[i] << 8;
+        for (int bit = 0; bit < 8; bit++) {
+            crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+        }
+    }
+    return crc;
+}
+
+uint32_t getUnixTimestamp() {
+    RTCTime now;
+    if (RTC.getTime(now)) {
+        return now.getUnixTime();
+    }
+    return 0;
+}
+
+void sendTelemetryFrame() {
+    TelemetryFrame frame;
+    Sequence currentSequence = currentTest.sequences[currentSequenceIndex];
+
+    frame.sync[0] = TELEMETRY_SYNC_1;
+    frame.sync[1] = TELEMETRY_SYNC_2;
+    frame.version = TELEMETRY_VERSION;
+    frame.flags = TELEMETRY_ALIVE | (isTestRunning ? TELEMETRY_RUNNING : 0);
+    frame.machineState = status;
+    frame.currentSequence = currentSequenceIndex + 1;
+    frame.currentTest = currentTestName.isEmpty() ? TELEMETRY_NO_TEST : currentTest.planIndex;
+    frame.queuedTests = testQueue.size();
+    frame.timestamp = getUnixTimestamp();
+    frame.currentTemp = (int16_t)(chamberState.temperatureRoom * 100);
+    frame.desiredTemp = (int16_t)(chamberState.temperatureDesired * 100);
+    frame.currentDuration = currentDuration;
+    frame.timeLeft = getTimeLeft(currentDuration, currentSequence);
+    frame.crc = crc16(&frame.version, sizeof(TelemetryFrame) - 4);
+
+    Serial.write((const uint8_t*)&frame, sizeof(TelemetryFrame));
+}
+
 void sendPingResponse() {
+    if (binaryTelemetry) {
+        sendTelemetryFrame();
+        return;
+    }
     StaticJsonDocument<512> responseDoc;
     Sequence currentSequence = currentTest.sequences[currentSequenceIndex];
 
@@ -547,8 +804,19 @@ String getMachineState() {
 void parseTextFromJson(JsonDocument& doc) {
     if (doc.containsKey("handshake")) {
         JsonObject handshake = doc["handshake"];
+        binaryTelemetry = handshake["telemetry"] == "binary";
+        unsigned long baudRate = currentBaudRate;
+        if (handshake.containsKey("baud_rates")) {
+            baudRate = chooseBaudRate(handshake["baud_rates"].as<JsonArray>());
+        }
         setInitialTimestamp(handshake);
-        sendHandshake();
+        lastHostContact = millis();
+        sendHandshake(baudRate);
+        if (baudRate != currentBaudRate) {
+            switchBaudRate(baudRate);
+            baudSwitchTime = millis();
+            awaitingBaudConfirm = true;
+        }
         printedTestsCleared = false;
         lastShutdownCause = "";
     } else if (doc.containsKey("tests") && systemSwitchState) {     // if json consists of tests
@@ -712,13 +980,17 @@ void runTestSequence() {
         Serial.println(currentTestName);
         isTestRunning = false;
 
+        // Drop the finished test, the app sends the next ones as the queue drains
+        if (testQueue.size() > 0) {
+            testQueue.erase(testQueue.begin());
+            testNames.erase(testNames.begin());
+        }
         // Proceed to next test if available
-        if (currentTestIndex >= testQueue.size()) {
-            Serial.print("All tests completed!");
+        if (testQueue.size() == 0) {
+            Serial.println("All tests completed!");
             clearTests();
             return;
         }
-        currentTestIndex++;
         runNextTest();
     }
 }
@@ -775,10 +1047,14 @@ void runCurrentSequence() {
 
 
 void readAndParseSerial() {
-    if (Serial.available() > 0) {
+    // handle every line that has arrived, so a command is never stuck behind others for a whole loop
+    while (Serial.available() > 0) {
         // Read the incoming data in chunks instead of one character at a time
         int len = Serial.readBytesUntil('\n', incomingString, sizeof(incomingString) - 1);
         incomingString[len] = '\0'; // null-terminate the string
+        if (len == 0) {
+            continue;   // blank line, e.g. the separator in front of an emergency stop
+        }
 
         DeserializationError error = deserializeJson(jsonBuffer, incomingString);
         if (error) {
@@ -786,7 +1062,7 @@ void readAndParseSerial() {
             Serial.println(error.f_str());
             Serial.println("Resetting buffer.");
             incomingString[0] = '\0';
-            return;
+            continue;
         }
         parseTextFromJson(jsonBuffer);
         incomingString[0] = '\0';
@@ -813,6 +1089,7 @@ void loop() {
             printedTestsCleared = true;
         }
         displayingEmergency = true;
+        subscribed = false;     // nobody is listening anymore
         runEmergencyStop();
     }
 
@@ -838,6 +1115,9 @@ void loop() {
     }
 
     readAndParseSerial();   // check serial input for new tests or commands
+    checkBaudConfirmTimeout();
+    checkBaudIdleTimeout();
+    streamTelemetry();
     if (isTestRunning) {
         runTestSequence();
     }